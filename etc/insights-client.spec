@@ -81,10 +81,16 @@ ln -sf /etc/insights-client/machine-id /etc/redhat-access-insights/machine-id
 if [ "$1" -eq 0 ]; then
 rm -f /etc/cron.daily/insights-client
 rm -f /etc/cron.weekly/insights-client
+rm -f /etc/cron.d/insights-client
+rm -f /etc/insights-client/.splay
+rm -f /etc/insights-client/.dockerpull
+rm -rf /var/lib/insights-client/spool
+rm -rf /var/lib/insights-client/image-cache
 rm -f /etc/insights-client/.cache*
 rm -f /etc/insights-client/.registered
 rm -f /etc/insights-client/.unregistered
 rm -f /etc/insights-client/.lastupload
+rm -f /etc/insights-client/.uploadstats
 # remove symlink to old name on uninstall
 rm -f %{_bindir}/redhat-access-insights
 # remove symlinks to old configs
@@ -9,13 +9,12 @@ import logging
 import logging.handlers
 import optparse
 import os
-import requests
 import shutil
 import sys
 import time
 import traceback
 import atexit
-from auto_config import try_auto_configuration
+from lazy_import import LazyModule, lazy
 from utilities import (validate_remove_file,
                        generate_machine_id,
                        generate_analysis_target_id,
@@ -27,22 +26,42 @@ from utilities import (validate_remove_file,
                        delete_machine_id,
                        determine_hostname,
                        modify_config_file)
-from collection_rules import InsightsConfig
-from data_collector import DataCollector
-from schedule import InsightsSchedule
-from connection import InsightsConnection
-from archive import InsightsArchive
-from support import InsightsSupport, registration_check
 from constants import InsightsConstants as constants
-from containers import (open_image,
-                        open_container,
-                        get_targets,
-                        run_in_container,
-                        insights_client_container_is_available,
-                        docker_display_name,
-                        container_image_links)
 from client_config import InsightsClient, set_up_options, parse_config_file
 
+# everything else is loaded on first use, so options that exit early
+# don't pay for requests, the collector or the docker probes
+requests = LazyModule('requests')
+try_auto_configuration = lazy('auto_config', 'try_auto_configuration')
+InsightsConfig = lazy('collection_rules', 'InsightsConfig')
+DataCollector = lazy('data_collector', 'DataCollector')
+InsightsSchedule = lazy('schedule', 'InsightsSchedule')
+get_connection = lazy('connection', 'get_connection')
+RetryPolicy = lazy('retry', 'RetryPolicy')
+UploadSpool = lazy('spool', 'UploadSpool')
+BulkUploader = lazy('bulk_upload', 'BulkUploader')
+find_archives = lazy('bulk_upload', 'find_archives')
+DedupArchive = lazy('dedup', 'DedupArchive')
+TargetPipeline = lazy('target_pipeline', 'TargetPipeline')
+ImageCache = lazy('image_cache', 'ImageCache')
+rules_key = lazy('image_cache', 'rules_key')
+InsightsArchive = lazy('archive', 'InsightsArchive')
+InsightsSupport = lazy('support', 'InsightsSupport')
+registration_check = lazy('support', 'registration_check')
+open_image = lazy('containers', 'open_image')
+open_container = lazy('containers', 'open_container')
+get_targets = lazy('containers', 'get_targets')
+run_in_container = lazy('containers', 'run_in_container')
+insights_client_container_is_available = lazy('containers', 'insights_client_container_is_available')
+docker_display_name = lazy('containers', 'docker_display_name')
+container_image_links = lazy('containers', 'container_image_links')
+release_mounts = lazy('containers', 'release_mounts')
+listed_images = lazy('containers', 'listed_images')
+saved_image_targets = lazy('containers', 'saved_image_targets')
+open_saved_image = lazy('containers', 'open_saved_image')
+rootfs_targets = lazy('rootfs', 'rootfs_targets')
+open_rootfs = lazy('rootfs', 'open_rootfs')
+
 __author__ = 'Jeremy Crafts <jcrafts@redhat.com>, Dan Varga <dvarga@redhat.com>'
 
 LOG_FORMAT = ("%(asctime)s %(levelname)s %(message)s")
@@ -142,16 +161,29 @@ def handle_startup():
         modify_config_file({'no_schedule': 'True'})
         sys.exit()
 
+    if InsightsClient.options.scheduled:
+        cron = InsightsSchedule(set_cron=False)
+        if not cron.is_due():
+            logger.debug('Scheduled run already done for this slot, exiting')
+            sys.exit()
+
     # do auto_config here, for connection-related 'do X and exit' options
     if InsightsClient.config.getboolean(APP_NAME, 'auto_config') and not InsightsClient.options.offline:
         # Try to discover if we are connected to a satellite or not
         try_auto_configuration()
 
     if InsightsClient.options.test_connection:
-        pconn = InsightsConnection()
+        pconn = get_connection()
         rc = pconn.test_connection()
         sys.exit(rc)
 
+    if InsightsClient.options.drain_spool:
+        pconn = get_connection()
+        sys.exit(UploadSpool().drain(pconn))
+
+    if InsightsClient.options.bulk_upload:
+        sys.exit(bulk_upload(InsightsClient.options.bulk_upload))
+
     if InsightsClient.options.status:
         reg_check = registration_check()
         logger.info('\n'.join(reg_check['messages']))
@@ -181,6 +213,9 @@ def handle_startup():
         if cron.already_linked():
             cron.remove_scheduling()
             logger.debug('Automatic scheduling for Insights has been disabled.')
+    else:
+        # pick up changes to the splay settings
+        InsightsSchedule(set_cron=False).refresh()
 
     # ----modifier options----
     if InsightsClient.options.no_gpg:
@@ -199,6 +234,14 @@ def handle_startup():
         logger.error('Invalid combination: --container and --no-tar-file')
         sys.exit(1)
 
+    if InsightsClient.options.image_archives and InsightsClient.options.no_tar_file:
+        logger.error('Invalid combination: --image-archive and --no-tar-file')
+        sys.exit(1)
+
+    if InsightsClient.options.rootfs and InsightsClient.options.no_tar_file:
+        logger.error('Invalid combination: --rootfs and --no-tar-file')
+        sys.exit(1)
+
     # can't use bofa
     if InsightsClient.options.from_stdin and InsightsClient.options.from_file:
         logger.error('Can\'t use both --from-stdin and --from-file.')
@@ -210,7 +253,7 @@ def handle_startup():
     # ----register options----
     # put this first to avoid conflicts with register
     if InsightsClient.options.unregister:
-        pconn = InsightsConnection()
+        pconn = get_connection()
         pconn.unregister()
         sys.exit()
 
@@ -357,7 +400,7 @@ def register():
         if save.lower() == 'y' or save.lower() == 'yes':
             logger.debug('Writing user/pass to config')
             modify_config_file({'username': username, 'password': password})
-    pconn = InsightsConnection()
+    pconn = get_connection()
     return pconn.register()
 
 
@@ -371,6 +414,13 @@ def _delete_archive(archive):
         archive.delete_tmp_dir()
 
 
+def _multiple_targets():
+    # images and containers are collected along with the host
+    return bool(InsightsClient.options.container_mode or
+                InsightsClient.options.image_archives or
+                InsightsClient.options.rootfs)
+
+
 def _create_metadata_json(archives):
     metadata = {'display_name': archives[-1]['display_name'],
                 'product': 'Docker',
@@ -380,7 +430,9 @@ def _create_metadata_json(archives):
     # host archive is appended to the end of the targets array,
     #   so it will always be the last one (index -1)
     docker_links = []
-    c_i_links = container_image_links()
+    c_i_links = {}
+    if InsightsClient.options.container_mode:
+        c_i_links = container_image_links() or {}
     for a in archives:
         system = {}
         if a['type'] == 'host':
@@ -403,6 +455,136 @@ def _create_metadata_json(archives):
     return metadata
 
 
+def _open_target(t):
+    """
+    Open a collection target
+    Returns (container connection, mountpoint, logging name, archive metadata),
+    or None if it could not be opened
+    """
+    container_connection = None
+    mp = None
+    archive_meta = {}
+    if t['type'] in ('docker_image', 'docker_container'):
+        if 'archive' in t:
+            container_connection = open_saved_image(t['archive'], t['name'])
+            logging_name = 'Docker image %s from %s' % (t['name'], t['archive'])
+        elif 'rootfs' in t:
+            container_connection = open_rootfs(t['rootfs'])
+            logging_name = 'Root file system ' + t['rootfs']
+        elif t['type'] == 'docker_image':
+            container_connection = open_image(t['name'])
+            logging_name = 'Docker image ' + t['name']
+        else:
+            container_connection = open_container(t['name'])
+            logging_name = 'Docker container ' + t['name']
+        archive_meta['docker_id'] = t['name']
+        if 'display_name' in t:
+            archive_meta['display_name'] = t['display_name']
+        else:
+            archive_meta['display_name'] = docker_display_name(t['name'], t['type'].replace('docker_', ''))
+        logger.debug('Docker display_name: %s', archive_meta['display_name'])
+        logger.debug('Docker docker_id: %s', archive_meta['docker_id'])
+        if container_connection:
+            try:
+                mp = container_connection.get_fs()
+            except Exception:
+                container_connection.close()
+                raise
+        else:
+            logger.error('Could not open %s for analysis', logging_name)
+            return None
+    elif t['type'] == 'host':
+        logging_name = determine_hostname()
+        archive_meta['display_name'] = determine_hostname(InsightsClient.options.display_name)
+    else:
+        logger.error('Unexpected analysis target: %s', t['type'])
+        return None
+
+    archive_meta['type'] = t['type'].replace('docker_', '')
+    archive_meta['product'] = 'Docker'
+    archive_meta['system_id'] = generate_analysis_target_id(t['type'], t['name'])
+    return container_connection, mp, logging_name, archive_meta
+
+
+def _close_target(opened):
+    container_connection = opened[0]
+    if container_connection:
+        container_connection.close()
+
+
+def _cacheable_image(t):
+    # only images from docker, named by their digest they never change,
+    # and the cache is pruned against docker's image listing; saved images
+    # and unpacked root file systems aren't in it
+    return t['type'] == 'docker_image' and 'archive' not in t and 'rootfs' not in t
+
+
+def _cached_images(image_cache, cache_key, targets):
+    """
+    Split off the images already collected and uploaded under these rules
+    Returns the targets still to collect and the cached archive metadata
+    """
+    image_ids = listed_images()
+    if image_ids:
+        # only against a full listing, never drop the cache because
+        # docker could not be asked or had no images
+        image_cache.prune(image_ids)
+    remaining = []
+    cached = []
+    for t in targets:
+        archive_meta = None
+        if _cacheable_image(t):
+            archive_meta = image_cache.lookup(t['name'], cache_key)
+        if archive_meta is None:
+            remaining.append(t)
+            continue
+        # tags can move between images, look the name up again
+        archive_meta['display_name'] = (t.get('display_name') or
+                                        docker_display_name(t['name'], 'image'))
+        cached.append(archive_meta)
+    if cached:
+        if InsightsClient.config.getboolean(APP_NAME, 'image_cache_upload'):
+            logger.info('Reusing the archives of %d unchanged images', len(cached))
+        else:
+            logger.info('Skipping %d images unchanged since the last upload', len(cached))
+    return remaining, cached
+
+
+def _collect_target(t, opened, collection_rules, rm_conf, branch_info, collection_elapsed):
+    """
+    Collect from an opened target
+    Returns (archive, archive metadata with the tarball, logging name, duration)
+    """
+    container_connection, mp, logging_name, archive_meta = opened
+    layers = None
+    if hasattr(container_connection, 'get_layers'):
+        layers = container_connection.get_layers()
+
+    collection_start = time.time()
+    archive = InsightsArchive(compressor=InsightsClient.options.compressor if not _multiple_targets() else "none",
+                              target_name=t['name'])
+    atexit.register(_delete_archive, archive)
+    dc = DataCollector(archive,
+                       mountpoint=mp,
+                       target_name=t['name'],
+                       target_type=t['type'],
+                       layers=layers)
+
+    logger.info('Starting to collect Insights data for %s', logging_name)
+    dc.run_collection(collection_rules, rm_conf, branch_info)
+    elapsed = (time.time() - collection_start)
+    logger.debug("Data collection complete. Elapsed time: %s", elapsed)
+
+    # include rule refresh time in the duration
+    collection_duration = (time.time() - collection_start) + collection_elapsed
+
+    if InsightsClient.options.no_tar_file:
+        archive_meta['tar_file'] = None
+    else:
+        archive_meta['tar_file'] = dc.done(collection_rules, rm_conf)
+    return archive, archive_meta, logging_name, collection_duration
+
+
 def collect_data_and_upload(rc=0):
     """
     All the heavy lifting done here
@@ -415,13 +597,19 @@ def collect_data_and_upload(rc=0):
         targets = targets + constants.default_target
     else:
         targets = constants.default_target
+    if InsightsClient.options.image_archives:
+        # images in docker save tarballs, read without docker
+        targets = saved_image_targets(InsightsClient.options.image_archives) + targets
+    if InsightsClient.options.rootfs:
+        # unpacked trees, collected like images
+        targets = rootfs_targets(InsightsClient.options.rootfs) + targets
 
     if InsightsClient.options.offline:
         logger.warning("Assuming remote branch and leaf value of -1")
         pconn = None
         branch_info = constants.default_branch_info
     else:
-        pconn = InsightsConnection()
+        pconn = get_connection()
 
     # TODO: change these err msgs to be more meaningful , i.e.
     # "could not determine login information"
@@ -464,100 +652,78 @@ def collect_data_and_upload(rc=0):
                      ('--from-file' if InsightsClient.options.from_file else '--from-stdin'))
         sys.exit(1)
 
-    start = time.clock()
+    start = time.time()
     collection_rules, rm_conf = pc.get_conf(InsightsClient.options.update, stdin_config)
-    collection_elapsed = (time.clock() - start)
+    collection_elapsed = (time.time() - start)
     logger.debug("Rules configuration loaded. Elapsed time: %s", collection_elapsed)
 
-    individual_archives = []
-
-    for t in targets:
-        # defaults
-        archive = None
-        container_connection = None
-        mp = None
-        obfuscate = None
-        # archive metadata
-        archive_meta = {}
+    def collect(t, opened):
+        return _collect_target(t, opened, collection_rules, rm_conf,
+                               branch_info, collection_elapsed)
 
+    image_cache = None
+    cached = []
+    if (InsightsClient.options.container_mode and
+            InsightsClient.config.getboolean(APP_NAME, 'image_cache')):
+        image_cache = ImageCache()
+        cache_key = rules_key(collection_rules, rm_conf, branch_info,
+                              InsightsClient.config.getboolean(APP_NAME, 'obfuscate'),
+                              InsightsClient.config.getboolean(APP_NAME, 'obfuscate_hostname'))
+        targets, cached = _cached_images(image_cache, cache_key, targets)
+
+    if _multiple_targets():
+        # mount the next targets while others are being collected
+        pipeline = TargetPipeline(
+            _open_target, collect, _close_target,
+            workers=InsightsClient.config.getint(APP_NAME, 'container_workers'),
+            max_mounts=InsightsClient.config.getint(APP_NAME, 'container_max_mounts'))
         try:
-            if t['type'] == 'docker_image':
-                container_connection = open_image(t['name'])
-                logging_name = 'Docker image ' + t['name']
-                archive_meta['docker_id'] = t['name']
-                archive_meta['display_name'] = docker_display_name(t['name'], t['type'].replace('docker_', ''))
-                logger.debug('Docker display_name: %s', archive_meta['display_name'])
-                logger.debug('Docker docker_id: %s', archive_meta['docker_id'])
-                if container_connection:
-                    mp = container_connection.get_fs()
-                else:
-                    logger.error('Could not open %s for analysis', logging_name)
-                    continue
-            elif t['type'] == 'docker_container':
-                container_connection = open_container(t['name'])
-                logging_name = 'Docker container ' + t['name']
-                archive_meta['docker_id'] = t['name']
-                archive_meta['display_name'] = docker_display_name(t['name'], t['type'].replace('docker_', ''))
-                logger.debug('Docker display_name: %s', archive_meta['display_name'])
-                logger.debug('Docker docker_id: %s', archive_meta['docker_id'])
-                if container_connection:
-                    mp = container_connection.get_fs()
-                else:
-                    logger.error('Could not open %s for analysis', logging_name)
-                    continue
-            elif t['type'] == 'host':
-                logging_name = determine_hostname()
-                archive_meta['display_name'] = determine_hostname(InsightsClient.options.display_name)
-            else:
-                logger.error('Unexpected analysis target: %s', t['type'])
-                continue
-
-            archive_meta['type'] = t['type'].replace('docker_', '')
-            archive_meta['product'] = 'Docker'
-            archive_meta['system_id'] = generate_analysis_target_id(t['type'], t['name'])
-
-            collection_start = time.clock()
-            archive = InsightsArchive(compressor=InsightsClient.options.compressor if not InsightsClient.options.container_mode else "none",
-                                      target_name=t['name'])
-            atexit.register(_delete_archive, archive)
-            dc = DataCollector(archive,
-                               mountpoint=mp,
-                               target_name=t['name'],
-                               target_type=t['type'])
-
-            logger.info('Starting to collect Insights data for %s', logging_name)
-            dc.run_collection(collection_rules, rm_conf, branch_info)
-            elapsed = (time.clock() - start)
-            logger.debug("Data collection complete. Elapsed time: %s", elapsed)
-
-            obfuscate = InsightsClient.config.getboolean(APP_NAME, "obfuscate")
-
-            # include rule refresh time in the duration
-            collection_duration = (time.clock() - collection_start) + collection_elapsed
-
-            if InsightsClient.options.no_tar_file:
-                logger.info('See Insights data in %s', dc.archive.archive_dir)
-                return rc
-
-            tar_file = dc.done(collection_rules, rm_conf)
-
-            # add archives to list of individual uploads
-            archive_meta['tar_file'] = tar_file
-            individual_archives.append(archive_meta)
-
+            results = pipeline.run(targets)
         finally:
-            # called on loop iter end or unexpected exit
-            if container_connection:
-                container_connection.close()
+            # images shared between targets stay mounted until now
+            release_mounts()
+    else:
+        results = []
+        for t in targets:
+            opened = _open_target(t)
+            if opened is None:
+                continue
+            try:
+                results.append(collect(t, opened))
+            finally:
+                _close_target(opened)
+
+    individual_archives = [result[1] for result in results]
+    if cached and InsightsClient.config.getboolean(APP_NAME, 'image_cache_upload'):
+        individual_archives = cached + individual_archives
+    # the host is always the last target
+    archive, archive_meta, logging_name, collection_duration = results[-1]
+    tar_file = archive_meta['tar_file']
+    obfuscate = InsightsClient.config.getboolean(APP_NAME, "obfuscate")
+
+    if InsightsClient.options.no_tar_file:
+        logger.info('See Insights data in %s', archive.archive_dir)
+        return rc
 
     # if multiple targets (container mode), add all archives to single archive
-    if InsightsClient.options.container_mode:
+    if _multiple_targets():
         full_archive = InsightsArchive(compressor=InsightsClient.options.compressor)
-        for a in individual_archives:
-            shutil.copy(a['tar_file'], full_archive.archive_dir)
+        dedup = None
+        if InsightsClient.config.getboolean(APP_NAME, 'dedup_container_archives'):
+            # store each file once across all the targets
+            dedup = DedupArchive(full_archive.archive_dir)
+            for a in individual_archives:
+                dedup.add_target(a['tar_file'], a['system_id'])
+            dedup.log_savings()
+        else:
+            # the target archives are already in /var/tmp, link rather than copy them
+            for a in individual_archives:
+                full_archive.link_file(a['tar_file'])
         # don't want insights_commands in meta archive
         shutil.rmtree(full_archive.cmd_dir)
         metadata = _create_metadata_json(individual_archives)
+        if dedup:
+            metadata['archive_format'] = dedup.format
         full_archive.add_metadata_to_archive(json.dumps(metadata), 'metadata.json')
         full_tar_file = full_archive.create_tar_file(full_archive=True)
     # if only one target (regular mode), just upload one
@@ -571,6 +737,12 @@ def collect_data_and_upload(rc=0):
 
     # do the upload
     rc = _do_upload(pconn, full_tar_file, logging_name, collection_duration)
+    if image_cache and rc == 0:
+        # only the images collected this time, the rest are cached already
+        cacheable = set(t['name'] for t in targets if _cacheable_image(t))
+        for result in results:
+            if result[1]['type'] == 'image' and result[1]['docker_id'] in cacheable:
+                image_cache.store(result[1]['docker_id'], cache_key, result[1])
 
     if InsightsClient.options.keep_archive:
         logger.info('Insights data retained in %s', full_tar_file)
@@ -582,31 +754,70 @@ def collect_data_and_upload(rc=0):
     return rc
 
 
+def bulk_upload(path):
+    """
+    Upload the archives in a directory or manifest, each to its own system
+    """
+    try:
+        archives = find_archives(path)
+    except (IOError, OSError, ValueError) as e:
+        logger.error('Could not read %s: %s', path, e)
+        return 1
+    if not archives:
+        logger.error('No archives found in %s', path)
+        return 1
+    uploader = BulkUploader(get_connection(),
+                            workers=InsightsClient.options.bulk_workers,
+                            retries=InsightsClient.options.retries)
+    return uploader.run(archives)
+
+
 def _do_upload(pconn, tar_file, logging_name, collection_duration, rc=0):
     # do the upload
     logger.info('Uploading Insights data for %s, this may take a few minutes', logging_name)
+    spool = None
+    if InsightsClient.config.getboolean(APP_NAME, 'spool_uploads'):
+        # a failed upload is queued, so don't hold up the run for long
+        spool = UploadSpool()
+        policy = RetryPolicy(InsightsClient.options.retries,
+                             max_total=constants.spool_retry_max_total)
+    else:
+        policy = RetryPolicy(InsightsClient.options.retries)
     for tries in range(InsightsClient.options.retries):
-        upload = pconn.upload_archive(tar_file, collection_duration,
-                                      cluster=generate_machine_id(
-                                          docker_group=InsightsClient.options.container_mode))
-        if upload.status_code == 201:
+        upload = None
+        error = None
+        try:
+            upload = pconn.upload_archive(tar_file, collection_duration,
+                                          cluster=generate_machine_id(
+                                              docker_group=_multiple_targets()))
+        except requests.ConnectionError as e:
+            error = e
+        if upload is not None and upload.status_code == 201:
             write_lastupload_file()
             logger.info("Upload completed successfully!")
+            if spool:
+                # the uplink is back, send anything left from earlier runs
+                spool.drain(pconn)
             break
-        elif upload.status_code == 412:
+        elif upload is not None and upload.status_code == 412:
             pconn.handle_fail_rcs(upload)
         else:
-            logger.error("Upload attempt %d of %d failed! Status Code: %s",
-                         tries + 1, InsightsClient.options.retries, upload.status_code)
-            if tries + 1 != InsightsClient.options.retries:
-                logger.info("Waiting %d seconds then retrying",
-                            constants.sleep_time)
-                time.sleep(constants.sleep_time)
+            logger.error("Upload attempt %d of %d failed! Reason: %s",
+                         tries + 1, InsightsClient.options.retries,
+                         policy.reason(upload, error))
+            delay = policy.next_delay(tries, upload)
+            if delay is not None:
+                logger.info("Waiting %d seconds then retrying", delay)
+                time.sleep(delay)
             else:
                 logger.error("All attempts to upload have failed!")
+                if spool:
+                    spool.add(tar_file, logging_name, collection_duration,
+                              _multiple_targets())
                 logger.error("Please see %s for additional information",
                              constants.default_log_file)
                 rc = 1
+                break
     return rc
 
 
@@ -652,11 +863,16 @@ def _main():
     logger.debug("Version: " + constants.version)
 
     # Handle all the options
+    started = time.time()
     handle_startup()
 
     # Vaccuum up the data
     rc = collect_data_and_upload()
 
+    if not rc and InsightsClient.options.scheduled:
+        # only once it worked, a failed run is tried again at the next catch-up
+        InsightsSchedule(set_cron=False).mark_run(started)
+
     # Roll log over on successful upload
     if not rc:
         handler.doRollover()
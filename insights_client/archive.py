@@ -4,11 +4,17 @@ Handle adding files and preparing the archive for upload
 import tempfile
 import time
 import os
+import errno
 import shutil
 import subprocess
 import shlex
 import logging
-from utilities import determine_hostname, _expand_paths, write_data_to_file
+from utilities import (determine_hostname,
+                       _expand_paths,
+                       write_data_to_file,
+                       read_upload_throughput)
+from compression import compression_threads, compress_stream, choose_compressor
+from client_config import InsightsClient
 from constants import InsightsConstants as constants
 from insights_spec import InsightsFile, InsightsCommand
 
@@ -35,6 +41,8 @@ class InsightsArchive(object):
         self.archive_dir = self.create_archive_dir()
         self.cmd_dir = self.create_command_dir()
         self.compressor = compressor
+        # None is the compressor's default level
+        self.compression_level = None
 
     def create_archive_dir(self):
         """
@@ -88,6 +96,24 @@ class InsightsArchive(object):
                 logger.debug("File %s does not exist", path)
                 return False
 
+    def link_file(self, path):
+        """
+        Put an existing file at the top of the archive dir,
+        hardlinked if it is on the same filesystem, copied otherwise
+        Raises OSError if a file of that name is already there
+        """
+        dest = os.path.join(self.archive_dir, os.path.basename(path))
+        try:
+            os.link(path, dest)
+            logger.debug("Linked %s to %s", path, dest)
+        except OSError as e:
+            # only copy when it can't be linked, never over another file
+            if e.errno not in (errno.EXDEV, errno.EPERM):
+                raise
+            logger.debug("Copying %s to %s", path, dest)
+            shutil.copyfile(path, dest)
+        return dest
+
     def copy_dir(self, path):
         """
         Recursively copy directory
@@ -113,22 +139,66 @@ class InsightsArchive(object):
         """
         Create tar file to be compressed
         """
+        # for the docker "uber archive,"use archive_dir
+        #   rather than tmp_dir for all the files we tar,
+        #   because all the individual archives are in there
+        source_dir = self.tmp_dir if not full_archive else self.archive_dir
+        threads = 1
+        if self.compressor in ("gz", "bz2", "xz", "auto"):
+            threads = compression_threads(
+                InsightsClient.config.getint(constants.app_name, 'compression_threads'))
+        if self.compressor == "auto":
+            self.compressor, self.compression_level = choose_compressor(
+                source_dir, threads, read_upload_throughput())
         tar_file_name = os.path.join(self.tmp_dir, self.archive_name)
         ext = "" if self.compressor == "none" else ".%s" % self.compressor
         tar_file_name = tar_file_name + ".tar" + ext
         logger.debug("Tar File: " + tar_file_name)
-        subprocess.call(shlex.split("tar c%sfS %s -C %s ." % (
-            self.get_compression_flag(self.compressor),
-            tar_file_name,
-            # for the docker "uber archive,"use archive_dir
-            #   rather than tmp_dir for all the files we tar,
-            #   because all the individual archives are in there
-            self.tmp_dir if not full_archive else self.archive_dir)),
-            stderr=subprocess.PIPE)
+        start = time.time()
+        compressed = False
+        if self.compressor == "none":
+            threads = 1
+        elif threads > 1 or self.compression_level is not None:
+            try:
+                self._create_parallel(tar_file_name, source_dir, threads)
+                compressed = True
+            except (IOError, OSError) as e:
+                logger.debug("Parallel compression failed (%s), using tar", e)
+                threads = 1
+        if not compressed:
+            subprocess.call(shlex.split("tar c%sfS %s -C %s ." % (
+                self.get_compression_flag(self.compressor),
+                tar_file_name,
+                source_dir)),
+                stderr=subprocess.PIPE)
+        logger.debug("Tar File created with %s level %s on %d thread(s) in %.2f seconds",
+                     self.compressor, self.compression_level or 'default',
+                     max(threads, 1), time.time() - start)
         self.delete_archive_dir()
         logger.debug("Tar File Size: %s", str(os.path.getsize(tar_file_name)))
         return tar_file_name
 
+    def _create_parallel(self, tar_file_name, source_dir, threads):
+        """
+        Pipe an uncompressed tar through the multi-threaded compressor,
+        also used for a single thread when a level was chosen
+        """
+        # tar skips its own output file when it writes it, but here it
+        #   can't tell, and the tar file may be inside source_dir
+        exclude = "./" + os.path.basename(tar_file_name)
+        with open(os.devnull, 'w') as devnull:
+            tar = subprocess.Popen(shlex.split("tar cfS - --exclude=%s -C %s ." % (
+                exclude, source_dir)), stdout=subprocess.PIPE, stderr=devnull)
+            try:
+                compress_stream(tar.stdout, tar_file_name, self.compressor, threads,
+                                self.compression_level)
+            finally:
+                tar.stdout.close()
+                rc = tar.wait()
+        # 1 is "some files changed while being read", like the tar c path allows
+        if rc > 1:
+            raise OSError('tar exited with %d' % rc)
+
     def delete_tmp_dir(self):
         """
         Delete the entire tmp dir
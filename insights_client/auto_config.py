@@ -6,7 +6,7 @@ import os
 import requests
 from constants import InsightsConstants as constants
 from cert_auth import rhsmCertificate
-from connection import InsightsConnection
+from connection import get_connection
 from client_config import InsightsClient
 
 logger = logging.getLogger(constants.app_name)
@@ -21,7 +21,7 @@ def verify_connectivity():
     for item, value in InsightsClient.config.items(APP_NAME):
         if item != 'password' and item != 'proxy' and item != 'systemid':
             logger.debug("%s:%s", item, value)
-    ic = InsightsConnection()
+    ic = get_connection()
     try:
         branch_info = ic.branch_info()
     except requests.ConnectionError as e:
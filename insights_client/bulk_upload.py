@@ -0,0 +1,189 @@
+"""
+Upload many archives collected elsewhere, e.g. on a relay host
+"""
+import os
+import json
+import time
+import shlex
+import tarfile
+import logging
+import threading
+import Queue
+import requests
+from subprocess import Popen, PIPE
+from constants import InsightsConstants as constants
+from retry import RetryPolicy, THROTTLE_CODES
+
+logger = logging.getLogger(constants.app_name)
+
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+MACHINE_ID_MEMBER = 'insights_data/machine-id'
+# archives read with tar rather than tarfile, by their extension
+TAR_FLAGS = {'.xz': 'J', '.bz2': 'j'}
+
+
+def find_archives(path):
+    """
+    Archives to upload from a directory, or from a manifest file listing
+    one archive per line, optionally followed by the machine-id to use
+    Returns a list of (archive path, machine-id or None)
+    """
+    if os.path.isdir(path):
+        return [(os.path.join(path, name), None)
+                for name in sorted(os.listdir(path))
+                if name.endswith(ARCHIVE_SUFFIXES)]
+    base = os.path.dirname(os.path.abspath(path))
+    archives = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = shlex.split(line)
+            archive = os.path.join(base, fields[0])
+            archives.append((archive, fields[1] if len(fields) > 1 else None))
+    return archives
+
+
+def _read_members(path, wanted):
+    """
+    Contents of the first member matching wanted(name), or None
+    """
+    flag = TAR_FLAGS.get(os.path.splitext(path)[1])
+    if flag:
+        # python 2 tarfile can't read xz, nor bzip2 written on several
+        #   threads, let tar do it
+        proc = Popen(['tar', '-t%sf' % flag, path], stdout=PIPE, stderr=PIPE)
+        names = proc.communicate()[0].splitlines()
+        for name in names:
+            if wanted(name):
+                proc = Popen(['tar', '-x%sOf' % flag, path, name], stdout=PIPE, stderr=PIPE)
+                return proc.communicate()[0]
+        return None
+    with tarfile.open(path, 'r:*') as tar:
+        for member in tar:
+            if member.isfile() and wanted(member.name):
+                return tar.extractfile(member).read()
+    return None
+
+
+def archive_machine_id(path):
+    """
+    machine-id an archive was collected for, read from inside the archive
+    An uber archive from container mode carries its docker group id
+    in metadata.json, a single archive has insights_data/machine-id
+    """
+    data = _read_members(
+        path, lambda name: (name.lstrip('./') == 'metadata.json' or
+                            name.endswith('/' + MACHINE_ID_MEMBER)))
+    if data is None:
+        return None
+    data = data.strip()
+    if data.startswith('{'):
+        return json.loads(data).get('system_id')
+    return data
+
+
+class BulkUploader(object):
+    """
+    Upload a batch of archives over one shared connection
+    with a pool of worker threads
+    """
+    def __init__(self, pconn, workers=constants.bulk_upload_workers, retries=1):
+        self.pconn = pconn
+        self.workers = max(1, workers)
+        self.retries = max(1, retries)
+        self.results = []
+        self.lock = threading.Lock()
+
+    def _upload_one(self, archive, machine_id):
+        result = {'archive': archive,
+                  'machine_id': machine_id,
+                  'status': None,
+                  'attempts': 0,
+                  'error': None}
+        try:
+            if machine_id is None:
+                machine_id = archive_machine_id(archive)
+                result['machine_id'] = machine_id
+            if not machine_id:
+                result['error'] = 'no machine-id found in archive'
+                return result
+            result['size'] = os.path.getsize(archive)
+        except (IOError, OSError, ValueError, tarfile.TarError) as e:
+            result['error'] = 'could not read archive: %s' % e
+            return result
+
+        policy = RetryPolicy(self.retries)
+        for attempt in range(self.retries):
+            result['attempts'] += 1
+            upload = None
+            error = None
+            try:
+                # relayed archives say nothing about this host's uplink,
+                # and workers would race writing the stats file
+                upload = self.pconn.upload_archive(archive, '0', cluster=machine_id,
+                                                   record_stats=False)
+            except requests.ConnectionError as e:
+                error = e
+            if upload is not None:
+                result['status'] = upload.status_code
+                if upload.status_code == 201:
+                    result['error'] = None
+                    return result
+            result['error'] = policy.reason(upload, error)
+            if (upload is not None and upload.status_code < 500 and
+                    upload.status_code not in THROTTLE_CODES):
+                # the server won't change its mind about this one
+                return result
+            delay = policy.next_delay(attempt, upload)
+            if delay is None:
+                break
+            logger.debug("Retrying %s in %d seconds: %s",
+                         archive, delay, result['error'])
+            time.sleep(delay)
+        return result
+
+    def _worker(self, queue):
+        while True:
+            try:
+                archive, machine_id = queue.get_nowait()
+            except Queue.Empty:
+                return
+            result = self._upload_one(archive, machine_id)
+            if result['error']:
+                logger.error("Upload of %s failed: %s", archive, result['error'])
+            else:
+                logger.info("Uploaded %s for %s", archive, result['machine_id'])
+            with self.lock:
+                self.results.append(result)
+
+    def run(self, archives):
+        """
+        Upload every (archive, machine-id) pair, returns 0 if all succeeded
+        """
+        queue = Queue.Queue()
+        for item in archives:
+            queue.put(item)
+        workers = min(self.workers, len(archives))
+        self.pconn.set_pool_size(workers)
+        logger.info("Uploading %d archives with %d workers", len(archives), workers)
+        start = time.time()
+        threads = [threading.Thread(target=self._worker, args=(queue,))
+                   for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.report(time.time() - start)
+        return 0 if all(not r['error'] for r in self.results) else 1
+
+    def report(self, elapsed):
+        uploaded = [r for r in self.results if not r['error']]
+        failed = [r for r in self.results if r['error']]
+        size = sum(r.get('size', 0) for r in uploaded)
+        logger.info("Bulk upload finished in %.1f seconds: %d uploaded (%d bytes), "
+                    "%d failed", elapsed, len(uploaded), size, len(failed))
+        for r in sorted(failed, key=lambda r: r['archive']):
+            logger.error("  %s (machine-id %s): %s after %d attempt(s)",
+                         r['archive'], r['machine_id'], r['error'], r['attempts'])
@@ -48,11 +48,31 @@ def set_up_options(parser):
     parser.add_option('--retry',
                       action="store",
                       type="int",
-                      help=('Number of times to retry uploading. '
-                            '%s seconds between tries'
-                            % constants.sleep_time),
+                      help=('Number of times to try uploading. '
+                            'Waits up to %s seconds between tries, '
+                            'backing off exponentially, and stops retrying '
+                            'after %s seconds in total'
+                            % (constants.retry_max_delay, constants.retry_max_total)),
                       default=1,
                       dest="retries")
+    parser.add_option('--drain-spool',
+                      help='Upload archives queued by earlier failed uploads and exit',
+                      action="store_true",
+                      dest="drain_spool",
+                      default=False)
+    parser.add_option('--bulk-upload',
+                      help=('Upload every archive in a directory, or listed in a '
+                            'manifest file, to the system it was collected on'),
+                      action="store",
+                      dest="bulk_upload",
+                      metavar="PATH")
+    parser.add_option('--bulk-workers',
+                      help=('Number of archives to upload at once with --bulk-upload, '
+                            'defaults to %d' % constants.bulk_upload_workers),
+                      action="store",
+                      type="int",
+                      dest="bulk_workers",
+                      default=constants.bulk_upload_workers)
     parser.add_option('--validate',
                       help='Validate remove.conf',
                       action="store_true",
@@ -90,7 +110,8 @@ def set_up_options(parser):
                       action='store_true')
     parser.add_option('--compressor',
                       help='specify alternate compression '
-                           'algorithm (gz, bzip2, xz, none; defaults to gz)',
+                           'algorithm (gz, bz2, xz, none, or auto to pick '
+                           'by CPU speed and upload throughput; defaults to gz)',
                       dest='compressor',
                       default='gz')
     parser.add_option('--from-stdin',
@@ -111,6 +132,23 @@ def set_up_options(parser):
                            'along with the host.',
                       action='store_true',
                       dest='container_mode')
+    parser.add_option('--image-archive',
+                      help='Analyze the images in a docker save tarball '
+                           'along with the host, without docker. '
+                           'May be given more than once.',
+                      action='append',
+                      dest='image_archives',
+                      default=[],
+                      metavar='PATH')
+    parser.add_option('--rootfs',
+                      help='Analyze unpacked root file systems like images, '
+                           'along with the host: a directory, a glob '
+                           'matching directories, or a manifest file '
+                           'listing one per line. May be given more than once.',
+                      action='append',
+                      dest='rootfs',
+                      default=[],
+                      metavar='PATH')
     group = optparse.OptionGroup(parser, "Debug options")
     parser.add_option('--version',
                       help="Display version",
@@ -190,6 +228,13 @@ def set_up_options(parser):
                      help=optparse.SUPPRESS_HELP,
                      action='store',
                      dest='just_upload')
+    # passed by the splayed cron job, exits unless this machine's
+    #  daily slot has come around
+    group.add_option('--scheduled',
+                     help=optparse.SUPPRESS_HELP,
+                     action='store_true',
+                     dest='scheduled',
+                     default=False)
     parser.add_option_group(group)
 
 
@@ -211,6 +256,7 @@ def parse_config_file(conf_file):
          'collection_rules_url': None,
          'obfuscate': 'False',
          'obfuscate_hostname': 'False',
+         'compression_threads': '1',
          'cert_verify': constants.default_ca_file,
          'gpg': 'True',
          'username': '',
@@ -218,8 +264,24 @@ def parse_config_file(conf_file):
          'systemid': None,
          'proxy': None,
          'insecure_connection': 'False',
+         'resumable_upload': 'False',
+         'upload_bandwidth': '0',
+         'upload_bandwidth_schedule': None,
          'no_schedule': 'False',
+         'splay_window': '0',
+         'splay_start': '00:00',
+         'splay_catch_up': 'True',
+         'spool_uploads': 'False',
+         'spool_max_age': '7',
+         'spool_max_archives': '5',
          'docker_image_name': '',
+         'docker_pull_ttl': '86400',
+         'dedup_container_archives': 'False',
+         'container_workers': '2',
+         'container_max_mounts': '3',
+         'image_cache': 'True',
+         'image_cache_upload': 'True',
+         'read_layers': 'False',
          'display_name': None})
     try:
         parsedconfig.read(conf_file)
@@ -0,0 +1,293 @@
+"""
+Multi-threaded compression of the archive tarball
+"""
+import os
+import bz2
+import time
+import zlib
+import math
+import threading
+import subprocess
+import multiprocessing
+import logging
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except IOError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """
+    CPUs allowed by the cgroup CPU quota, or None if there is no quota
+    """
+    cpu_max = _read_first_line(CGROUP_V2_CPU_MAX)
+    if cpu_max:
+        quota, _, period = cpu_max.partition(' ')
+        if quota == 'max':
+            return None
+        try:
+            return float(quota) / float(period or 100000)
+        except ValueError:
+            return None
+    quota = _read_first_line(CGROUP_V1_QUOTA)
+    period = _read_first_line(CGROUP_V1_PERIOD)
+    try:
+        quota = int(quota)
+        period = int(period)
+    except (TypeError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return float(quota) / period
+
+
+def compression_threads(configured=0):
+    """
+    Threads to compress with, at most the CPUs we are allowed to use
+    0 means use all of them
+    """
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, int(math.ceil(quota)))
+    if configured > 0:
+        cpus = min(cpus, configured)
+    return max(1, cpus)
+
+
+DEFAULT_LEVELS = {'gz': 6, 'bz2': 9, 'xz': 6}
+
+# what the auto compressor picks from: (compressor, level)
+AUTO_CANDIDATES = (('none', None), ('gz', 1), ('gz', 6),
+                   ('bz2', 9), ('xz', 1), ('xz', 6))
+
+
+def _gzip_block(data, level):
+    # a complete gzip member
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _bzip2_block(data, level):
+    return bz2.compress(data, level)
+
+
+def _xz_block(data, level):
+    proc = subprocess.Popen(['xz', '-%d' % level, '-c'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate(data)
+    if proc.returncode != 0:
+        raise OSError('xz failed: %s' % err.strip())
+    return out
+
+
+BLOCK_COMPRESSORS = {'gz': _gzip_block,
+                     'bz2': _bzip2_block,
+                     'xz': _xz_block}
+
+# whole streams on one thread, for readers that stop after the first
+#   member, like python 2's bz2 and so tarfile
+STREAM_COMPRESSORS = {
+    'gz': lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    'bz2': lambda level: bz2.BZ2Compressor(level)}
+
+
+def sample_tar(source_dir, size):
+    """
+    The first size bytes of the uncompressed tar stream of source_dir
+    """
+    with open(os.devnull, 'w') as devnull:
+        tar = subprocess.Popen(['tar', 'cfS', '-', '-C', source_dir, '.'],
+                               stdout=subprocess.PIPE, stderr=devnull)
+        data = tar.stdout.read(size)
+        tar.stdout.close()
+        if tar.poll() is None:
+            tar.terminate()
+        tar.wait()
+    return data
+
+
+def tree_size(source_dir):
+    """
+    Total size of the files under source_dir
+    """
+    total = 0
+    for root, dirs, files in os.walk(source_dir):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def choose_compressor(source_dir, threads, throughput,
+                      sample_size=constants.compression_sample_size):
+    """
+    Pick the (compressor, level) with the lowest estimated time to
+    compress the whole archive on threads threads and upload it at
+    throughput bytes/s, from the ratio and speed seen on a sample
+    Falls back to gz when there is no throughput history yet
+    """
+    if not throughput:
+        logger.debug("No upload throughput recorded yet, using gz")
+        return 'gz', None
+    sample = sample_tar(source_dir, sample_size)
+    if not sample:
+        return 'gz', None
+    total = max(tree_size(source_dir), len(sample))
+    best = None
+    for compressor, level in AUTO_CANDIDATES:
+        if compressor == 'none':
+            ratio = 1.0
+            compress_time = 0.0
+        else:
+            start = time.time()
+            try:
+                compressed = BLOCK_COMPRESSORS[compressor](sample, level)
+            except OSError as e:
+                logger.debug("Skipping %s: %s", compressor, e)
+                continue
+            elapsed = max(time.time() - start, 0.0001)
+            ratio = float(len(compressed)) / len(sample)
+            compress_time = total * elapsed / len(sample) / threads
+        estimate = compress_time + total * ratio / throughput
+        logger.debug("auto compressor: %s level %s ratio %.3f, estimated "
+                     "%.1fs to compress and %.1fs to upload", compressor, level,
+                     ratio, compress_time, total * ratio / throughput)
+        if best is None or estimate < best[0]:
+            best = (estimate, compressor, level)
+    logger.debug("auto compressor picked %s level %s", best[1], best[2])
+    return best[1], best[2]
+
+
+class BlockCompressor(object):
+    """
+    Compress a stream in fixed-size blocks on a pool of threads and
+    write the results in order as concatenated gzip or bzip2 members,
+    which gunzip, bunzip2 and tar read as a single stream
+    zlib and bz2 release the GIL while they work
+    """
+    def __init__(self, compressor, threads, block_size=constants.compression_block_size,
+                 level=None):
+        self.compress_block = BLOCK_COMPRESSORS[compressor]
+        self.level = level or DEFAULT_LEVELS[compressor]
+        self.threads = threads
+        self.block_size = block_size
+        self.cond = threading.Condition()
+        self.pending = []
+        self.done = {}
+        self.error = None
+        self.finished = False
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.finished:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                index, data = self.pending.pop(0)
+                self.cond.notify_all()
+            try:
+                result = self.compress_block(data, self.level)
+            except Exception as e:
+                result = None
+                with self.cond:
+                    self.error = e
+            with self.cond:
+                self.done[index] = result
+                self.cond.notify_all()
+
+    def compress(self, src, dest):
+        """
+        Read src until EOF and write the compressed stream to dest
+        Returns the number of uncompressed bytes
+        """
+        workers = [threading.Thread(target=self._worker) for i in range(self.threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        # blocks read but not yet written, bounds memory use
+        max_in_flight = self.threads * 2
+        read_index = 0
+        write_index = 0
+        total = 0
+        eof = False
+        try:
+            while not eof or write_index < read_index:
+                with self.cond:
+                    while (write_index not in self.done and
+                           (eof or read_index - write_index >= max_in_flight) and
+                           self.error is None):
+                        self.cond.wait()
+                    if self.error is not None:
+                        raise self.error
+                    ready = write_index in self.done
+                    result = self.done.pop(write_index, None)
+                if ready:
+                    dest.write(result)
+                    write_index += 1
+                    continue
+                data = src.read(self.block_size)
+                if not data:
+                    eof = True
+                    continue
+                total += len(data)
+                with self.cond:
+                    self.pending.append((read_index, data))
+                    self.cond.notify_all()
+                read_index += 1
+        finally:
+            with self.cond:
+                self.finished = True
+                del self.pending[:]
+                self.cond.notify_all()
+        for worker in workers:
+            worker.join()
+        return total
+
+
+def compress_stream(src, dest_path, compressor, threads, level=None):
+    """
+    Compress the tar stream src into dest_path using threads threads
+    xz is handed to xz -T, which splits the stream into blocks itself,
+    gz and bz2 are a single member on one thread
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[compressor]
+    if compressor == 'xz':
+        with open(dest_path, 'wb') as dest:
+            proc = subprocess.Popen(['xz', '-%d' % level, '-T', str(threads), '-c'],
+                                    stdin=src, stdout=dest,
+                                    stderr=subprocess.PIPE)
+            err = proc.communicate()[1]
+        if proc.returncode != 0:
+            raise OSError('xz failed: %s' % err.strip())
+        return os.path.getsize(dest_path)
+    with open(dest_path, 'wb') as dest:
+        if threads > 1:
+            BlockCompressor(compressor, threads, level=level).compress(src, dest)
+        else:
+            stream = STREAM_COMPRESSORS[compressor](level)
+            while True:
+                data = src.read(constants.compression_block_size)
+                if not data:
+                    break
+                dest.write(stream.compress(data))
+            dest.write(stream.flush())
+    return os.path.getsize(dest_path)
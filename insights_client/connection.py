@@ -5,15 +5,21 @@ import requests
 import sys
 import os
 import json
+import time
+import hashlib
 
 import traceback
 import logging
+from urlparse import urljoin
 from utilities import (determine_hostname,
                        generate_machine_id,
                        delete_unregistered_file,
                        write_unregistered_file,
-                       write_registered_file)
+                       write_registered_file,
+                       write_upload_throughput)
 from cert_auth import rhsmCertificate
+from upload_stream import MultipartFileEncoder, LimitedBody
+from ratelimit import TokenBucket, BandwidthLimit, parse_rate, parse_schedule
 from constants import InsightsConstants as constants
 from client_config import InsightsClient
 
@@ -43,6 +49,25 @@ if os.environ.get('INSIGHTS_DEBUG_HTTP'):
     requests_log.propagate = True
 
 
+class ProxyAuthAdapter(requests.adapters.HTTPAdapter):
+
+    """
+    Transport adapter that adds Proxy-Authorization to the headers
+    urllib3 uses when it builds a proxy connection pool
+    """
+
+    __attrs__ = requests.adapters.HTTPAdapter.__attrs__ + ['proxy_auth']
+
+    def __init__(self, proxy_auth, *args, **kwargs):
+        self.proxy_auth = proxy_auth
+        super(ProxyAuthAdapter, self).__init__(*args, **kwargs)
+
+    def proxy_headers(self, proxy):
+        headers = super(ProxyAuthAdapter, self).proxy_headers(proxy)
+        headers['Proxy-Authorization'] = self.proxy_auth
+        return headers
+
+
 class InsightsConnection(object):
 
     """
@@ -82,6 +107,11 @@ class InsightsConnection(object):
             self.branch_info_url = self.base_url + "/v1/branch_info"
         self.authmethod = InsightsClient.config.get(APP_NAME, 'authmethod')
         self.systemid = InsightsClient.config.get(APP_NAME, 'systemid')
+        self.resumable_upload = InsightsClient.config.getboolean(APP_NAME, 'resumable_upload')
+        self.resumable_chunk_size = constants.resumable_chunk_size
+        # flipped off the first time the server turns a session down
+        self.resumable_supported = True
+        self.upload_limiter = self._get_upload_limiter()
         self.get_proxies()
         self._validate_hostnames()
         self.session = self._init_session()
@@ -89,6 +119,26 @@ class InsightsConnection(object):
         # tuple of self-signed cert flag & cert chain list
         self.cert_chain = (False, [])
 
+    def _get_upload_limiter(self):
+        """
+        Token bucket for upload bandwidth, None if uploads are unlimited
+        """
+        rate = InsightsClient.config.get(APP_NAME, 'upload_bandwidth')
+        schedule = InsightsClient.config.get(APP_NAME, 'upload_bandwidth_schedule')
+        try:
+            rate = parse_rate(rate)
+            if schedule:
+                schedule = parse_schedule(schedule, rate)
+        except ValueError:
+            logger.error("ERROR: Invalid upload_bandwidth or upload_bandwidth_schedule "
+                         "in %s", constants.default_conf_file)
+            sys.exit(1)
+        if not rate and not schedule:
+            return None
+        logger.debug("Upload bandwidth limited to %s bytes/s%s", rate,
+                     ' on schedule' if schedule else '')
+        return TokenBucket(BandwidthLimit(rate, schedule))
+
     def _init_session(self):
         """
         Set up the session, auth is handled here
@@ -111,25 +161,23 @@ class InsightsConnection(object):
         session.proxies = self.proxies
         session.trust_env = False
         if self.proxy_auth:
-            # HACKY
-            try:
-                # Need to make a request that will fail to get proxies set up
-                session.request(
-                    "GET", "https://cert-api.access.redhat.com/r/insights")
-            except requests.ConnectionError:
-                pass
-            # Major hack, requests/urllib3 does not make access to
-            # proxy_headers easy
-            proxy_mgr = session.adapters['https://'].proxy_manager[self.proxies['https']]
-            auth_map = {'Proxy-Authorization': self.proxy_auth}
-            proxy_mgr.proxy_headers = auth_map
-            proxy_mgr.connection_pool_kw['_proxy_headers'] = auth_map
-            conns = proxy_mgr.pools._container
-            for conn in conns:
-                connection = conns[conn]
-                connection.proxy_headers = auth_map
+            # send the proxy credentials with every proxy pool we create
+            session.mount('https://', ProxyAuthAdapter(self.proxy_auth))
         return session
 
+    def set_pool_size(self, size):
+        """
+        Keep up to size connections alive per host, for concurrent uploads
+        """
+        if size <= requests.adapters.DEFAULT_POOLSIZE:
+            return
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=size))
+        if self.proxy_auth:
+            adapter = ProxyAuthAdapter(self.proxy_auth, pool_maxsize=size)
+        else:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=size)
+        self.session.mount('https://', adapter)
+
     def get_proxies(self):
         """
         Determine proxy configuration
@@ -667,10 +715,163 @@ class InsightsConnection(object):
         else:
             return (message, client_hostname, "None", "")
 
-    def upload_archive(self, data_collected, duration, cluster=None):
+    def _archive_digest(self, path):
+        """
+        sha256 of a file, read in chunks
+        """
+        digest = hashlib.sha256()
+        with open(path, 'rb') as archive:
+            for block in iter(lambda: archive.read(constants.upload_chunk_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _resumable_session(self, upload_url, data_collected, duration, size, digest):
+        """
+        Find or create the resumable upload session for an archive
+        The session url is kept next to the archive so a later attempt,
+        or a later run, resumes the same session
+        Returns None if the server does not support resumable uploads
+        """
+        state_file = data_collected + '.upload'
+        if os.path.isfile(state_file):
+            try:
+                with open(state_file) as state_fp:
+                    state = json.load(state_fp)
+                if state['size'] == size and state['sha256'] == digest:
+                    logger.debug("Resuming upload session %s", state['url'])
+                    return state['url']
+            except (IOError, ValueError, LookupError):
+                logger.debug("Ignoring unreadable upload state %s", state_file)
+        data = json.dumps({'filename': os.path.basename(data_collected),
+                           'size': size,
+                           'sha256': digest})
+        headers = {'Content-Type': 'application/json',
+                   'x-rh-collection-time': duration}
+        res = self.session.post(upload_url + '/resumable', headers=headers, data=data)
+        logger.debug("POST upload session status: %s", res.status_code)
+        if res.status_code in (404, 405, 415, 501):
+            logger.debug("Server does not support resumable uploads")
+            self.resumable_supported = False
+            return None
+        if res.status_code not in (200, 201) or 'Location' not in res.headers:
+            logger.debug("Could not create upload session: %s %s",
+                         res.status_code, res.text)
+            return None
+        session_url = urljoin(upload_url, res.headers['Location'])
+        with open(state_file, 'w') as state_fp:
+            json.dump({'url': session_url, 'size': size, 'sha256': digest}, state_fp)
+        return session_url
+
+    def _upload_offset(self, session_url):
+        """
+        Ask the server how many bytes of the session it has
+        Returns (offset, response), offset is None unless the server
+        answered 2xx with an Upload-Offset
+        """
+        res = self.session.head(session_url)
+        if not 200 <= res.status_code < 300:
+            return None, res
+        try:
+            return int(res.headers['Upload-Offset']), res
+        except (LookupError, ValueError):
+            return None, res
+
+    def _upload_resumable(self, data_collected, duration, upload_url):
+        """
+        Upload the archive in fixed-size chunks, each with its own digest,
+        resuming from the last offset the server acknowledged on failure
+        Returns the final response, or None to fall back to a single POST
+        """
+        state_file = data_collected + '.upload'
+        size = os.path.getsize(data_collected)
+        digest = self._archive_digest(data_collected)
+
+        session_url = None
+        res = None
+        error = None
+        failures = 0
+        offset = None
+        with open(data_collected, 'rb') as archive:
+            while True:
+                error = None
+                try:
+                    # creating the session is retried like any chunk
+                    if session_url is None:
+                        session_url = self._resumable_session(
+                            upload_url, data_collected, duration, size, digest)
+                        if session_url is None:
+                            return None
+                    if offset is None:
+                        offset, res = self._upload_offset(session_url)
+                        if res.status_code == 404:
+                            logger.debug("Upload session %s expired, starting over", session_url)
+                            os.remove(state_file)
+                            session_url = None
+                            continue
+                        if offset is not None:
+                            logger.debug("Server has %d of %d bytes", offset, size)
+                    if offset is not None:
+                        archive.seek(offset)
+                        chunk = archive.read(self.resumable_chunk_size)
+                        headers = {'Content-Type': 'application/offset+octet-stream',
+                                   'Upload-Offset': str(offset),
+                                   'Upload-Checksum': 'sha256 ' + hashlib.sha256(chunk).hexdigest()}
+                        data = chunk
+                        if self.upload_limiter:
+                            data = LimitedBody(chunk, self.upload_limiter)
+                        res = self.session.patch(session_url, data=data, headers=headers)
+                except requests.ConnectionError as e:
+                    res = None
+                    error = e
+                # without an offset the server's answer was to the HEAD,
+                # which is a failed attempt, never a finished upload
+                if offset is not None and res is not None and res.status_code in (200, 201):
+                    break
+                if offset is not None and res is not None and res.status_code == 204:
+                    offset = int(res.headers.get('Upload-Offset', offset + len(chunk)))
+                    failures = 0
+                    continue
+                failures += 1
+                logger.debug("Chunk at offset %s failed (%s), %d of %d retries",
+                             offset, error if error else res.status_code,
+                             failures, constants.resumable_chunk_retries)
+                if failures > constants.resumable_chunk_retries:
+                    if error:
+                        raise error
+                    return res
+                # renegotiate the offset before sending anything else
+                offset = None
+
+        try:
+            os.remove(state_file)
+        except OSError:
+            pass
+        return res
+
+    def upload_archive(self, data_collected, duration, cluster=None, record_stats=True):
         """
         Do an HTTPS Upload of the archive
+        record_stats=False leaves the throughput out of this host's
+        average, for archives collected elsewhere
         """
+        if cluster:
+            upload_url = self.upload_url + '/' + cluster
+        else:
+            upload_url = self.upload_url + '/' + generate_machine_id()
+
+        start = time.time()
+        if self.resumable_upload and self.resumable_supported:
+            logger.debug("Uploading %s to %s in %d byte chunks",
+                         data_collected, upload_url, self.resumable_chunk_size)
+            upload = self._upload_resumable(data_collected, duration, upload_url)
+            if upload is not None:
+                logger.debug("Upload status: %s %s %s",
+                             upload.status_code, upload.reason, upload.text)
+                self._log_throughput(os.path.getsize(data_collected), start, upload,
+                                     record_stats)
+                return upload
+            logger.debug("Falling back to a single upload request")
+
         file_name = os.path.basename(data_collected)
         try:
             import magic
@@ -683,20 +884,55 @@ class InsightsConnection(object):
             from utilities import magic_plan_b
             mime_type = magic_plan_b(data_collected)
 
-        files = {
-            'file': (file_name, open(data_collected, 'rb'), mime_type)}
-
-        if cluster:
-            upload_url = self.upload_url + '/' + cluster
-        else:
-            upload_url = self.upload_url + '/' + generate_machine_id()
-
         logger.debug("Uploading %s to %s", data_collected, upload_url)
 
-        headers = {'x-rh-collection-time': duration}
-        upload = self.session.post(upload_url, files=files, headers=headers)
+        body = MultipartFileEncoder('file', data_collected, mime_type, file_name,
+                                    limiter=self.upload_limiter)
+        headers = {'x-rh-collection-time': duration,
+                   'Content-Type': body.content_type}
+        start = time.time()
+        try:
+            upload = self.session.post(upload_url, data=body, headers=headers)
+        finally:
+            body.close()
 
         logger.debug("Upload status: %s %s %s",
                      upload.status_code, upload.reason, upload.text)
         logger.debug("Upload duration: %s", upload.elapsed)
+        self._log_throughput(len(body), start, upload, record_stats)
         return upload
+
+    def _log_throughput(self, size, start, upload, record_stats=True):
+        elapsed = max(time.time() - start, 0.001)
+        logger.info("Uploaded %d bytes in %.1f seconds (%d bytes/s%s)",
+                    size, elapsed, size / elapsed,
+                    ', limited' if self.upload_limiter else '')
+        if record_stats and upload.status_code in (200, 201):
+            # remembered for the auto compressor
+            write_upload_throughput(size / elapsed)
+
+
+# one connection (and so one pooled keep-alive session) per endpoint,
+#   shared by everything in this process that talks to the API
+_CONNECTIONS = {}
+_CONNECTION_KEY_ITEMS = ('base_url', 'upload_url', 'api_url', 'branch_info_url',
+                         'insecure_connection', 'cert_verify', 'authmethod',
+                         'username', 'password', 'systemid', 'proxy',
+                         'upload_bandwidth', 'upload_bandwidth_schedule')
+
+
+def get_connection():
+    """
+    Return the shared InsightsConnection for the configured endpoint,
+    creating it on first use
+    Auto-config may rewrite the endpoint settings, so connections are keyed
+    on everything in the config that affects where and how we connect
+    """
+    key = tuple([InsightsClient.config.get(APP_NAME, item)
+                 for item in _CONNECTION_KEY_ITEMS])
+    if key not in _CONNECTIONS:
+        _CONNECTIONS[key] = InsightsConnection()
+    else:
+        logger.debug("Reusing connection to %s",
+                     InsightsClient.config.get(APP_NAME, 'base_url'))
+    return _CONNECTIONS[key]
@@ -11,7 +11,17 @@ class InsightsConstants(object):
     log_level = 'DEBUG'
     package_path = os.path.dirname(
         os.path.dirname(os.path.abspath(__file__)))
-    sleep_time = 300
+    retry_base_delay = 60
+    retry_max_delay = 600
+    retry_max_total = 1800
+    spool_retry_max_total = 300
+    upload_chunk_size = 65536
+    resumable_chunk_size = 4 * 1024 * 1024
+    resumable_chunk_retries = 5
+    bulk_upload_workers = 4
+    compression_block_size = 1024 * 1024
+    compression_sample_size = 1024 * 1024
+    upload_stats_weight = 0.3
     user_agent = app_name + '/' + version
     default_conf_dir = '/etc/' + app_name + '/'
     log_dir = '/var/log/' + app_name
@@ -26,9 +36,21 @@ class InsightsConstants(object):
     unregistered_file = default_conf_dir + '.unregistered'
     registered_file = default_conf_dir + '.registered'
     lastupload_file = default_conf_dir + '.lastupload'
+    upload_stats_file = default_conf_dir + '.uploadstats'
+    splay_file = default_conf_dir + '.splay'
+    docker_pull_file = default_conf_dir + '.dockerpull'
+    spool_dir = '/var/lib/' + app_name + '/spool'
+    image_cache_dir = '/var/lib/' + app_name + '/image-cache'
     pub_gpg_path = default_conf_dir + 'redhattools.pub.gpg'
     machine_id_file = default_conf_dir + 'machine-id'
     docker_group_id_file = default_conf_dir + 'docker-group-id'
     default_target = [{'type': 'host', 'name': ''}]
     default_branch_info = {'remote_branch': -1, 'remote_leaf': -1}
     docker_image_name = None
+    docker_socket = '/var/run/docker.sock'
+    docker_root = '/var/lib/docker'
+    docker_api_timeout = 60
+    docker_registry_timeout = 10
+    mount_max_idle = 4
+    # mount options have to fit in a page
+    overlay_max_options = 4000
@@ -8,11 +8,21 @@
 # same thing as 'there is no docker on this machine'.
 
 import os
+import json
+import atexit
+import shutil
 import logging
 import shlex
+import tarfile
+import tempfile
 import subprocess
 
 from insights_client.constants import InsightsConstants as constants
+from insights_client.client_config import InsightsClient
+from engine_api import DockerEngineClient, DockerEngineError
+from mount_manager import MountManager
+from layer_reader import LayerReader, image_layers, container_layers
+from saved_image import SavedImage, SavedImageError, saved_images
 
 APP_NAME = constants.app_name
 logger = logging.getLogger(APP_NAME)
@@ -28,369 +38,644 @@ def run_command_very_quietly(cmdline):
         return returncode
 
 
-# Check to see if we have access to docker
-HaveDocker = False
+# Docker and atomic are probed the first time they are needed rather than
+# when this module is imported, so runs that never look at containers
+# don't pay for starting them
+HaveDocker = None
 HaveDockerException = None
-try:
-    if run_command_very_quietly("docker info") == 0:
-        # a returncode of 0 means cmd ran correctly
-        HaveDocker = True
+HaveAtomic = None
+HaveAtomicException = None
 
-except Exception as e:
-    HaveDockerException = e
 
-# Check to see if we have access to Atomic through the 'atomic' command
-HaveAtomic = False
-HaveAtomicException = None
-try:
-    if run_command_very_quietly("atomic --version") == 0:
-        # a returncode of 0 means cmd ran correctly
-        HaveAtomic = True
-    else:
-        # anything else indicates problem
+def have_docker():
+    # Check to see if we have access to docker
+    global HaveDocker, HaveDockerException
+    if HaveDocker is None:
+        HaveDocker = False
+        try:
+            if run_command_very_quietly("docker info") == 0:
+                # a returncode of 0 means cmd ran correctly
+                HaveDocker = True
+        except Exception as e:
+            HaveDockerException = e
+    return HaveDocker
+
+
+def have_atomic():
+    # Check to see if we have access to Atomic through the 'atomic' command
+    global HaveAtomic, HaveAtomicException
+    if HaveAtomic is None:
         HaveAtomic = False
-except Exception as e:
-    # this happens when atomic isn't installed or is otherwise unrunable
-    HaveAtomic = False
-    HaveAtomicException = e
+        try:
+            if run_command_very_quietly("atomic --version") == 0:
+                # a returncode of 0 means cmd ran correctly
+                HaveAtomic = True
+        except Exception as e:
+            # this happens when atomic isn't installed or is otherwise unrunable
+            HaveAtomicException = e
+    return HaveAtomic
+
+
+DockerEngine = None
+DockerEngineChecked = False
+DockerMounts = None
+# every image id get_targets found, None until a listing succeeded
+ListedImages = None
+
+
+def runcommand(cmd):
+    # this takes an array (not a string)
+    logger.debug("Running Command: %s" % cmd)
+    proc = subprocess.Popen(cmd)
+    returncode = proc.wait()
+    return returncode
+
+
+def run_command_capture_output(cmdline):
+    cmd = shlex.split(cmdline)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    (out, err) = proc.communicate()
+    return out
+
+
+def _docker_engine():
+    # one Engine API connection for the whole run, or None to use the CLI
+    global DockerEngine, DockerEngineChecked
+    if not DockerEngineChecked:
+        DockerEngineChecked = True
+        if os.path.exists(constants.docker_socket):
+            client = DockerEngineClient()
+            if client.ping():
+                DockerEngine = client
+            else:
+                logger.debug("Docker API not answering on %s, using the docker command" %
+                             constants.docker_socket)
+    return DockerEngine
 
-HaveAtomicMount = HaveAtomic
 
+def get_container_name():
+    return "insights-client"
 
-if HaveDocker:
-    import tempfile
-    import shutil
-    import json
 
-    from insights_client.client_config import InsightsClient
+def get_image_name():
+    if InsightsClient.options.docker_image_name:
+        logger.debug("found docker_image_name in options: %s" % InsightsClient.options.docker_image_name)
+        return InsightsClient.options.docker_image_name
 
-    def runcommand(cmd):
-        # this takes an array (not a string)
-        logger.debug("Running Command: %s" % cmd)
-        proc = subprocess.Popen(cmd)
-        returncode = proc.wait()
-        return returncode
+    elif InsightsClient.config.get(APP_NAME, 'docker_image_name'):
+        logger.debug("found docker_image_name in config: %s" % InsightsClient.config.get(APP_NAME, 'docker_image_name'))
+        return InsightsClient.config.get(APP_NAME, 'docker_image_name')
 
-    def run_command_capture_output(cmdline):
-        cmd = shlex.split(cmdline)
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (out, err) = proc.communicate()
-        return out
+    else:
+        logger.debug("found docker_image_name in constants: %s" % constants.docker_image_name)
+        return constants.docker_image_name
 
-    def get_container_name():
-        return "insights-client"
 
-    def get_image_name():
-        if InsightsClient.options.docker_image_name:
-            logger.debug("found docker_image_name in options: %s" % InsightsClient.options.docker_image_name)
-            return InsightsClient.options.docker_image_name
+def use_atomic_run():
+    return have_atomic()
 
-        elif InsightsClient.config.get(APP_NAME, 'docker_image_name'):
-            logger.debug("found docker_image_name in config: %s" % InsightsClient.config.get(APP_NAME, 'docker_image_name'))
-            return InsightsClient.config.get(APP_NAME, 'docker_image_name')
 
-        else:
-            logger.debug("found docker_image_name in constants: %s" % constants.docker_image_name)
-            return constants.docker_image_name
+def use_atomic_mount():
+    return have_atomic() and not InsightsClient.options.run_here
 
-    def use_atomic_run():
-        return HaveAtomic
 
-    def use_atomic_mount():
-        return HaveAtomicMount and not InsightsClient.options.run_here
+def pull_image(image):
+    return runcommand(shlex.split("docker pull") + [image])
 
-    def pull_image(image):
-        return runcommand(shlex.split("docker pull") + [image])
 
-    def insights_client_container_is_available():
-        image_name = get_image_name()
-        if image_name:
-            pull_image(image_name)
+def _image_repo_digests(image):
+    # None if the image isn't here at all
+    inspect = _docker_inspect_image(image)
+    if not inspect:
+        return None
+    return inspect.get('RepoDigests') or []
 
-            if not _docker_image_is_available(image_name):
-                logger.debug("insights-client docker image not available: %s" % image_name)
-                return False
-            else:
-                return True
-        else:
+
+def update_image(image):
+    # pull only when the registry has something newer, at most once a TTL
+    from pull_cache import PullCache
+    cache = PullCache(_image_repo_digests, pull_image,
+                      InsightsClient.config.getint(APP_NAME, 'docker_pull_ttl'))
+    return cache.update(image)
+
+
+def insights_client_container_is_available():
+    if not have_docker():
+        return _no_docker_insights_client_container_is_available()
+    image_name = get_image_name()
+    if image_name:
+        update_image(image_name)
+
+        if not _docker_image_is_available(image_name):
+            logger.debug("insights-client docker image not available: %s" % image_name)
             return False
+        else:
+            return True
+    else:
+        return False
 
-    def get_targets():
-        targets = []
-        for d in _docker_all_image_ids():
-            if InsightsClient.options.only is None or InsightsClient.options.only == d:
-                targets.append({'type': 'docker_image', 'name': d})
-        for d in _docker_all_container_ids():
-            if InsightsClient.options.only is None or InsightsClient.options.only == d:
-                targets.append({'type': 'docker_container', 'name': d})
-        return targets
-
-    def docker_display_name(docker_name, docker_type):
-        inspect = _docker_inspect_image(docker_name, docker_type)
-        if not inspect:
-            return docker_name
-
-        if docker_type == 'image':
-            try:
-                display_name = inspect['RepoTags'][0]
-            except LookupError:
-                display_name = docker_name
-
-        if docker_type == 'container':
-            display_name = inspect['Name'].lstrip('/')
-
-        return display_name
-
-    def container_image_links():
-        from insights_client.utilities import generate_analysis_target_id
-        link_dict = {}
+
+def get_targets():
+    global ListedImages
+    if not have_docker():
+        return _no_docker_get_targets()
+    targets = []
+    image_ids = _docker_all_image_ids()
+    if image_ids is None:
+        image_ids = []
+    else:
+        ListedImages = image_ids
+    for d in image_ids:
+        if InsightsClient.options.only is None or InsightsClient.options.only == d:
+            targets.append({'type': 'docker_image', 'name': d})
+    for d in _docker_all_container_ids():
+        if InsightsClient.options.only is None or InsightsClient.options.only == d:
+            targets.append({'type': 'docker_container', 'name': d})
+    return targets
+
+
+def listed_images():
+    # all the images the last get_targets found, including those --only
+    # left out, or None if they could not be listed
+    return ListedImages
+
+
+def docker_display_name(docker_name, docker_type):
+    if not have_docker():
+        return _no_docker_docker_display_name(docker_name, docker_type)
+    engine = _docker_engine()
+    if engine:
+        try:
+            # usually answered from the listing done by get_targets
+            return engine.display_name(docker_name, docker_type)
+        except DockerEngineError as e:
+            logger.debug("Docker API error: %s" % e)
+    inspect = _docker_inspect_image(docker_name, docker_type)
+    if not inspect:
+        return docker_name
+
+    if docker_type == 'image':
+        try:
+            display_name = inspect['RepoTags'][0]
+        except LookupError:
+            display_name = docker_name
+
+    if docker_type == 'container':
+        display_name = inspect['Name'].lstrip('/')
+
+    return display_name
+
+
+def container_image_links():
+    if not have_docker():
+        return _no_docker_container_image_links()
+    from insights_client.utilities import generate_analysis_target_id
+    link_dict = {}
+    engine = _docker_engine()
+    if engine:
+        # the API has the image id, so links match the image targets
+        links = [(c['Id'], c['ImageID']) for c in engine.containers()]
+    else:
         ps_output = run_command_capture_output("docker ps --no-trunc --all")
         ps_data = ps_output.splitlines()
         ps_data.pop(0)  # remove heading
-        for l in ps_data:
-            elements = l.split()
-            c_id = elements[0]
-            i_id = elements[1]
-            link_dict[c_id] = [{'system_id': generate_analysis_target_id('docker_image', i_id),
-                               'type': 'image'}]
-            if i_id not in link_dict:
-                link_dict[i_id] = []
-            link_dict[i_id].append({'system_id': generate_analysis_target_id('docker_container', c_id),
-                                    'type': 'container'})
-        return link_dict
-
-    def run_in_container():
-
-        if InsightsClient.options.from_file:
-            logger.error('--from-file is incompatible with transfering to a container.')
-            return 1
-
-        if use_atomic_run():
-            return runcommand(["atomic", "run", "--name", get_container_name(), get_image_name(), "redhat-access-insights", "--run-here"] + InsightsClient.argv[1:])
+        links = [tuple(l.split()[:2]) for l in ps_data]
+    for c_id, i_id in links:
+        link_dict[c_id] = [{'system_id': generate_analysis_target_id('docker_image', i_id),
+                           'type': 'image'}]
+        if i_id not in link_dict:
+            link_dict[i_id] = []
+        link_dict[i_id].append({'system_id': generate_analysis_target_id('docker_container', c_id),
+                                'type': 'container'})
+    return link_dict
+
+
+def run_in_container():
+    if not have_docker():
+        return _no_docker_run_in_container()
+
+    if InsightsClient.options.from_file:
+        logger.error('--from-file is incompatible with transfering to a container.')
+        return 1
+
+    if use_atomic_run():
+        return runcommand(["atomic", "run", "--name", get_container_name(), get_image_name(), "redhat-access-insights", "--run-here"] + InsightsClient.argv[1:])
+    else:
+        run_string = _get_run_string(get_image_name(), get_container_name())
+        if not run_string:
+            logger.debug("docker RUN label not found in image " + get_image_name() + " using fallback RUN string")
+            run_string = "docker run --privileged=true -i -a stdin -a stdout -a stderr --rm -v /var/run/docker.sock:/var/run/docker.sock -v /var/lib/docker/:/var/lib/docker/ -v /dev/:/dev/ -v /etc/redhat-access-insights/:/etc/redhat-access-insights -v /etc/pki/:/etc/pki/ " + get_image_name()
+
+        docker_args = shlex.split(run_string + " redhat-access-insights")
+
+        return runcommand(docker_args + ["--run-here"] + InsightsClient.argv[1:])
+
+
+def _get_run_string(imagename, containername):
+    labelstring = _get_label(imagename, "RUN")
+    if labelstring:
+        if containername:
+            labelstring = labelstring.replace(" --name NAME", " --name " + containername)
         else:
-            run_string = _get_run_string(get_image_name(), get_container_name())
-            if not run_string:
-                logger.debug("docker RUN label not found in image " + get_image_name() + " using fallback RUN string")
-                run_string = "docker run --privileged=true -i -a stdin -a stdout -a stderr --rm -v /var/run/docker.sock:/var/run/docker.sock -v /var/lib/docker/:/var/lib/docker/ -v /dev/:/dev/ -v /etc/redhat-access-insights/:/etc/redhat-access-insights -v /etc/pki/:/etc/pki/ " + get_image_name()
+            labelstring = labelstring.replace(" --name NAME", " ")
 
-            docker_args = shlex.split(run_string + " redhat-access-insights")
+        labelstring = labelstring.replace("IMAGE", imagename)
+        return labelstring
 
-            return runcommand(docker_args + ["--run-here"] + InsightsClient.argv[1:])
+    return None
 
-    def _get_run_string(imagename, containername):
-        labelstring = _get_label(imagename, "RUN")
-        if labelstring:
-            if containername:
-                labelstring = labelstring.replace(" --name NAME", " --name " + containername)
-            else:
-                labelstring = labelstring.replace(" --name NAME", " ")
 
-            labelstring = labelstring.replace("IMAGE", imagename)
-            return labelstring
+def _get_label(imagename, label):
+    imagedata = _docker_inspect_image(imagename)
+    if imagedata:
+        idx = ("Config", "Labels", label)
+        if dictmultihas(imagedata, idx):
+            return dictmultiget(imagedata, idx)
+
+    return None
+
 
+def _docker_image_is_available(image_name):
+    if _docker_inspect_image(image_name):
+        return True
+    else:
+        return False
+
+
+class AtomicTemporaryMountPoint:
+    # this is used for both images and containers
+    def __init__(self, image_id, mount_point):
+        self.image_id = image_id
+        self.mount_point = mount_point
+
+    def get_fs(self):
+        return self.mount_point
+
+    def close(self):
+        try:
+            logger.debug("Closing Id %s On %s" % (self.image_id, self.mount_point))
+            runcommand(shlex.split("atomic unmount") + [self.mount_point])
+        except Exception as e:
+            logger.debug("exception while unmounting image or container: %s" % e)
+        shutil.rmtree(self.mount_point, ignore_errors=True)
+
+
+class DockerSharedMountPoint:
+    # this is used for both images and containers, the mount itself
+    # belongs to the run's mount manager
+    def __init__(self, manager, key, mount_point):
+        self.manager = manager
+        self.key = key
+        self.mount_point = mount_point
+
+    def get_fs(self):
+        return self.mount_point
+
+    def close(self):
+        logger.debug("Releasing Id %s On %s" % (self.key[1], self.mount_point))
+        self.manager.release(self.key)
+
+
+class DockerLayers:
+    # this is used for both images and containers, files are read from
+    # the layer directories and the tree is only mounted for commands
+    def __init__(self, kind, docker_id, layers):
+        self.key = (kind, docker_id)
+        self.mounted = False
+        self.reader = LayerReader(layers, mount=self._mount)
+
+    def get_fs(self):
+        return self.reader.root
+
+    def get_layers(self):
+        return self.reader
+
+    def _mount(self):
+        mount_point = _docker_mounts().acquire(self.key)
+        self.mounted = mount_point is not None
+        return mount_point
+
+    def close(self):
+        if self.mounted:
+            logger.debug("Releasing Id %s" % self.key[1])
+            _docker_mounts().release(self.key)
+
+
+class SavedImageTarget:
+    # an image read from a docker save tarball, no docker involved
+    def __init__(self, image):
+        self.image = image
+
+    def get_fs(self):
+        return self.image.root
+
+    def get_layers(self):
+        return self.image
+
+    def close(self):
+        self.image.close()
+
+
+def saved_image_targets(paths):
+    # docker_image targets for every image in these docker save tarballs
+    targets = []
+    for path in paths:
+        try:
+            images = saved_images(path)
+        except (IOError, tarfile.TarError, SavedImageError) as e:
+            logger.error('Could not read saved images from %s: %s' % (path, e))
+            continue
+        for image_id, display_name in images:
+            if InsightsClient.options.only is None or InsightsClient.options.only == image_id:
+                targets.append({'type': 'docker_image', 'name': image_id,
+                                'archive': path, 'display_name': display_name})
+    return targets
+
+
+def open_saved_image(path, image_id):
+    logger.debug("Indexing Image Id %s in %s" % (image_id, path))
+    try:
+        return SavedImageTarget(SavedImage(path, image_id))
+    except (IOError, tarfile.TarError, SavedImageError) as e:
+        logger.error('Could not read Image Id %s from %s: %s' % (image_id, path, e))
         return None
 
-    def _get_label(imagename, label):
-        imagedata = _docker_inspect_image(imagename)
-        if imagedata:
-            idx = ("Config", "Labels", label)
-            if dictmultihas(imagedata, idx):
-                return dictmultiget(imagedata, idx)
 
+def _open_layers(kind, docker_id):
+    # read overlay layers from disk, no daemon and no mount, if enabled
+    if not InsightsClient.config.getboolean(APP_NAME, 'read_layers'):
         return None
+    if kind == 'image':
+        layers = image_layers(docker_id)
+    else:
+        layers = container_layers(docker_id)
+    if not layers:
+        return None
+    logger.debug("Reading %s Id %s from %d layers" % (kind, docker_id, len(layers)))
+    return DockerLayers(kind, docker_id, layers)
 
-    def _docker_image_is_available(image_name):
-        if _docker_inspect_image(image_name):
-            return True
-        else:
-            return False
 
-    class AtomicTemporaryMountPoint:
-        # this is used for both images and containers
-        def __init__(self, image_id, mount_point):
-            self.image_id = image_id
-            self.mount_point = mount_point
-
-        def get_fs(self):
-            return self.mount_point
-
-        def close(self):
-            try:
-                logger.debug("Closing Id %s On %s" % (self.image_id, self.mount_point))
-                runcommand(shlex.split("atomic unmount") + [self.mount_point])
-            except Exception as e:
-                logger.debug("exception while unmounting image or container: %s" % e)
-            shutil.rmtree(self.mount_point, ignore_errors=True)
-
-    from mount import DockerMount, Mount, MountError
-
-    class DockerTemporaryMountPoint:
-        # this is used for both images and containers
-        def __init__(self, driver, image_id, mount_point, cid):
-            self.driver = driver
-            self.image_id = image_id
-            self.mount_point = mount_point
-            self.cid = cid
-
-        def get_fs(self):
-            return self.mount_point
-
-        def close(self):
-            try:
-                logger.debug("Closing Id %s On %s" % (self.image_id, self.mount_point))
-                # If using device mapper, unmount the bind-mount over the directory
-                if self.driver == 'devicemapper':
-                    Mount.unmount_path(self.mount_point)
-
-                DockerMount(self.mount_point).unmount(self.cid)
-            except Exception as e:
-                logger.debug("exception while unmounting image or container: %s" % e)
-            shutil.rmtree(self.mount_point, ignore_errors=True)
-
-    def open_image(image_id):
-        global HaveAtomicException
-        if HaveAtomicException:
-            logger.debug("atomic is either not installed or not accessable %s" % HaveAtomicException)
-            HaveAtomicException = None
-
-        if use_atomic_mount():
-            mount_point = tempfile.mkdtemp()
-            logger.debug("Opening Image Id %s On %s using atomic" % (image_id, mount_point))
-            if runcommand(shlex.split("atomic mount") + [image_id, mount_point]) == 0:
-                return AtomicTemporaryMountPoint(image_id, mount_point)
-            else:
-                logger.error('Could not mount Image Id %s On %s' % (image_id, mount_point))
-                shutil.rmtree(mount_point, ignore_errors=True)
-                return None
+def _docker_mounts():
+    # one mount manager per run, everything it mounted goes at exit
+    global DockerMounts
+    if DockerMounts is None:
+        DockerMounts = MountManager(_docker_mount, _docker_unmount)
+        atexit.register(DockerMounts.cleanup)
+    return DockerMounts
+
+
+def release_mounts():
+    # unmount everything the run's targets used, all at once
+    if DockerMounts is not None:
+        DockerMounts.cleanup()
 
-        else:
-            driver = _docker_driver()
-            if driver is None:
-                return None
-
-            mount_point = tempfile.mkdtemp()
-            logger.debug("Opening Image Id %s On %s using docker client" % (image_id, mount_point))
-            # docker mount creates a temp image
-            # we have to use this temp image id to remove the device
-            mount_point, cid = DockerMount(mount_point).mount(image_id)
-            if driver == 'devicemapper':
-                DockerMount.mount_path(os.path.join(mount_point, "rootfs"), mount_point, bind=True)
-            if cid:
-                return DockerTemporaryMountPoint(driver, image_id, mount_point, cid)
-            else:
-                logger.error('Could not mount Image Id %s On %s' % (image_id, mount_point))
-                shutil.rmtree(mount_point, ignore_errors=True)
-                return None
-
-    def open_container(container_id):
-        global HaveAtomicException
-        if HaveAtomicException:
-            logger.debug("atomic is either not installed or not accessable %s" % HaveAtomicException)
-            HaveAtomicException = None
-
-        if use_atomic_mount():
-            mount_point = tempfile.mkdtemp()
-            logger.debug("Opening Container Id %s On %s using atomic" % (container_id, mount_point))
-            if runcommand(shlex.split("atomic mount") + [container_id, mount_point]) == 0:
-                return AtomicTemporaryMountPoint(container_id, mount_point)
-            else:
-                logger.error('Could not mount Container Id %s On %s' % (container_id, mount_point))
-                shutil.rmtree(mount_point, ignore_errors=True)
-                return None
 
+def _layer_dirs(inspect):
+    # overlay layer directories of an image or container, top first
+    graph = inspect.get('GraphDriver') or {}
+    if graph.get('Name') not in ('overlay', 'overlay2'):
+        return None
+    data = graph.get('Data') or {}
+    dirs = [data.get('UpperDir')] + (data.get('LowerDir') or '').split(':')
+    return [d for d in dirs if d]
+
+
+def _mount_layers(dirs, mount_point):
+    # read-only overlay of dirs, no temporary container needed
+    options = 'ro,lowerdir=' + ':'.join(dirs)
+    if len(dirs) < 2 or len(options) > constants.overlay_max_options:
+        return False
+    return runcommand(['mount', '-t', 'overlay', '-o', options, 'overlay', mount_point]) == 0
+
+
+def _docker_mount(key, mount_point):
+    """
+    Mount an image or container for the mount manager
+    On overlay, images are mounted straight from their layers and
+    containers on top of their image's shared mount
+    """
+    kind, docker_id = key
+    driver = _docker_driver()
+    if driver is None:
+        return None
+    if driver in ('overlay', 'overlay2'):
+        inspect = _docker_inspect_image(docker_id, kind)
+        dirs = _layer_dirs(inspect) if inspect else None
+        if dirs and kind == 'image':
+            if _mount_layers(dirs, mount_point):
+                return ('layers', None)
+        elif dirs:
+            image_key = ('image', inspect['Image'])
+            image = _docker_inspect_image(inspect['Image'], 'image')
+            image_dirs = _layer_dirs(image) if image else None
+            if image_dirs and dirs[-len(image_dirs):] == image_dirs:
+                image_mount = _docker_mounts().acquire(image_key)
+                if image_mount:
+                    # the container's own layers over the image's mount
+                    own = dirs[:-len(image_dirs)]
+                    if _mount_layers(own + [image_mount], mount_point):
+                        return ('layers', image_key)
+                    _docker_mounts().release(image_key)
+        logger.debug("Mounting %s %s through a temporary container" % (kind, docker_id))
+
+    from mount import DockerMount
+    # docker mount creates a temp image
+    # we have to use this temp image id to remove the device
+    mount_point, cid = DockerMount(mount_point).mount(docker_id)
+    if not cid:
+        return None
+    if driver == 'devicemapper':
+        DockerMount.mount_path(os.path.join(mount_point, "rootfs"), mount_point, bind=True)
+    return ('docker', (driver, cid))
+
+
+def _docker_unmount(mount_point, handle):
+    how, data = handle
+    if how == 'layers':
+        runcommand(['umount', mount_point])
+        if data:
+            _docker_mounts().release(data)
+        return
+    from mount import DockerMount, Mount
+    driver, cid = data
+    # If using device mapper, unmount the bind-mount over the directory
+    if driver == 'devicemapper':
+        Mount.unmount_path(mount_point)
+    DockerMount(mount_point).unmount(cid)
+
+
+def open_image(image_id):
+    if not have_docker():
+        return _no_docker_open_image(image_id)
+    layers = _open_layers('image', image_id)
+    if layers:
+        return layers
+    global HaveAtomicException
+    atomic_mount = use_atomic_mount()
+    if HaveAtomicException:
+        logger.debug("atomic is either not installed or not accessable %s" % HaveAtomicException)
+        HaveAtomicException = None
+
+    if atomic_mount:
+        mount_point = tempfile.mkdtemp()
+        logger.debug("Opening Image Id %s On %s using atomic" % (image_id, mount_point))
+        if runcommand(shlex.split("atomic mount") + [image_id, mount_point]) == 0:
+            return AtomicTemporaryMountPoint(image_id, mount_point)
         else:
-            driver = _docker_driver()
-            if driver is None:
-                return None
-
-            mount_point = tempfile.mkdtemp()
-            logger.debug("Opening Container Id %s On %s using docker client" % (container_id, mount_point))
-            # docker mount creates a temp image
-            # we have to use this temp image id to remove the device
-            mount_point, cid = DockerMount(mount_point).mount(container_id)
-            if driver == 'devicemapper':
-                DockerMount.mount_path(os.path.join(mount_point, "rootfs"), mount_point, bind=True)
-            if cid:
-                return DockerTemporaryMountPoint(driver, container_id, mount_point, cid)
-            else:
-                logger.error('Could not mount Container Id %s On %s' % (container_id, mount_point))
-                shutil.rmtree(mount_point, ignore_errors=True)
-                return None
+            logger.error('Could not mount Image Id %s On %s' % (image_id, mount_point))
+            shutil.rmtree(mount_point, ignore_errors=True)
+            return None
 
-    def _docker_inspect_image(docker_name, docker_type):
-        a = json.loads(run_command_capture_output("docker inspect --type %s %s" % (docker_type, docker_name)))
-        if len(a) == 0:
+    else:
+        mount_point = _docker_mounts().acquire(('image', image_id))
+        if mount_point is None:
+            logger.error('Could not mount Image Id %s' % image_id)
             return None
+        logger.debug("Opening Image Id %s On %s using docker client" % (image_id, mount_point))
+        return DockerSharedMountPoint(_docker_mounts(), ('image', image_id), mount_point)
+
+
+def open_container(container_id):
+    if not have_docker():
+        return _no_docker_open_container(container_id)
+    layers = _open_layers('container', container_id)
+    if layers:
+        return layers
+    global HaveAtomicException
+    atomic_mount = use_atomic_mount()
+    if HaveAtomicException:
+        logger.debug("atomic is either not installed or not accessable %s" % HaveAtomicException)
+        HaveAtomicException = None
+
+    if atomic_mount:
+        mount_point = tempfile.mkdtemp()
+        logger.debug("Opening Container Id %s On %s using atomic" % (container_id, mount_point))
+        if runcommand(shlex.split("atomic mount") + [container_id, mount_point]) == 0:
+            return AtomicTemporaryMountPoint(container_id, mount_point)
         else:
-            return a[0]
-
-    def _docker_driver():
-        x = "Storage Driver:"
-        for each in run_command_capture_output("docker info").splitlines():
-            if each.startswith(x):
-                return each[len(x):].strip()
-        return ""
-
-    def _docker_all_image_ids():
-        l = []
-        for each in run_command_capture_output("docker images --quiet --no-trunc").splitlines():
-            if each not in l:
-                l.append(each)
-        return l
-
-    def _docker_all_container_ids():
-        l = []
-        for each in run_command_capture_output("docker ps --all --quiet --no-trunc").splitlines():
-            if each not in l:
-                l.append(each)
-        return l
-
-else:
-    # If we can't import docker then we stub out all the main functions to report errors
-
-    def insights_client_container_is_available():
-        # Don't print error here, this is the way to tell if running in a container is possible
-        # but do print debug info
-        logger.debug('not transfering to insights-client image')
-        logger.debug('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
-        return False
+            logger.error('Could not mount Container Id %s On %s' % (container_id, mount_point))
+            shutil.rmtree(mount_point, ignore_errors=True)
+            return None
 
-    def run_in_container():
-        logger.debug('Could not connect to docker to transfer into a container')
-        logger.error('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
-        return 1
+    else:
+        mount_point = _docker_mounts().acquire(('container', container_id))
+        if mount_point is None:
+            logger.error('Could not mount Container Id %s' % container_id)
+            return None
+        logger.debug("Opening Container Id %s On %s using docker client" % (container_id, mount_point))
+        return DockerSharedMountPoint(_docker_mounts(), ('container', container_id), mount_point)
 
-    def get_targets():
-        logger.debug('Could not connect to docker to collect from images and containers')
-        logger.debug('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
-        return []
 
-    def open_image(image_id):
-        logger.error('Could not connect to docker to examine image %s' % image_id)
-        logger.error('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
+def _docker_inspect_image(docker_name, docker_type='image'):
+    engine = _docker_engine()
+    if engine:
+        return engine.inspect(docker_name, docker_type)
+    a = json.loads(run_command_capture_output("docker inspect --type %s %s" % (docker_type, docker_name)))
+    if len(a) == 0:
         return None
-
-    def open_container(container_id):
-        logger.error('Could not connect to docker to examine container %s' % container_id)
-        logger.error('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
+    else:
+        return a[0]
+
+
+def _docker_driver():
+    engine = _docker_engine()
+    if engine:
+        return engine.storage_driver()
+    x = "Storage Driver:"
+    for each in run_command_capture_output("docker info").splitlines():
+        if each.startswith(x):
+            return each[len(x):].strip()
+    return ""
+
+
+def _unique(ids):
+    seen = set()
+    l = []
+    for each in ids:
+        if each not in seen:
+            seen.add(each)
+            l.append(each)
+    return l
+
+
+def _docker_all_image_ids():
+    # None if the images could not be listed
+    engine = _docker_engine()
+    if engine:
+        try:
+            return engine.image_ids()
+        except DockerEngineError as e:
+            logger.error('Could not list docker images: %s' % e)
+            return None
+    proc = subprocess.Popen(shlex.split("docker images --quiet --no-trunc"),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        logger.error('Could not list docker images: %s' % err.strip())
         return None
+    return _unique(out.splitlines())
+
+
+def _docker_all_container_ids():
+    engine = _docker_engine()
+    if engine:
+        return engine.container_ids()
+    return _unique(run_command_capture_output("docker ps --all --quiet --no-trunc").splitlines())
+
+
+# Without docker the main functions report errors instead
+
+def _no_docker_insights_client_container_is_available():
+    # Don't print error here, this is the way to tell if running in a container is possible
+    # but do print debug info
+    logger.debug('not transfering to insights-client image')
+    logger.debug('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return False
+
+
+def _no_docker_run_in_container():
+    logger.debug('Could not connect to docker to transfer into a container')
+    logger.error('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return 1
+
+
+def _no_docker_get_targets():
+    logger.debug('Could not connect to docker to collect from images and containers')
+    logger.debug('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return []
+
+
+def _no_docker_open_image(image_id):
+    logger.error('Could not connect to docker to examine image %s' % image_id)
+    logger.error('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return None
+
+
+def _no_docker_open_container(container_id):
+    logger.error('Could not connect to docker to examine container %s' % container_id)
+    logger.error('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return None
+
+
+def _no_docker_docker_display_name(docker_name, docker_type):
+    logger.error('Could not connect to docker to examine %s %s' % (docker_type, docker_name))
+    logger.error('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return None
+
+
+def _no_docker_container_image_links():
+    logger.error('Could not connect to docker.')
+    logger.error('Docker is either not installed or not accessable: %s' %
+                 (HaveDockerException if HaveDockerException else ''))
+    return None
 
-    def docker_display_name(image_id):
-        logger.error('Could not connect to docker to examine image %s' % image_id)
-        logger.error('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
-        return None
 
-    def container_image_links():
-        logger.error('Could not connect to docker.')
-        logger.error('Docker is either not installed or not accessable: %s' %
-                     (HaveDockerException if HaveDockerException else ''))
-        return None
 #
 # JSON data has lots of nested dictionaries, that are often optional.
 #
@@ -0,0 +1,168 @@
+"""
+Minimal Docker Engine API client over the daemon's unix socket
+
+Keeps one connection open for all requests, so listing and inspecting
+every image and container doesn't start a docker CLI process per call
+"""
+import json
+import socket
+import urllib
+import httplib
+import logging
+import threading
+
+from insights_client.constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+
+class DockerEngineError(Exception):
+    """
+    The daemon could not be reached or answered with an error
+    """
+    pass
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """
+    HTTP connection to a unix socket
+    """
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.socket_path = socket_path
+        self.unix_timeout = timeout
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.unix_timeout is not None:
+            sock.settimeout(self.unix_timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngineClient(object):
+    """
+    Lists and inspects images and containers through the Engine API
+
+    The list calls already return the image tags and container names,
+    they are kept so display names need no inspect call at all
+    """
+    def __init__(self, socket_path=None, timeout=constants.docker_api_timeout):
+        self.socket_path = socket_path or constants.docker_socket
+        self.timeout = timeout
+        self.conn = None
+        # requests share the connection, one at a time
+        self.lock = threading.Lock()
+        self.summaries = {}
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _request(self, path):
+        """
+        GET path, returns (status, decoded JSON body or None)
+        Reconnects once if the daemon closed the kept-alive connection
+        """
+        with self.lock:
+            for attempt in range(2):
+                if self.conn is None:
+                    self.conn = UnixHTTPConnection(self.socket_path, self.timeout)
+                try:
+                    self.conn.request('GET', path)
+                    response = self.conn.getresponse()
+                    body = response.read()
+                except (socket.error, httplib.HTTPException) as e:
+                    self.close()
+                    if attempt:
+                        raise DockerEngineError('%s: %s' % (path, e))
+                    continue
+                if response.getheader('connection', '').lower() == 'close':
+                    self.close()
+                break
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = body
+        return response.status, data
+
+    def get(self, path):
+        status, data = self._request(path)
+        if status != 200:
+            raise DockerEngineError('%s: HTTP %d %s' % (path, status, data))
+        return data
+
+    def ping(self):
+        try:
+            return self._request('/_ping')[0] == 200
+        except DockerEngineError:
+            return False
+
+    def info(self):
+        return self.get('/info')
+
+    def storage_driver(self):
+        return self.info().get('Driver', '')
+
+    def _unique(self, entries, kind):
+        # daemon output can repeat an id, keep the first of each
+        seen = set()
+        ids = []
+        for entry in entries:
+            if entry['Id'] in seen:
+                continue
+            seen.add(entry['Id'])
+            ids.append(entry['Id'])
+            self.summaries[(kind, entry['Id'])] = entry
+        return ids
+
+    def image_ids(self):
+        """
+        Full ids of all the top level images, like docker images --quiet --no-trunc
+        """
+        return self._unique(self.get('/images/json'), 'image')
+
+    def container_ids(self):
+        """
+        Full ids of all containers, like docker ps --all --quiet --no-trunc
+        """
+        return self._unique(self.get('/containers/json?all=1'), 'container')
+
+    def containers(self):
+        """
+        List entries of all containers, including the id of their image
+        """
+        entries = self.get('/containers/json?all=1')
+        self._unique(entries, 'container')
+        return entries
+
+    def inspect(self, name, kind='image'):
+        """
+        docker inspect --type kind name, or None if there is no such object
+        """
+        path = '/%ss/%s/json' % (kind, urllib.quote(name, safe=''))
+        status, data = self._request(path)
+        if status == 404:
+            return None
+        if status != 200:
+            raise DockerEngineError('%s: HTTP %d %s' % (path, status, data))
+        return data
+
+    def display_name(self, name, kind):
+        """
+        Image tag or container name, from the listing if it had this object
+        """
+        summary = self.summaries.get((kind, name))
+        if summary is None:
+            summary = self.inspect(name, kind)
+            if summary is None:
+                return name
+        if kind == 'image':
+            tags = [t for t in summary.get('RepoTags') or [] if t != '<none>:<none>']
+            return tags[0] if tags else name
+        if 'Names' in summary:
+            # list entries carry every name, inspect only the first
+            names = summary['Names'] or ['']
+            return names[0].lstrip('/') or name
+        return summary.get('Name', '').lstrip('/') or name
@@ -0,0 +1,300 @@
+"""
+Read image and container files straight from their overlay layers
+
+Paths are looked up through the layer directories under /var/lib/docker,
+top layer first, the way the overlay filesystem would show them, without
+asking the docker daemon anything and without mounting
+"""
+import os
+import re
+import json
+import stat
+import ctypes
+import hashlib
+import logging
+import threading
+
+from insights_client.constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+# aufs style whiteouts, as found in layer tarballs
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_MARKER = '.wh..wh..opq'
+# overlay marks opaque directories with an extended attribute
+OPAQUE_XATTR = 'trusted.overlay.opaque'
+MAX_SYMLINKS = 40
+
+_libc = None
+
+
+def _lgetxattr(path, name):
+    # python 2 has no xattr support of its own
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(None, use_errno=True)
+            _libc.lgetxattr
+        except (OSError, AttributeError):
+            _libc = False
+    if not _libc:
+        return None
+    buf = ctypes.create_string_buffer(16)
+    size = _libc.lgetxattr(path, name, buf, len(buf))
+    if size < 0:
+        return None
+    return buf.raw[:size]
+
+
+def _is_whiteout(st):
+    # overlay whiteouts are 0/0 character devices
+    return stat.S_ISCHR(st.st_mode) and st.st_rdev == 0
+
+
+def _is_opaque(path):
+    if os.path.lexists(os.path.join(path, OPAQUE_MARKER)):
+        return True
+    return _lgetxattr(path, OPAQUE_XATTR) == 'y'
+
+
+class LayerReader(object):
+    """
+    Merged view of overlay layer directories, top layer first
+
+    Nothing is mounted to read files.  Commands that need the whole tree
+    get a real mount point from mount(), called at most once
+    """
+    def __init__(self, layers, mount=None):
+        self.layers = list(layers)
+        self.mount = mount
+        self.mount_lock = threading.Lock()
+        self.mounted = False
+        self.mount_path = None
+
+    @property
+    def root(self):
+        # stands in for the mount point in file names, nothing is there
+        return self.layers[0]
+
+    def mount_point(self):
+        """
+        A real mount of the tree, or None
+        """
+        with self.mount_lock:
+            if not self.mounted:
+                self.mounted = True
+                if self.mount is not None:
+                    self.mount_path = self.mount()
+            return self.mount_path
+
+    def _lookup(self, dirs, name):
+        """
+        (stat, paths) of name in the merged directory made of dirs
+        paths has one entry for a file and one per layer for a directory,
+        returns None if there is no such entry or it was deleted
+        """
+        found = []
+        for d in dirs:
+            path = os.path.join(d, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                if os.path.lexists(os.path.join(d, WHITEOUT_PREFIX + name)):
+                    break
+                continue
+            if _is_whiteout(st):
+                break
+            if not stat.S_ISDIR(st.st_mode):
+                if found:
+                    # a directory above hides it
+                    break
+                return st, [path]
+            if not found:
+                top = st
+            found.append(path)
+            if _is_opaque(path):
+                break
+        if found:
+            return top, found
+        return None
+
+    def _walk(self, path):
+        """
+        Follow path from the root, symlinks included
+        Returns (stat, paths) like _lookup, or None
+        """
+        parts = [p for p in path.split('/') if p]
+        # merged directories from the root down to where we are
+        stack = [self.layers]
+        entry = (None, self.layers)
+        links = 0
+        while parts:
+            name = parts.pop(0)
+            if name == '.':
+                continue
+            if name == '..':
+                if len(stack) > 1:
+                    stack.pop()
+                entry = (None, stack[-1])
+                continue
+            entry = self._lookup(stack[-1], name)
+            if entry is None:
+                return None
+            st, paths = entry
+            if stat.S_ISLNK(st.st_mode):
+                links += 1
+                if links > MAX_SYMLINKS:
+                    return None
+                target = os.readlink(paths[0])
+                if target.startswith('/'):
+                    # absolute links point into the image, not the host
+                    stack = [self.layers]
+                parts = [p for p in target.split('/') if p] + parts
+                entry = (None, stack[-1])
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                stack.append(paths)
+            elif parts:
+                return None
+        return entry
+
+    def resolve(self, path):
+        """
+        Host path of the file seen at path in the merged tree, or None
+        """
+        entry = self._walk(path)
+        if entry is None or entry[0] is None or stat.S_ISDIR(entry[0].st_mode):
+            return None
+        return entry[1][0]
+
+    def open(self, path):
+        """
+        The file at path in the merged tree opened for reading, or None
+        """
+        real_path = self.resolve(path)
+        if real_path is None or not os.path.isfile(real_path):
+            return None
+        return open(real_path, 'rb')
+
+    def listdir(self, path):
+        """
+        Names in the merged directory at path
+        """
+        entry = self._walk(path)
+        if entry is None or (entry[0] is not None and not stat.S_ISDIR(entry[0].st_mode)):
+            return []
+        names = set()
+        hidden = set()
+        for d in entry[1]:
+            try:
+                found = os.listdir(d)
+            except OSError:
+                continue
+            deleted = set()
+            for name in found:
+                if name == OPAQUE_MARKER:
+                    continue
+                if name.startswith(WHITEOUT_PREFIX):
+                    deleted.add(name[len(WHITEOUT_PREFIX):])
+                    continue
+                if name in hidden or name in names:
+                    continue
+                try:
+                    if _is_whiteout(os.lstat(os.path.join(d, name))):
+                        deleted.add(name)
+                        continue
+                except OSError:
+                    continue
+                names.add(name)
+            # whiteouts only hide the layers below
+            hidden.update(deleted)
+        return sorted(names)
+
+    def expand(self, path):
+        """
+        Wildcarded path expanded in the merged tree, like _expand_paths
+        """
+        dir_name = os.path.dirname(path)
+        match = os.path.basename(path)
+        return [os.path.join(dir_name, name)
+                for name in self.listdir(dir_name) if re.match(match, name)]
+
+
+def _hex(docker_id):
+    return docker_id.split(':', 1)[-1]
+
+
+def _read_id(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _existing(dirs):
+    for d in dirs:
+        if not os.path.isdir(d):
+            logger.debug("Layer directory %s not found" % d)
+            return None
+    return dirs
+
+
+def image_layers(image_id, docker_root=None):
+    """
+    Layer directories of an image, top first, from docker's own metadata
+    None if the image isn't stored by the overlay or overlay2 driver
+    """
+    root = docker_root or constants.docker_root
+    for driver in ('overlay2', 'overlay'):
+        image_dir = os.path.join(root, 'image', driver)
+        config = os.path.join(image_dir, 'imagedb', 'content', 'sha256', _hex(image_id))
+        if not os.path.isfile(config):
+            continue
+        try:
+            with open(config) as f:
+                diff_ids = json.load(f)['rootfs']['diff_ids']
+            cache_ids = []
+            chain_id = None
+            for diff_id in diff_ids:
+                # layers are stored by the digest of the layers below them
+                if chain_id is None:
+                    chain_id = diff_id
+                else:
+                    chain_id = 'sha256:' + hashlib.sha256(chain_id + ' ' + diff_id).hexdigest()
+                cache_ids.append(_read_id(os.path.join(
+                    image_dir, 'layerdb', 'sha256', _hex(chain_id), 'cache-id')))
+        except (IOError, ValueError, LookupError, TypeError) as e:
+            logger.debug("Could not read the layers of image %s: %s" % (image_id, e))
+            return None
+        if not cache_ids:
+            return None
+        if driver == 'overlay':
+            # each overlay image layer holds the whole tree, hardlinked
+            return _existing([os.path.join(root, driver, cache_ids[-1], 'root')])
+        return _existing([os.path.join(root, driver, c, 'diff')
+                          for c in reversed(cache_ids)])
+    return None
+
+
+def container_layers(container_id, docker_root=None):
+    """
+    Layer directories of a container, top first, like image_layers
+    """
+    root = docker_root or constants.docker_root
+    for driver in ('overlay2', 'overlay'):
+        mount_id_file = os.path.join(root, 'image', driver, 'layerdb', 'mounts',
+                                     container_id, 'mount-id')
+        if not os.path.isfile(mount_id_file):
+            continue
+        try:
+            layer_dir = os.path.join(root, driver, _read_id(mount_id_file))
+            if driver == 'overlay':
+                lower = _read_id(os.path.join(layer_dir, 'lower-id'))
+                return _existing([os.path.join(layer_dir, 'upper'),
+                                  os.path.join(root, driver, lower, 'root')])
+            # short names under l/, linking to the lower layers' diff dirs
+            lower = _read_id(os.path.join(layer_dir, 'lower'))
+        except IOError as e:
+            logger.debug("Could not read the layers of container %s: %s" % (container_id, e))
+            return None
+        return _existing([os.path.join(layer_dir, 'diff')] +
+                         [os.path.join(root, driver, l) for l in lower.split(':') if l])
+    return None
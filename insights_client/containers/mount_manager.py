@@ -0,0 +1,131 @@
+"""
+Mounts shared by the targets of one run
+"""
+import os
+import logging
+import tempfile
+import threading
+
+from insights_client.constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+
+def _remove_mount_point(path):
+    # rmdir rather than rmtree, never delete through a mount left behind
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        logger.debug("Could not remove %s: %s" % (path, e))
+
+
+class MountManager(object):
+    """
+    Reference counted mounts, keyed by image or container id
+
+    A key is mounted the first time it is acquired and shared by every
+    later acquire.  When the last user releases it the mount is kept,
+    as another target may need the same layers, up to max_idle unused
+    mounts; the rest are torn down together by cleanup() at the end
+
+    mount(key, mount_point) mounts and returns a handle, or None
+    unmount(mount_point, handle) undoes it
+    """
+    def __init__(self, mount, unmount, max_idle=constants.mount_max_idle):
+        self.mount = mount
+        self.unmount = unmount
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.mounts = {}
+        # keys in the order their mounts completed, so cleanup can
+        # undo mounts stacked on others first
+        self.order = []
+        # released keys, least recently used first
+        self.idle = []
+        self.mounted = 0
+        self.reused = 0
+
+    def acquire(self, key):
+        """
+        Mount point for key, or None if it could not be mounted
+        """
+        with self.lock:
+            entry = self.mounts.get(key)
+            owner = entry is None
+            if owner:
+                entry = {'mount_point': None,
+                         'handle': None,
+                         'refs': 1,
+                         'ready': threading.Event()}
+                self.mounts[key] = entry
+            else:
+                entry['refs'] += 1
+                if key in self.idle:
+                    self.idle.remove(key)
+                self.reused += 1
+        if not owner:
+            entry['ready'].wait()
+            return entry['mount_point']
+
+        mount_point = tempfile.mkdtemp()
+        handle = None
+        try:
+            handle = self.mount(key, mount_point)
+        finally:
+            with self.lock:
+                if handle is None:
+                    del self.mounts[key]
+                    _remove_mount_point(mount_point)
+                else:
+                    entry['mount_point'] = mount_point
+                    entry['handle'] = handle
+                    # after any mounts this one was stacked on
+                    self.order.append(key)
+                    self.mounted += 1
+            entry['ready'].set()
+        return entry['mount_point']
+
+    def release(self, key):
+        """
+        Done with key, it stays mounted until evicted or cleaned up
+        """
+        evicted = []
+        with self.lock:
+            entry = self.mounts.get(key)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return
+            self.idle.append(key)
+            while len(self.idle) > self.max_idle:
+                evicted.append(self._pop(self.idle[0]))
+        for entry in evicted:
+            self._teardown(entry)
+
+    def _pop(self, key):
+        # called with the lock held
+        if key in self.idle:
+            self.idle.remove(key)
+        self.order.remove(key)
+        return self.mounts.pop(key)
+
+    def _teardown(self, entry):
+        try:
+            self.unmount(entry['mount_point'], entry['handle'])
+        except Exception as e:
+            logger.debug("exception while unmounting %s: %s" % (entry['mount_point'], e))
+        _remove_mount_point(entry['mount_point'])
+
+    def cleanup(self):
+        """
+        Unmount everything, newest first
+        """
+        while True:
+            with self.lock:
+                if not self.order:
+                    break
+                entry = self._pop(self.order[-1])
+            self._teardown(entry)
+        if self.mounted:
+            logger.debug("Made %d mounts, reused them %d times" % (self.mounted, self.reused))
@@ -0,0 +1,157 @@
+"""
+Avoid pulling the insights-client image on every container mode run
+
+The digest of the image and when it was last checked are recorded.
+Within the TTL the image isn't looked at again, and after that the
+registry is only asked for the digest of its manifest, the image is
+pulled only when that has changed
+"""
+import re
+import json
+import time
+import logging
+import requests
+
+from insights_client.constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+DEFAULT_REGISTRY = 'docker.io'
+DOCKER_HUB_API = 'registry-1.docker.io'
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v1+prettyjws'])
+
+
+def parse_reference(image):
+    """
+    (registry, repository, tag or digest) of an image name
+    """
+    name, reference = image, 'latest'
+    if '@' in name:
+        name, reference = name.split('@', 1)
+    else:
+        # a colon after the last slash is a tag, before it a registry port
+        last = name.rsplit('/', 1)[-1]
+        if ':' in last:
+            name, reference = name.rsplit(':', 1)
+    parts = name.split('/', 1)
+    if len(parts) == 2 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry, repository = parts
+    else:
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry == DEFAULT_REGISTRY and '/' not in repository:
+        repository = 'library/' + repository
+    return registry, repository, reference
+
+
+def _bearer_token(challenge, timeout):
+    # anonymous token for registries that ask for one, like Docker Hub
+    params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+    realm = params.pop('realm', None)
+    if not realm:
+        return None
+    response = requests.get(realm, params=params, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    body = response.json()
+    return body.get('token') or body.get('access_token')
+
+
+def registry_digest(image, timeout=constants.docker_registry_timeout):
+    """
+    Digest the registry has for image, from a HEAD request for its
+    manifest, or None if it could not be found out
+    """
+    registry, repository, reference = parse_reference(image)
+    if reference.startswith('sha256:'):
+        return reference
+    host = DOCKER_HUB_API if registry == DEFAULT_REGISTRY else registry
+    url = 'https://%s/v2/%s/manifests/%s' % (host, repository, reference)
+    headers = {'Accept': MANIFEST_TYPES}
+    try:
+        response = requests.head(url, headers=headers, timeout=timeout)
+        challenge = response.headers.get('www-authenticate', '')
+        if response.status_code == 401 and challenge.lower().startswith('bearer'):
+            token = _bearer_token(challenge[len('bearer'):], timeout)
+            if token:
+                headers['Authorization'] = 'Bearer ' + token
+                response = requests.head(url, headers=headers, timeout=timeout)
+    except (requests.RequestException, ValueError) as e:
+        logger.debug("Could not check %s with %s: %s" % (image, host, e))
+        return None
+    if response.status_code != 200:
+        logger.debug("Registry %s answered %d for %s" % (host, response.status_code, image))
+        return None
+    return response.headers.get('docker-content-digest')
+
+
+def _local_digests(repo_digests):
+    # RepoDigests entries are name@digest
+    return set(d.split('@', 1)[-1] for d in repo_digests or [])
+
+
+class PullCache(object):
+    """
+    When the image was last checked, and the digest it had then
+
+    image_digests(image) returns the local image's RepoDigests, or None
+    if it isn't there; pull(image) pulls it and returns 0 on success
+    """
+    def __init__(self, image_digests, pull, ttl, path=None, registry_digest=registry_digest):
+        self.image_digests = image_digests
+        self.pull = pull
+        self.ttl = ttl
+        self.path = path or constants.docker_pull_file
+        self.registry_digest = registry_digest
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, state):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(state, f)
+        except IOError:
+            logger.debug('Could not write %s', self.path)
+
+    def update(self, image):
+        """
+        Make sure image is there and recent enough, pulling only if needed
+        Returns True if it was pulled
+        """
+        now = time.time()
+        state = self._load()
+        entry = state.get(image)
+        local = self.image_digests(image)
+        if local is not None and entry and 0 <= now - entry['checked'] < self.ttl:
+            logger.debug("Checked %s %d seconds ago, not pulling" % (image, now - entry['checked']))
+            return False
+        remote = None
+        if local is not None:
+            remote = self.registry_digest(image)
+            if remote and remote in _local_digests(local):
+                logger.debug("%s is up to date at %s" % (image, remote))
+                state[image] = {'digest': remote, 'checked': now}
+                self._save(state)
+                return False
+        logger.debug("Pulling %s" % image)
+        if self.pull(image) != 0:
+            # not recorded, so the next run tries again
+            logger.debug("Could not pull %s" % image)
+            return False
+        local = self.image_digests(image)
+        if local is not None:
+            digests = _local_digests(local)
+            if remote not in digests:
+                remote = sorted(digests)[0] if digests else None
+            state[image] = {'digest': remote, 'checked': now}
+            self._save(state)
+        return True
@@ -0,0 +1,312 @@
+"""
+Read images straight from docker save tarballs
+
+The layer tarballs inside are read for their headers only, building an
+index of the final version of every path with deleted files taken out.
+Only the files that are collected are then read, nothing is extracted.
+Compressed layers are decompressed once, into an unlinked temporary file,
+so files can be read from them without starting over each time
+"""
+import os
+import re
+import gzip
+import json
+import shutil
+import logging
+import tarfile
+import tempfile
+import threading
+
+from insights_client.constants import InsightsConstants as constants
+from layer_reader import WHITEOUT_PREFIX, OPAQUE_MARKER, MAX_SYMLINKS
+
+logger = logging.getLogger(constants.app_name)
+
+FILE, DIRECTORY, SYMLINK = range(3)
+GZIP_MAGIC = '\x1f\x8b'
+
+
+class SavedImageError(Exception):
+    """
+    The tarball is not a docker save tarball, or is missing an image
+    """
+    pass
+
+
+def _tar_path(name):
+    # absolute, without ./, the way specs name files
+    return os.path.normpath('/' + name)
+
+
+def _manifest(tar):
+    try:
+        manifest = tar.extractfile('manifest.json')
+    except KeyError:
+        raise SavedImageError('no manifest.json')
+    try:
+        return json.load(manifest)
+    except ValueError as e:
+        raise SavedImageError('bad manifest.json: %s' % e)
+
+
+def _image_id(entry):
+    # the config's file name is its digest, which is the image id
+    return 'sha256:' + os.path.basename(entry['Config']).split('.')[0]
+
+
+class _Section(object):
+    """
+    Read-only file object for size bytes at start of fileobj, which
+    other sections share under lock
+    """
+    def __init__(self, fileobj, lock, start, size):
+        self.fileobj = fileobj
+        self.lock = lock
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(pos, 0)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        left = max(self.size - self.pos, 0)
+        if size is None or size < 0 or size > left:
+            size = left
+        if not size:
+            return ''
+        with self.lock:
+            self.fileobj.seek(self.start + self.pos)
+            data = self.fileobj.read(size)
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        pass
+
+
+def saved_images(path):
+    """
+    (image id, display name) of each image in a docker save tarball
+    """
+    tar = tarfile.open(path)
+    try:
+        images = []
+        for entry in _manifest(tar):
+            image_id = _image_id(entry)
+            tags = entry.get('RepoTags') or []
+            images.append((image_id, tags[0] if tags else image_id))
+        return images
+    finally:
+        tar.close()
+
+
+class SavedImage(object):
+    """
+    One image of a docker save tarball, read like LayerReader reads layers
+
+    Files are read from the tarball as they are opened.  There is no tree
+    to mount, so commands that need one are skipped
+    """
+    def __init__(self, path, image_id):
+        self.path = path
+        self.image_id = image_id
+        try:
+            self.tar = tarfile.open(path, 'r:')
+            # layers are read straight from the tarball
+            self.plain = True
+        except tarfile.ReadError:
+            # e.g. docker save | gzip
+            self.tar = tarfile.open(path)
+            self.plain = False
+        # reads share the files, one at a time
+        self.lock = threading.Lock()
+        # (file, offset) each layer's tarball is at
+        self.sources = []
+        # path -> (kind, layer, offset, size, link target)
+        self.entries = {}
+        self.children = {'/': set()}
+        try:
+            for entry in _manifest(self.tar):
+                if _image_id(entry) == image_id:
+                    self.layers = [self.tar.getmember(l) for l in entry['Layers']]
+                    break
+            else:
+                raise SavedImageError('no image %s' % image_id)
+            for n, layer in enumerate(self.layers):
+                self._add_layer(n, layer)
+        except (KeyError, IOError, tarfile.TarError) as e:
+            self.close()
+            raise SavedImageError(str(e))
+        except SavedImageError:
+            self.close()
+            raise
+
+    @property
+    def root(self):
+        # stands in for the mount point in file names
+        return self.path
+
+    def mount_point(self):
+        return None
+
+    def close(self):
+        for fileobj, start in self.sources:
+            if fileobj is not self.tar.fileobj:
+                fileobj.close()
+        self.tar.close()
+
+    def _open_layer(self, n):
+        """
+        Where layer n's tarball can be read from, decompressed if need be
+        """
+        layer = self.tar.extractfile(self.layers[n])
+        compressed = layer.read(2) == GZIP_MAGIC
+        layer.seek(0)
+        if self.plain and not compressed:
+            self.sources.append((self.tar.fileobj, self.layers[n].offset_data))
+            return _Section(self.tar.fileobj, self.lock,
+                            self.layers[n].offset_data, self.layers[n].size)
+        copy = tempfile.TemporaryFile(dir='/var/tmp')
+        self.sources.append((copy, 0))
+        if compressed:
+            layer = gzip.GzipFile(fileobj=layer, mode='rb')
+        shutil.copyfileobj(layer, copy)
+        return _Section(copy, self.lock, 0, copy.tell())
+
+    def _headers(self, n):
+        """
+        Headers of layer n, without tarfile keeping them all
+        """
+        layer = tarfile.open(fileobj=self._open_layer(n), mode='r:')
+        while True:
+            info = layer.next()
+            if info is None:
+                break
+            layer.members = []
+            yield info
+
+    def _remove(self, path):
+        self.entries.pop(path, None)
+        for name in self.children.pop(path, ()):
+            self._remove(os.path.join(path, name))
+        parent = self.children.get(os.path.dirname(path))
+        if parent is not None:
+            parent.discard(os.path.basename(path))
+
+    def _add(self, path, entry):
+        old = self.entries.get(path)
+        if old is not None and (old[0] != DIRECTORY or entry[0] != DIRECTORY):
+            self._remove(path)
+        parent = os.path.dirname(path)
+        if parent not in self.children:
+            # layers don't always list the directories themselves
+            self._add(parent, (DIRECTORY, None, 0, 0, None))
+        self.children[parent].add(os.path.basename(path))
+        if entry[0] == DIRECTORY:
+            self.children.setdefault(path, set())
+        self.entries[path] = entry
+
+    def _add_layer(self, n, layer):
+        """
+        Apply layer n over the ones below it
+        """
+        added = []
+        for info in self._headers(n):
+            path = _tar_path(info.name)
+            if path == '/':
+                continue
+            name = os.path.basename(path)
+            if name == OPAQUE_MARKER:
+                # the directory hides everything below it
+                for child in list(self.children.get(os.path.dirname(path), ())):
+                    self._remove(os.path.join(os.path.dirname(path), child))
+            elif name.startswith(WHITEOUT_PREFIX):
+                self._remove(os.path.join(os.path.dirname(path), name[len(WHITEOUT_PREFIX):]))
+            elif info.isdir():
+                added.append((path, (DIRECTORY, None, 0, 0, None)))
+            elif info.issym():
+                added.append((path, (SYMLINK, None, 0, 0, info.linkname)))
+            elif info.islnk():
+                added.append((path, _tar_path(info.linkname)))
+            elif info.isfile():
+                added.append((path, (FILE, n, info.offset_data, info.size, None)))
+        # whiteouts only hide the layers below, so add this one's files after
+        layer_files = {}
+        for path, entry in added:
+            if isinstance(entry, str):
+                # hard links point at a file earlier in the same layer
+                entry = layer_files.get(entry)
+                if entry is None:
+                    continue
+            if entry[0] == FILE:
+                layer_files[path] = entry
+            self._add(path, entry)
+
+    def _walk(self, path):
+        """
+        Index path of path, following symlinks inside the image, or None
+        """
+        parts = [p for p in path.split('/') if p]
+        current = '/'
+        links = 0
+        while parts:
+            name = parts.pop(0)
+            if name == '.':
+                continue
+            if name == '..':
+                current = os.path.dirname(current)
+                continue
+            candidate = os.path.join(current, name)
+            entry = self.entries.get(candidate)
+            if entry is None:
+                return None
+            if entry[0] == SYMLINK:
+                links += 1
+                if links > MAX_SYMLINKS:
+                    return None
+                if entry[4].startswith('/'):
+                    current = '/'
+                parts = [p for p in entry[4].split('/') if p] + parts
+                continue
+            if entry[0] != DIRECTORY and parts:
+                return None
+            current = candidate
+        return current
+
+    def open(self, path):
+        """
+        File object with the contents of the file at path, or None
+        """
+        found = self._walk(path)
+        entry = self.entries.get(found) if found else None
+        if entry is None or entry[0] != FILE:
+            return None
+        kind, n, offset, size, link = entry
+        fileobj, start = self.sources[n]
+        return _Section(fileobj, self.lock, start + offset, size)
+
+    def listdir(self, path):
+        """
+        Names in the directory at path
+        """
+        found = self._walk(path)
+        if found is None:
+            return []
+        return sorted(self.children.get(found, ()))
+
+    def expand(self, path):
+        """
+        Wildcarded path expanded in the image, like _expand_paths
+        """
+        dir_name = os.path.dirname(path)
+        match = os.path.basename(path)
+        return [os.path.join(dir_name, name)
+                for name in self.listdir(dir_name) if re.match(match, name)]
@@ -29,13 +29,16 @@ class DataCollector(object):
     '''
     Run commands and collect files
     '''
-    def __init__(self, archive_=None, mountpoint=None, target_name='', target_type='host'):
+    def __init__(self, archive_=None, mountpoint=None, target_name='', target_type='host',
+                 layers=None):
         self.archive = archive_ if archive_ else archive.InsightsArchive()
         self.mountpoint = '/'
         if mountpoint:
             self.mountpoint = mountpoint
         self.target_name = target_name
         self.target_type = target_type
+        # files under the mountpoint are read through these layers, if given
+        self.layers = layers
 
     def _get_meta_path(self, specname, conf):
         # should really never need these
@@ -89,12 +92,41 @@ class DataCollector(object):
         stdout, stderr = pre_proc.communicate()
         return stdout.splitlines()
 
+    def _file_layers(self, spec):
+        '''
+        Layers to read a file spec through, None to read it directly
+        '''
+        if '{CONTAINER_MOUNT_POINT}' in spec['file']:
+            return self.layers
+        return None
+
+    def _command_mountpoint(self, spec):
+        '''
+        Mountpoint for a command spec, None if the target can't be mounted
+        '''
+        if self.layers is not None and '{CONTAINER_MOUNT_POINT}' in spec['command']:
+            # only commands that need the whole tree mount it
+            return self.layers.mount_point()
+        return self.mountpoint
+
     def _parse_file_spec(self, spec):
         '''
         Separate wildcard specs into more specs
         '''
         # separate wildcard specs into more specs
-        if '*' in spec['file']:
+        if '*' in spec['file'] and self._file_layers(spec) is not None:
+            expanded_paths = self.layers.expand(spec['file'].replace(
+                '{CONTAINER_MOUNT_POINT}', '').replace(
+                '{DOCKER_IMAGE_NAME}', self.target_name).replace(
+                '{DOCKER_CONTAINER_NAME}', self.target_name))
+            expanded_specs = []
+            for p in expanded_paths:
+                _spec = copy.copy(spec)
+                _spec['file'] = '{CONTAINER_MOUNT_POINT}' + p
+                expanded_specs.append(_spec)
+            return expanded_specs
+
+        elif '*' in spec['file']:
             expanded_paths = _expand_paths(spec['file'].replace(
                 '{CONTAINER_MOUNT_POINT}', self.mountpoint).replace(
                 '{DOCKER_IMAGE_NAME}', self.target_name).replace(
@@ -148,7 +180,8 @@ class DataCollector(object):
                     # spoof archive_file_name
                     # use _, archive path will be re-mangled anyway
                     s['archive_file_name'] = s['file']
-                    file_spec = InsightsFile(s, exclude, self.mountpoint, self.target_name)
+                    file_spec = InsightsFile(s, exclude, self.mountpoint, self.target_name,
+                                             layers=self._file_layers(s))
                     self.archive.add_to_archive(file_spec)
         for c in conf['commands']:
             if rm_conf and c['command'] in rm_conf['commands']:
@@ -159,7 +192,12 @@ class DataCollector(object):
                 for s in cmd_specs:
                     # spoof archive_file_name, will be reassembled in InsightsCommand()
                     s['archive_file_name'] = os.path.join('insights_commands', '_')
-                    cmd_spec = InsightsCommand(s, exclude, self.mountpoint, self.target_name)
+                    mountpoint = self._command_mountpoint(s)
+                    if mountpoint is None:
+                        logger.debug('Could not mount %s, skipping %s',
+                                     self.target_name, s['command'])
+                        continue
+                    cmd_spec = InsightsCommand(s, exclude, mountpoint, self.target_name)
                     self.archive.add_to_archive(cmd_spec)
         logger.debug('Spec collection finished.')
         # collect metadata
@@ -199,7 +237,8 @@ class DataCollector(object):
                         else:
                             file_specs = self._parse_file_spec(spec)
                             for s in file_specs:
-                                file_spec = InsightsFile(s, exclude, self.mountpoint, self.target_name)
+                                file_spec = InsightsFile(s, exclude, self.mountpoint, self.target_name,
+                                                         layers=self._file_layers(s))
                                 self.archive.add_to_archive(file_spec)
                     elif 'command' in spec:
                         if rm_conf and spec['command'] in rm_conf['commands']:
@@ -208,7 +247,12 @@ class DataCollector(object):
                         else:
                             cmd_specs = self._parse_command_spec(spec, conf['pre_commands'])
                             for s in cmd_specs:
-                                cmd_spec = InsightsCommand(s, exclude, self.mountpoint, self.target_name)
+                                mountpoint = self._command_mountpoint(s)
+                                if mountpoint is None:
+                                    logger.debug('Could not mount %s, skipping %s',
+                                                 self.target_name, s['command'])
+                                    continue
+                                cmd_spec = InsightsCommand(s, exclude, mountpoint, self.target_name)
                                 self.archive.add_to_archive(cmd_spec)
             except LookupError:
                 logger.debug('Target type %s not found in spec %s. Skipping...', self.target_type, specname)
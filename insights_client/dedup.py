@@ -0,0 +1,112 @@
+"""
+Deduplicated layout for the container mode uber-archive
+
+Instead of one tarball per target, file contents are stored once under
+objects/ by their sha256, and each target gets a manifest in targets/
+listing its files and the objects holding their contents:
+
+    metadata.json
+    objects/ab/ab12...
+    targets/insights-<name>-<timestamp>.json
+"""
+import os
+import json
+import hashlib
+import tarfile
+import logging
+import tempfile
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+DEDUP_FORMAT = 'dedup-v1'
+COPY_BUFSIZE = 65536
+
+
+class DedupArchive(object):
+    """
+    Builds the deduplicated layout in an uber-archive directory
+    from the finished (uncompressed) per-target tarballs
+    """
+    # archive_format in metadata.json
+    format = DEDUP_FORMAT
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.objects_dir = os.path.join(archive_dir, 'objects')
+        self.targets_dir = os.path.join(archive_dir, 'targets')
+        for path in (self.objects_dir, self.targets_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path, 0o700)
+        self.total_bytes = 0
+        self.stored_bytes = 0
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _store(self, fileobj):
+        """
+        Store a file's contents once, returns its digest
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir)
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                data = fileobj.read(COPY_BUFSIZE)
+                if not data:
+                    break
+                digest.update(data)
+                out.write(data)
+                size += len(data)
+        digest = digest.hexdigest()
+        path = self._object_path(digest)
+        self.total_bytes += size
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.mkdir(os.path.dirname(path))
+            os.rename(tmp_path, path)
+            self.stored_bytes += size
+        return digest
+
+    def add_target(self, tar_file, system_id=None):
+        """
+        Add a per-target tarball, returns the manifest path
+        """
+        name = os.path.basename(tar_file).split('.tar')[0]
+        entries = []
+        with tarfile.open(tar_file, 'r:*') as tar:
+            for member in tar:
+                entry = {'name': member.name,
+                         'mode': member.mode,
+                         'mtime': member.mtime}
+                if member.isfile():
+                    entry['type'] = 'file'
+                    entry['size'] = member.size
+                    entry['digest'] = self._store(tar.extractfile(member))
+                elif member.isdir():
+                    entry['type'] = 'dir'
+                elif member.issym():
+                    entry['type'] = 'symlink'
+                    entry['target'] = member.linkname
+                elif member.islnk():
+                    entry['type'] = 'link'
+                    entry['target'] = member.linkname
+                else:
+                    logger.debug('Skipping special file %s in %s', member.name, tar_file)
+                    continue
+                entries.append(entry)
+        manifest = os.path.join(self.targets_dir, name + '.json')
+        with open(manifest, 'w') as f:
+            json.dump({'format': DEDUP_FORMAT,
+                       'archive_name': name,
+                       'system_id': system_id,
+                       'files': entries}, f)
+        return manifest
+
+    def log_savings(self):
+        saved = self.total_bytes - self.stored_bytes
+        logger.debug('Deduplicated uber-archive: %d bytes of files stored as %d '
+                     '(%d bytes saved)', self.total_bytes, self.stored_bytes, saved)
@@ -0,0 +1,109 @@
+"""
+Cache of per-image archives for container mode
+Images don't change, so an image collected and uploaded under the same
+collection rules doesn't need to be mounted and collected again
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+
+def rules_key(collection_rules, rm_conf, branch_info=None,
+              obfuscate=False, obfuscate_hostname=False):
+    """
+    What the collected data depends on besides the image itself:
+    the collection rules version, the client version, remove.conf, the
+    branch info written into the archive and how it is obfuscated
+    """
+    settings = json.dumps({'rm_conf': rm_conf or None,
+                           'branch_info': branch_info,
+                           'obfuscate': obfuscate,
+                           'obfuscate_hostname': obfuscate_hostname},
+                          sort_keys=True)
+    return '%s/%s/%s' % (collection_rules.get('version'), constants.version,
+                         hashlib.sha256(settings).hexdigest()[:16])
+
+
+class ImageCache(object):
+    """
+    One directory per image holding its archive and a meta.json
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or constants.image_cache_dir
+
+    def _entry(self, image_id):
+        return os.path.join(self.cache_dir, hashlib.sha256(image_id).hexdigest())
+
+    def _read_meta(self, entry):
+        try:
+            with open(os.path.join(entry, 'meta.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def lookup(self, image_id, key):
+        """
+        Archive metadata of a cached image with tar_file pointing into
+        the cache, or None if it has to be collected
+        """
+        entry = self._entry(image_id)
+        meta = self._read_meta(entry)
+        if meta is None:
+            return None
+        tar_file = os.path.join(entry, meta['archive'])
+        if meta['image_id'] != image_id or meta['key'] != key:
+            logger.debug('Cached archive of image %s is stale', image_id)
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        if not os.path.isfile(tar_file):
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        archive_meta = dict(meta['archive_meta'])
+        archive_meta['tar_file'] = tar_file
+        return archive_meta
+
+    def store(self, image_id, key, archive_meta):
+        """
+        Keep an uploaded image archive, linked rather than copied if possible
+        """
+        entry = self._entry(image_id)
+        tar_file = archive_meta['tar_file']
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.makedirs(entry, 0o700)
+            dest = os.path.join(entry, os.path.basename(tar_file))
+            try:
+                os.link(tar_file, dest)
+            except OSError:
+                shutil.copy(tar_file, dest)
+            meta = {'image_id': image_id,
+                    'key': key,
+                    'archive': os.path.basename(tar_file),
+                    'archive_meta': dict((k, v) for k, v in archive_meta.items()
+                                         if k != 'tar_file'),
+                    'created': time.time()}
+            with open(os.path.join(entry, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        except (IOError, OSError) as e:
+            logger.debug('Could not cache archive of image %s: %s', image_id, e)
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+        return True
+
+    def prune(self, image_ids):
+        """
+        Drop the entries of images that are gone
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        keep = set(os.path.basename(self._entry(i)) for i in image_ids)
+        for name in os.listdir(self.cache_dir):
+            if name not in keep:
+                logger.debug('Removing cached archive %s, image is gone', name)
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
@@ -1,5 +1,8 @@
 import os
 import re
+import fcntl
+import shutil
+import threading
 from subprocess import Popen, PIPE, STDOUT
 import errno
 import shlex
@@ -12,6 +15,35 @@ from constants import InsightsConstants as constants
 logger = logging.getLogger(constants.app_name)
 
 
+def _stdin_for(source):
+    '''
+    Something a command can read source from as its stdin
+    Contents that aren't in a file of their own are fed through a pipe
+    '''
+    try:
+        source.fileno()
+        return source
+    except (AttributeError, IOError, ValueError):
+        pass
+    read_fd, write_fd = os.pipe()
+    # no command may hold the write end open, or the reader never sees EOF
+    fcntl.fcntl(write_fd, fcntl.F_SETFD,
+                fcntl.fcntl(write_fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def feed():
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                shutil.copyfileobj(source, pipe)
+        except (IOError, OSError):
+            # the command stopped reading
+            pass
+        source.close()
+    feeder = threading.Thread(target=feed)
+    feeder.daemon = True
+    feeder.start()
+    return os.fdopen(read_fd, 'rb')
+
+
 class InsightsSpec(object):
     '''
     A spec loaded from the uploader.json
@@ -132,8 +164,10 @@ class InsightsFile(InsightsSpec):
     '''
     A file spec
     '''
-    def __init__(self, spec, exclude, mountpoint, target_name):
+    def __init__(self, spec, exclude, mountpoint, target_name, layers=None):
         InsightsSpec.__init__(self, spec, exclude)
+        # read through image layers instead of a mounted tree
+        self.layers = layers
         # substitute mountpoint for collection
         self.real_path = spec['file'].replace(
             '{CONTAINER_MOUNT_POINT}', mountpoint).replace(
@@ -149,7 +183,13 @@ class InsightsFile(InsightsSpec):
         '''
         Get file content, selecting only lines we are interested in
         '''
-        if not os.path.isfile(self.real_path):
+        source = None
+        if self.layers is not None:
+            source = self.layers.open(self.relative_path)
+            if source is None:
+                logger.debug('File %s does not exist', self.real_path)
+                return
+        elif not os.path.isfile(self.real_path):
             logger.debug('File %s does not exist', self.real_path)
             return
 
@@ -160,9 +200,16 @@ class InsightsFile(InsightsSpec):
         cmd.append("/bin/sed".encode('utf-8'))
         cmd.append("-rf".encode('utf-8'))
         cmd.append(constants.default_sed_file.encode('utf-8'))
-        cmd.append(self.real_path.encode('utf8'))
-        sedcmd = Popen(cmd,
-                       stdout=PIPE)
+        if source is None:
+            cmd.append(self.real_path.encode('utf8'))
+            sedcmd = Popen(cmd,
+                           stdout=PIPE)
+        else:
+            stdin = _stdin_for(source)
+            sedcmd = Popen(cmd,
+                           stdin=stdin,
+                           stdout=PIPE)
+            stdin.close()
 
         if self.exclude is not None:
             exclude_file = NamedTemporaryFile()
@@ -0,0 +1,34 @@
+"""
+Deferred imports, so a run only loads the subsystems it actually uses
+"""
+
+
+def _import(name):
+    # resolved the way the client modules import each other, relative to
+    # this package first
+    return __import__(name, globals(), {}, ['__name__'], -1)
+
+
+class LazyModule(object):
+    """
+    Stands in for a module until one of its attributes is used
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = _import(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy(module, attr):
+    """
+    Callable standing in for a function or class in module,
+    which is imported on the first call
+    """
+    def load(*args, **kwargs):
+        return getattr(_import(module), attr)(*args, **kwargs)
+    load.__name__ = attr
+    return load
@@ -0,0 +1,118 @@
+"""
+Upload bandwidth limiting
+"""
+import time
+import threading
+import logging
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+UNITS = {'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024}
+
+
+def parse_rate(value):
+    """
+    Bytes per second from a string like 65536, 64k or 2M; 0 is unlimited
+    """
+    value = value.strip().lower()
+    if value.endswith('b'):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in UNITS:
+        multiplier = UNITS[value[-1]]
+        value = value[:-1]
+    rate = int(float(value) * multiplier)
+    if rate < 0:
+        raise ValueError('negative rate')
+    return rate
+
+
+def _parse_clock(value):
+    hour, minute = [int(x) for x in value.strip().split(':')]
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError('invalid time %s' % value)
+    return hour * 60 + minute
+
+
+def parse_schedule(spec, default_rate):
+    """
+    Parse a schedule like '08:00-18:00, 22:00-02:00=1M' into a list of
+    (start minute, end minute, bytes per second); windows without a rate
+    use default_rate, and windows may wrap past midnight
+    """
+    windows = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        span, _, rate = item.partition('=')
+        start, end = span.split('-')
+        windows.append((_parse_clock(start), _parse_clock(end),
+                        parse_rate(rate) if rate else default_rate))
+    return windows
+
+
+class BandwidthLimit(object):
+    """
+    Current upload rate limit, following the schedule if there is one
+    Outside every scheduled window uploads are unlimited
+    """
+    def __init__(self, rate, schedule=None, clock=time.time):
+        self.rate = rate
+        self.schedule = schedule
+        self.clock = clock
+
+    def __call__(self):
+        if not self.schedule:
+            return self.rate
+        now = time.localtime(self.clock())
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.schedule:
+            if start <= end:
+                inside = start <= minute < end
+            else:
+                inside = minute >= start or minute < end
+            if inside:
+                return rate
+        return 0
+
+
+class TokenBucket(object):
+    """
+    Token bucket shared by everything uploading through one connection
+    'rate' is bytes per second, or a callable returning it; 0 is unlimited
+    The bucket holds up to one second's worth of tokens
+    """
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.rate = rate if callable(rate) else (lambda: rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tokens = None
+        self.last = None
+
+    def consume(self, amount):
+        """
+        Block until amount bytes may be sent
+        The bucket may go into debt, the caller then sleeps it off
+        """
+        while amount > 0:
+            rate = self.rate()
+            if not rate:
+                self.tokens = None
+                return
+            with self.lock:
+                now = self.clock()
+                if self.tokens is None:
+                    self.tokens = float(rate)
+                else:
+                    self.tokens = min(float(rate),
+                                      self.tokens + (now - self.last) * rate)
+                self.last = now
+                take = min(amount, rate)
+                self.tokens -= take
+                amount -= take
+                wait = -self.tokens / rate if self.tokens < 0 else 0
+            if wait:
+                self.sleep(wait)
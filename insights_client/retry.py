@@ -0,0 +1,91 @@
+"""
+Retry policy for uploads
+"""
+import time
+import random
+import logging
+from email.utils import parsedate_tz, mktime_tz
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+# the server is telling us to back off
+THROTTLE_CODES = (429, 503)
+
+
+def parse_retry_after(value, now=None):
+    """
+    Seconds to wait from a Retry-After header, either delta-seconds
+    or an HTTP-date; None if it can't be parsed
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, int(mktime_tz(parsed) - now))
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter, honoring Retry-After,
+    with a cap on the total time spent waiting
+    """
+    def __init__(self, attempts,
+                 base_delay=constants.retry_base_delay,
+                 max_delay=constants.retry_max_delay,
+                 max_total=constants.retry_max_total,
+                 rand=random.random):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total = max_total
+        self.rand = rand
+        self.waited = 0
+
+    def reason(self, response=None, error=None):
+        """
+        Human readable reason for a failed attempt
+        """
+        if error is not None:
+            return 'connection error: %s' % error
+        if response is None:
+            return 'no response'
+        if response.status_code in THROTTLE_CODES:
+            return 'throttled by server (HTTP %s)' % response.status_code
+        return 'HTTP %s' % response.status_code
+
+    def next_delay(self, attempt, response=None):
+        """
+        Seconds to wait after failed attempt number 'attempt' (from 0),
+        or None if we should give up
+        """
+        if attempt + 1 >= self.attempts:
+            return None
+        remaining = self.max_total - self.waited
+        if remaining <= 0:
+            logger.debug("Retry time budget of %d seconds used up", self.max_total)
+            return None
+        backoff = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = self.rand() * backoff
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                if retry_after > remaining:
+                    # coming back any sooner would only be refused again
+                    logger.debug("Server asked us to wait %d seconds, more than the "
+                                 "%d left of the retry time budget", retry_after, remaining)
+                    return None
+                # honor the server, plus a little jitter so we don't all come back at once
+                delay = retry_after + self.rand() * self.base_delay
+            elif response.status_code in THROTTLE_CODES:
+                # throttled without a hint, wait at least half the backoff
+                delay = backoff / 2.0 + delay / 2.0
+        delay = min(delay, remaining)
+        self.waited += delay
+        return delay
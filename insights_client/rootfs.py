@@ -0,0 +1,96 @@
+"""
+Collect from unpacked root file systems, e.g. podman or LXC rootfs trees,
+chroots or build farm output, as if they were docker images
+"""
+import os
+import re
+import glob
+import shlex
+import hashlib
+import logging
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+GLOB_CHARS = '*?['
+
+
+def find_rootfs(path):
+    """
+    Root file systems from a directory, a glob matching directories, or a
+    manifest file listing one directory per line, optionally followed by
+    the name to collect it under
+    Returns a list of (directory, name or None)
+    """
+    if any(c in path for c in GLOB_CHARS):
+        return [(d, None) for d in sorted(glob.glob(path)) if os.path.isdir(d)]
+    if os.path.isdir(path):
+        return [(path, None)]
+    base = os.path.dirname(os.path.abspath(path))
+    trees = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = shlex.split(line)
+            trees.append((os.path.join(base, fields[0]),
+                          fields[1] if len(fields) > 1 else None))
+    return trees
+
+
+def archive_name(tree, name=None):
+    """
+    Name to collect a tree under, it ends up in the archive file names, so
+    it's a single path component, and the hash of the path keeps trees
+    with the same last component (like podman's .../merged) apart
+    """
+    base = re.sub(r'[^\w.-]+', '_', name or os.path.basename(tree.rstrip('/')) or 'rootfs')
+    return '%s-%s' % (base, hashlib.sha256(tree).hexdigest()[:12])
+
+
+def rootfs_targets(paths):
+    """
+    docker_image targets for the root file systems found in paths
+    """
+    targets = []
+    seen = set()
+    for path in paths:
+        try:
+            trees = find_rootfs(path)
+        except (IOError, OSError, ValueError) as e:
+            logger.error('Could not read %s: %s', path, e)
+            continue
+        if not trees:
+            logger.error('No root file systems found in %s', path)
+        for tree, name in trees:
+            tree = os.path.abspath(tree)
+            if tree in seen:
+                continue
+            seen.add(tree)
+            # shown as the path unless the manifest gave it a name
+            targets.append({'type': 'docker_image', 'name': archive_name(tree, name),
+                            'rootfs': tree, 'display_name': name or tree})
+    logger.debug('Found %d root file systems', len(targets))
+    return targets
+
+
+class RootfsTarget(object):
+    """
+    An unpacked root file system, already a tree, nothing to mount
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def get_fs(self):
+        return self.path
+
+    def close(self):
+        pass
+
+
+def open_rootfs(path):
+    if not os.path.isdir(path):
+        logger.error('Root file system %s is not a directory', path)
+        return None
+    return RootfsTarget(path)
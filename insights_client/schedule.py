@@ -2,22 +2,39 @@
 Module responsible for scheduling Insights data collection
 """
 import os
+import json
+import time
+import hashlib
 import logging
 from client_config import InsightsClient
 from constants import InsightsConstants as constants
+from utilities import generate_machine_id
 
 CRON_DAILY = '/etc/cron.daily/'
 CRON_WEEKLY = '/etc/cron.weekly/'
+CRON_D = '/etc/cron.d/'
+MINUTES_PER_DAY = 24 * 60
 APP_NAME = constants.app_name
 logger = logging.getLogger(APP_NAME)
 
 
+def splay_offset(machine_id, window):
+    """
+    Minutes into the splay window for this machine, stable for a machine-id
+    """
+    if window <= 0:
+        return 0
+    return int(hashlib.sha256(machine_id).hexdigest(), 16) % window
+
+
 class InsightsSchedule(object):
     """
     Set the cron schedule
     """
     def __init__(self, set_cron=True):
         if set_cron and not self.already_linked():
+            # kept for the schedule, whatever mode later runs are in
+            self._set_script(self.mode_script())
             self.set_daily()
 
     def already_linked(self):
@@ -30,9 +47,164 @@ class InsightsSchedule(object):
         elif os.path.isfile(CRON_DAILY + APP_NAME):
             logger.debug('Found cron.daily')
             return True
+        elif os.path.isfile(CRON_D + APP_NAME):
+            logger.debug('Found cron.d')
+            return True
         else:
             return False
 
+    def mode_script(self):
+        """
+        Cron script for the mode of this run
+        """
+        return '/etc/' + APP_NAME + '/' + APP_NAME + (
+            '-container' if InsightsClient.options.container_mode else ''
+        ) + '.cron'
+
+    def cron_script(self):
+        """
+        Cron script chosen when scheduling was enabled
+        """
+        script = self._read_state().get('script')
+        if not script and os.path.islink(CRON_DAILY + APP_NAME):
+            # scheduled before the script was recorded
+            script = os.readlink(CRON_DAILY + APP_NAME)
+        return script or self.mode_script()
+
+    def _set_script(self, script):
+        state = self._read_state()
+        state['script'] = script
+        self._write_state(state)
+
+    def splay_window(self):
+        """
+        Length of the splay window in minutes, 0 if splay is disabled
+        """
+        window = InsightsClient.config.getint(APP_NAME, 'splay_window')
+        if window > MINUTES_PER_DAY:
+            logger.debug('splay_window is longer than a day, using %d minutes',
+                         MINUTES_PER_DAY)
+            window = MINUTES_PER_DAY
+        return max(window, 0)
+
+    def splay_start(self):
+        """
+        Start of the splay window in minutes after midnight
+        """
+        start = InsightsClient.config.get(APP_NAME, 'splay_start')
+        try:
+            hour, minute = [int(x) for x in start.split(':')]
+            return (hour * 60 + minute) % MINUTES_PER_DAY
+        except ValueError:
+            logger.error('Invalid splay_start %s, expected HH:MM', start)
+            return 0
+
+    def _read_state(self):
+        try:
+            with open(constants.splay_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_state(self, state):
+        try:
+            with open(constants.splay_file, 'w') as f:
+                json.dump(state, f)
+        except IOError:
+            logger.debug('Could not write %s', constants.splay_file)
+
+    def slot(self):
+        """
+        Minute of the day this machine's scheduled run starts
+        The offset is kept in the splay file so it only moves
+        when the machine-id or the window changes
+        """
+        window = self.splay_window()
+        start = self.splay_start()
+        machine_id = generate_machine_id()
+        state = self._read_state()
+        if (state.get('machine_id') != machine_id or
+                state.get('window') != window or
+                state.get('start') != start or
+                'offset' not in state):
+            state.update({'machine_id': machine_id,
+                          'window': window,
+                          'start': start,
+                          'offset': splay_offset(machine_id, window)})
+            self._write_state(state)
+        return (start + state['offset']) % MINUTES_PER_DAY
+
+    def cron_entry(self):
+        """
+        Contents of the cron.d file for a splayed schedule
+        With catch-up the job wakes hourly at this machine's minute and
+        only collects if the last daily slot was missed
+        """
+        slot = self.slot()
+        hour, minute = divmod(slot, 60)
+        if InsightsClient.config.getboolean(APP_NAME, 'splay_catch_up'):
+            when = '%d * * * *' % minute
+        else:
+            when = '%d %d * * *' % (minute, hour)
+        return ('# Generated by %s, daily run at %02d:%02d '
+                '(splayed over %d minutes)\n'
+                '%s root %s --scheduled\n' % (APP_NAME, hour, minute,
+                                              self.splay_window(), when,
+                                              self.cron_script()))
+
+    def last_slot_time(self, now=None):
+        """
+        Timestamp of the most recent daily slot at or before now
+        """
+        if now is None:
+            now = time.time()
+        hour, minute = divmod(self.slot(), 60)
+        today = time.localtime(now)
+        slot_time = time.mktime((today.tm_year, today.tm_mon, today.tm_mday,
+                                 hour, minute, 0, 0, 0, -1))
+        if slot_time > now:
+            slot_time = time.mktime((today.tm_year, today.tm_mon, today.tm_mday - 1,
+                                     hour, minute, 0, 0, 0, -1))
+        return slot_time
+
+    def is_due(self, now=None):
+        """
+        Determine if the scheduled run for the latest slot has not happened yet
+        """
+        if not self.splay_window():
+            return True
+        last_run = self._read_state().get('last_run', 0)
+        return last_run < self.last_slot_time(now)
+
+    def mark_run(self, now=None):
+        """
+        Record that the scheduled run for the latest slot succeeded,
+        now being when it started
+        """
+        state = self._read_state()
+        state['last_run'] = time.time() if now is None else now
+        self._write_state(state)
+
+    def refresh(self):
+        """
+        Rewrite a daily schedule if the splay settings changed,
+        keeping the script it runs
+        """
+        if os.path.isfile(CRON_WEEKLY + APP_NAME):
+            return
+        splayed = os.path.isfile(CRON_D + APP_NAME)
+        if not splayed and not os.path.isfile(CRON_DAILY + APP_NAME):
+            return
+        if not self.splay_window():
+            if splayed:
+                self.set_daily()
+            return
+        if splayed:
+            with open(CRON_D + APP_NAME) as f:
+                if f.read() == self.cron_entry():
+                    return
+        self.set_daily()
+
     def set_daily(self):
         """
         Set cron task to daily
@@ -43,15 +215,34 @@ class InsightsSchedule(object):
         except OSError:
             logger.debug('Could not remove cron.weekly')
 
+        if self.splay_window():
+            self._set_splayed()
+            return
+        try:
+            os.remove(CRON_D + APP_NAME)
+        except OSError:
+            logger.debug('Could not remove cron.d')
+
         try:
-            os.symlink(
-                '/etc/' + APP_NAME + '/' + APP_NAME + (
-                    '-container' if InsightsClient.options.container_mode else ''
-                ) + '.cron',
-                CRON_DAILY + APP_NAME)
+            os.symlink(self.cron_script(), CRON_DAILY + APP_NAME)
         except OSError:
             logger.debug('Could not link cron.daily')
 
+    def _set_splayed(self):
+        """
+        Schedule the daily run at this machine's slot in the splay window
+        """
+        try:
+            os.remove(CRON_DAILY + APP_NAME)
+        except OSError:
+            logger.debug('Could not remove cron.daily')
+        try:
+            with open(CRON_D + APP_NAME, 'w') as f:
+                f.write(self.cron_entry())
+            logger.debug('Scheduled daily run at minute %d of the day', self.slot())
+        except IOError:
+            logger.debug('Could not write cron.d')
+
     def remove_scheduling(self):
         '''
         Delete cron tasks
@@ -65,3 +256,7 @@ class InsightsSchedule(object):
             os.remove(CRON_DAILY + APP_NAME)
         except OSError:
             logger.debug('Could not remove cron.daily')
+        try:
+            os.remove(CRON_D + APP_NAME)
+        except OSError:
+            logger.debug('Could not remove cron.d')
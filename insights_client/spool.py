@@ -0,0 +1,173 @@
+"""
+On-disk spool for archives that could not be uploaded
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import errno
+import shutil
+import logging
+import requests
+from client_config import InsightsClient
+from constants import InsightsConstants as constants
+from utilities import generate_machine_id, write_lastupload_file
+
+APP_NAME = constants.app_name
+logger = logging.getLogger(APP_NAME)
+LOCK_FILE = '.lock'
+
+
+class UploadSpool(object):
+    """
+    Queue of failed uploads, one directory per archive holding
+    the archive and a meta.json describing how to upload it
+    """
+    def __init__(self, spool_dir=None):
+        self.spool_dir = spool_dir or constants.spool_dir
+        self.max_age = InsightsClient.config.getint(APP_NAME, 'spool_max_age') * 86400
+        self.max_archives = InsightsClient.config.getint(APP_NAME, 'spool_max_archives')
+
+    def entries(self):
+        """
+        Spooled entries, oldest first
+        """
+        if not os.path.isdir(self.spool_dir):
+            return []
+        entries = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if name == LOCK_FILE:
+                continue
+            meta_file = os.path.join(self.spool_dir, name, 'meta.json')
+            try:
+                with open(meta_file) as f:
+                    meta = json.load(f)
+            except (IOError, ValueError):
+                logger.debug('Skipping unreadable spool entry %s', name)
+                continue
+            meta['entry'] = os.path.join(self.spool_dir, name)
+            entries.append(meta)
+        entries.sort(key=lambda meta: meta['created'])
+        return entries
+
+    def _lock(self):
+        """
+        Open lock file held exclusively, or None if another run holds it
+        """
+        lock = open(os.path.join(self.spool_dir, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            lock.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        return lock
+
+    def _remove(self, meta, why):
+        logger.debug('Removing spooled archive %s (%s)', meta['archive'], why)
+        shutil.rmtree(meta['entry'], ignore_errors=True)
+
+    def _write_meta(self, meta):
+        entry = meta.pop('entry')
+        try:
+            with open(os.path.join(entry, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        finally:
+            meta['entry'] = entry
+
+    def expire(self, now=None):
+        """
+        Drop entries past the retention age, then the oldest beyond the limit
+        """
+        if now is None:
+            now = time.time()
+        entries = []
+        for meta in self.entries():
+            if now - meta['created'] > self.max_age:
+                self._remove(meta, 'older than retention')
+            else:
+                entries.append(meta)
+        while len(entries) > self.max_archives:
+            self._remove(entries.pop(0), 'spool is full')
+        return entries
+
+    def add(self, tar_file, logging_name, collection_duration, docker_group=False):
+        """
+        Copy an archive into the spool to be uploaded later
+        """
+        now = time.time()
+        entry = os.path.join(self.spool_dir,
+                             '%d-%s' % (int(now), uuid.uuid4().hex[:8]))
+        try:
+            os.makedirs(entry, 0o700)
+            shutil.copy(tar_file, entry)
+        except (IOError, OSError) as e:
+            logger.error('Could not spool %s: %s', tar_file, e)
+            shutil.rmtree(entry, ignore_errors=True)
+            return False
+        meta = {'entry': entry,
+                'archive': os.path.basename(tar_file),
+                'logging_name': logging_name,
+                'collection_duration': collection_duration,
+                'docker_group': docker_group,
+                'created': now,
+                'attempts': 0}
+        self._write_meta(meta)
+        logger.info('Insights data for %s queued for upload in %s',
+                    logging_name, self.spool_dir)
+        lock = self._lock()
+        if lock is not None:
+            # a run draining the spool expires it itself
+            try:
+                self.expire(now)
+            finally:
+                lock.close()
+        return True
+
+    def drain(self, pconn):
+        """
+        Try each spooled archive once, oldest first
+        Stops at the first failure, the uplink is probably still down
+        Returns 0 if the spool is empty afterwards, or another run is
+        already draining it
+        """
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        lock = self._lock()
+        if lock is None:
+            logger.info('Spool is being uploaded by another run, skipping it')
+            return 0
+        try:
+            return self._drain(pconn)
+        finally:
+            lock.close()
+
+    def _drain(self, pconn):
+        entries = self.expire()
+        if entries:
+            logger.info('Uploading %d spooled archive(s)', len(entries))
+        for meta in entries:
+            tar_file = os.path.join(meta['entry'], meta['archive'])
+            meta['attempts'] += 1
+            reason = None
+            try:
+                upload = pconn.upload_archive(
+                    tar_file, meta['collection_duration'],
+                    cluster=generate_machine_id(docker_group=meta['docker_group']))
+                if upload.status_code == 201:
+                    write_lastupload_file()
+                    logger.info('Uploaded spooled Insights data for %s',
+                                meta['logging_name'])
+                    self._remove(meta, 'uploaded')
+                    continue
+                reason = 'HTTP %s' % upload.status_code
+            except requests.ConnectionError as e:
+                reason = 'connection error: %s' % e
+            logger.error('Upload of spooled archive %s failed (attempt %d): %s',
+                         meta['archive'], meta['attempts'], reason)
+            meta['last_error'] = reason
+            self._write_meta(meta)
+            return 1
+        return 0
@@ -8,7 +8,7 @@ import os
 import requests
 from subprocess import Popen, PIPE, STDOUT
 from constants import InsightsConstants as constants
-from connection import InsightsConnection
+from connection import get_connection
 from client_config import InsightsClient
 
 APP_NAME = constants.app_name
@@ -28,7 +28,7 @@ def registration_check():
         with open(constants.unregistered_file) as reg_file:
             local_record += ' Unregistered at ' + reg_file.readline()
 
-    pconn = InsightsConnection()
+    pconn = get_connection()
     api_reg_status = pconn.api_registration_check()
     if type(api_reg_status) is bool:
         if api_reg_status:
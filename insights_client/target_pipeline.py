@@ -0,0 +1,100 @@
+"""
+Collect from several container mode targets at once
+"""
+import sys
+import Queue
+import logging
+import threading
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+
+class TargetPipeline(object):
+    """
+    Mount targets ahead of time on one thread and collect from them on a
+    pool of workers, with at most max_mounts targets mounted at once
+
+    open_target(t) returns a handle, or None to skip the target
+    collect_target(t, handle) returns the target's result
+    close_target(handle) unmounts it, always called once per handle
+    """
+    def __init__(self, open_target, collect_target, close_target,
+                 workers=1, max_mounts=1):
+        self.open_target = open_target
+        self.collect_target = collect_target
+        self.close_target = close_target
+        self.workers = max(1, workers)
+        # a worker can't start without a mounted target
+        self.max_mounts = max(self.workers, max_mounts)
+        self.mounts = threading.BoundedSemaphore(self.max_mounts)
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        self.error = None
+
+    def _fail(self):
+        with self.lock:
+            if self.error is None:
+                self.error = sys.exc_info()
+        self.stop.set()
+
+    def _prefetch(self, targets, ready):
+        try:
+            for index, t in enumerate(targets):
+                self.mounts.acquire()
+                if self.stop.is_set():
+                    self.mounts.release()
+                    break
+                try:
+                    handle = self.open_target(t)
+                except Exception:
+                    self.mounts.release()
+                    self._fail()
+                    break
+                if handle is None:
+                    self.mounts.release()
+                    continue
+                ready.put((index, t, handle))
+        finally:
+            for i in range(self.workers):
+                ready.put(None)
+
+    def _worker(self, ready, results):
+        while True:
+            item = ready.get()
+            if item is None:
+                return
+            index, t, handle = item
+            try:
+                if not self.stop.is_set():
+                    results[index] = self.collect_target(t, handle)
+            except Exception:
+                self._fail()
+            finally:
+                try:
+                    self.close_target(handle)
+                except Exception:
+                    logger.debug('Could not close %s', t['name'], exc_info=True)
+                self.mounts.release()
+
+    def run(self, targets):
+        """
+        Results of the targets that could be opened, in the order given
+        An exception from collecting stops the run once every mounted
+        target is closed again, and is then raised here
+        """
+        results = [None] * len(targets)
+        ready = Queue.Queue()
+        logger.debug('Collecting %d targets with %d workers, at most %d mounted',
+                     len(targets), self.workers, self.max_mounts)
+        threads = [threading.Thread(target=self._prefetch, args=(targets, ready))]
+        threads.extend(threading.Thread(target=self._worker, args=(ready, results))
+                       for i in range(self.workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return [result for result in results if result is not None]
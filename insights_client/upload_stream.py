@@ -0,0 +1,121 @@
+"""
+Streaming request bodies for archive uploads
+"""
+import os
+import uuid
+import logging
+from constants import InsightsConstants as constants
+
+logger = logging.getLogger(constants.app_name)
+
+
+class MultipartFileEncoder(object):
+    """
+    multipart/form-data body for a single file, read from disk in chunks
+    The total length is known up front, so requests sends a Content-Length
+    and streams the body instead of building it in memory
+    Reads wait on 'limiter' (a TokenBucket) if one is given
+    """
+    def __init__(self, field_name, path, mime_type, file_name=None,
+                 chunk_size=constants.upload_chunk_size, limiter=None):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        if file_name is None:
+            file_name = os.path.basename(path)
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        head = ('--%s\r\n'
+                'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: %s\r\n\r\n' % (self.boundary, field_name,
+                                              file_name, mime_type))
+        tail = '\r\n--%s--\r\n' % self.boundary
+        self._head = head.encode('utf-8')
+        self._tail = tail.encode('utf-8')
+        self._file = open(path, 'rb')
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self.len = len(self._head) + self._file_size + len(self._tail)
+        self._pos = 0
+
+    def __len__(self):
+        return self.len
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes of the encoded body
+        """
+        if size is None or size < 0:
+            size = self.len - self._pos
+        out = []
+        remaining = size
+        while remaining > 0 and self._pos < self.len:
+            data = self._read_part(remaining)
+            if not data:
+                break
+            out.append(data)
+            remaining -= len(data)
+        data = b''.join(out)
+        if self.limiter:
+            self.limiter.consume(len(data))
+        return data
+
+    def _read_part(self, size):
+        head_len = len(self._head)
+        body_end = head_len + self._file_size
+        if self._pos < head_len:
+            data = self._head[self._pos:self._pos + size]
+        elif self._pos < body_end:
+            data = self._file.read(min(size, body_end - self._pos))
+            if not data:
+                # file shrank underneath us, the length we sent is now wrong
+                raise IOError('%s was truncated during upload' % self._file.name)
+        else:
+            offset = self._pos - body_end
+            data = self._tail[offset:offset + size]
+        self._pos += len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+class LimitedBody(object):
+    """
+    Request body for bytes already in memory, read through a limiter
+    """
+    def __init__(self, data, limiter, chunk_size=constants.upload_chunk_size):
+        self.data = data
+        self.limiter = limiter
+        self.chunk_size = chunk_size
+        self.len = len(data)
+        self._pos = 0
+
+    def __len__(self):
+        return self.len
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._pos
+        data = self.data[self._pos:self._pos + size]
+        self._pos += len(data)
+        self.limiter.consume(len(data))
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
@@ -6,6 +6,7 @@ import os
 import sys
 import logging
 import uuid
+import json
 import datetime
 import shlex
 from subprocess import Popen, PIPE, STDOUT
@@ -202,6 +203,33 @@ def write_lastupload_file():
     reg.write(datetime.datetime.isoformat(datetime.datetime.now()))
 
 
+def read_upload_throughput():
+    """
+    Average upload throughput of earlier runs in bytes/s, or None
+    """
+    try:
+        with open(constants.upload_stats_file) as f:
+            return float(json.load(f)['bytes_per_second'])
+    except (IOError, ValueError, LookupError, TypeError):
+        return None
+
+
+def write_upload_throughput(bytes_per_second):
+    """
+    Fold an upload's throughput into the running average next to .lastupload
+    """
+    previous = read_upload_throughput()
+    if previous:
+        weight = constants.upload_stats_weight
+        bytes_per_second = previous * (1 - weight) + bytes_per_second * weight
+    try:
+        with open(constants.upload_stats_file, 'w') as f:
+            json.dump({'bytes_per_second': bytes_per_second,
+                       'updated': datetime.datetime.isoformat(datetime.datetime.now())}, f)
+    except IOError:
+        logger.debug('Could not write %s', constants.upload_stats_file)
+
+
 def validate_remove_file():
     """
     Validate the remove file
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+"""
+Offline benchmark for DataCollector.run_collection
+
+Builds a synthetic root filesystem and a corpus of fake commands with
+controllable latency and output volume, rewrites a collection spec set
+(.fallback.json by default) to point at them, optionally scales the spec
+set up, then times run_collection and reports throughput, per-spec latency
+percentiles and peak RSS.
+
+    python tests/benchmarks/bench_collection.py --scale 10 --cmd-latency 0.01
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import tempfile
+import optparse
+
+import benchutil
+
+FAKE_CMD = """#!/bin/sh
+sleep %(latency)s
+head -c %(output)d %(payload)s
+"""
+
+
+def _payload_line(n):
+    return ('line %d host%d.example.com 10.%d.%d.%d some log text '
+            'LoginGraceTime Protocol security realm\n' %
+            (n, n % 97, n % 250, (n // 250) % 250, n % 249 + 1))
+
+
+def write_payload(path, size):
+    """
+    Write a text file of roughly 'size' bytes of log-like lines
+    """
+    written = 0
+    n = 0
+    with open(path, 'w') as f:
+        while written < size:
+            line = _payload_line(n)
+            f.write(line)
+            written += len(line)
+            n += 1
+
+
+class SyntheticRoot(object):
+    """
+    A synthetic mountpoint plus a directory of fake command binaries
+    """
+    def __init__(self, work_dir, file_size, cmd_latency, cmd_output):
+        self.work_dir = work_dir
+        self.root = os.path.join(work_dir, 'rootfs')
+        self.bin_dir = os.path.join(work_dir, 'bin')
+        self.file_size = file_size
+        os.makedirs(self.root)
+        os.makedirs(self.bin_dir)
+        self.payload = os.path.join(work_dir, 'payload')
+        write_payload(self.payload, max(file_size, cmd_output))
+        self.fake_cmd = os.path.join(self.bin_dir, 'fakecmd')
+        with open(self.fake_cmd, 'w') as f:
+            f.write(FAKE_CMD % {'latency': cmd_latency,
+                                'output': cmd_output,
+                                'payload': self.payload})
+        os.chmod(self.fake_cmd, 0o755)
+        self.file_count = 0
+
+    def add_file(self, path):
+        """
+        Create a synthetic file at path (relative to the root)
+        """
+        full_path = os.path.join(self.root, path.lstrip('/'))
+        if os.path.exists(full_path):
+            return
+        try:
+            os.makedirs(os.path.dirname(full_path))
+        except OSError:
+            pass
+        write_payload(full_path, self.file_size)
+        self.file_count += 1
+
+    def command(self, n):
+        return '%s %d' % (self.fake_cmd, n)
+
+
+def _rewrite_file_spec(spec, synth, suffix):
+    path = spec['file'].replace('{CONTAINER_MOUNT_POINT}', '')
+    if '*' in path:
+        # wildcard specs are expanded against the synthetic root as-is
+        spec['file'] = '{CONTAINER_MOUNT_POINT}' + path
+        return spec
+    path = path + suffix
+    synth.add_file(path)
+    spec['file'] = '{CONTAINER_MOUNT_POINT}' + path
+    if 'archive_file_name' in spec and '{EXPANDED_FILE_NAME}' not in spec['archive_file_name']:
+        spec['archive_file_name'] = spec['archive_file_name'] + suffix
+    return spec
+
+
+def build_conf(rules, synth, target_type, scale):
+    """
+    Rewrite a collection rules document so every file spec resolves into the
+    synthetic root and every command runs the fake command,
+    replicating each spec 'scale' times
+    """
+    conf = copy.deepcopy(rules)
+    cmd_n = [0]
+
+    def next_cmd():
+        cmd_n[0] += 1
+        return synth.command(cmd_n[0])
+
+    conf['pre_commands'] = dict((alias, 'echo arg0; echo arg1')
+                                for alias in conf.get('pre_commands', {}))
+    specs = {}
+    for specname, spec_group in conf.get('specs', {}).items():
+        if target_type not in spec_group:
+            continue
+        for i in range(scale):
+            suffix = '' if i == 0 else '.bench%d' % i
+            new_list = []
+            for spec in spec_group[target_type]:
+                spec = copy.deepcopy(spec)
+                if 'file' in spec:
+                    new_list.append(_rewrite_file_spec(spec, synth, suffix))
+                elif 'command' in spec:
+                    spec['command'] = next_cmd()
+                    new_list.append(spec)
+            specs[specname + suffix] = {target_type: new_list}
+    conf['specs'] = specs
+
+    files = []
+    commands = []
+    for i in range(scale):
+        suffix = '' if i == 0 else '.bench%d' % i
+        for f in rules.get('files', []):
+            files.append(_rewrite_file_spec(copy.deepcopy(f), synth, suffix))
+        for c in rules.get('commands', []):
+            c = copy.deepcopy(c)
+            c['command'] = next_cmd()
+            commands.append(c)
+    conf['files'] = files
+    conf['commands'] = commands
+    return conf
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for f in filenames:
+            total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+
+def run_once(conf, synth, target_type, tar):
+    """
+    Run one collection, return (elapsed, per-spec latencies, bytes, tar time)
+    """
+    from archive import InsightsArchive
+    from data_collector import DataCollector
+    archive = InsightsArchive(compressor='gz', target_name='bench')
+    latencies = []
+    add_to_archive = archive.add_to_archive
+
+    def timed_add(spec):
+        start = time.time()
+        add_to_archive(spec)
+        latencies.append(time.time() - start)
+    archive.add_to_archive = timed_add
+
+    dc = DataCollector(archive, mountpoint=synth.root,
+                       target_name='bench', target_type=target_type)
+    try:
+        with benchutil.Timer() as t:
+            dc.run_collection(conf, None, {'remote_branch': -1, 'remote_leaf': -1})
+        collected = _dir_size(archive.archive_dir)
+        tar_elapsed = 0.0
+        if tar:
+            with benchutil.Timer() as tt:
+                archive.create_tar_file()
+            tar_elapsed = tt.elapsed
+    finally:
+        archive.delete_tmp_dir()
+    return t.elapsed, latencies, collected, tar_elapsed
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--rules', default=os.path.join(benchutil.ETC_DIR, '.fallback.json'),
+                      help='collection rules to drive (default: etc/.fallback.json)')
+    parser.add_option('--target-type', default='host',
+                      help='host, docker_image or docker_container')
+    parser.add_option('--scale', type='int', default=1,
+                      help='replicate every spec this many times')
+    parser.add_option('--file-size', type='int', default=4096,
+                      help='bytes per synthetic file')
+    parser.add_option('--cmd-latency', type='float', default=0.0,
+                      help='seconds each fake command sleeps')
+    parser.add_option('--cmd-output', type='int', default=4096,
+                      help='bytes each fake command prints')
+    parser.add_option('--runs', type='int', default=3,
+                      help='number of timed collections')
+    parser.add_option('--original-style-specs', action='store_true', default=False,
+                      help='drive the old files/commands lists instead of specs')
+    parser.add_option('--tar', action='store_true', default=False,
+                      help='also time create_tar_file')
+    parser.add_option('--keep', action='store_true', default=False,
+                      help='keep the synthetic tree for inspection')
+    options, args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='insights-bench-')
+    benchutil.setup_client(work_dir=work_dir,
+                           original_style_specs=options.original_style_specs)
+    try:
+        with open(options.rules) as f:
+            rules = json.load(f)
+        synth = SyntheticRoot(work_dir, options.file_size,
+                              options.cmd_latency, options.cmd_output)
+        conf = build_conf(rules, synth, options.target_type, options.scale)
+        if options.original_style_specs:
+            spec_count = len(conf['files']) + len(conf['commands'])
+        else:
+            spec_count = sum([len(g[options.target_type]) for g in conf['specs'].values()])
+
+        elapsed = []
+        latencies = []
+        collected = 0
+        tar_elapsed = []
+        for run in range(options.runs):
+            e, l, c, t = run_once(conf, synth, options.target_type, options.tar)
+            elapsed.append(e)
+            latencies.extend(l)
+            collected = c
+            tar_elapsed.append(t)
+
+        best = min(elapsed)
+        own_rss, child_rss = benchutil.peak_rss_kb()
+        rows = [('rules', options.rules),
+                ('target type', options.target_type),
+                ('specs', spec_count),
+                ('synthetic files', synth.file_count),
+                ('runs', options.runs),
+                ('best run (s)', best),
+                ('mean run (s)', sum(elapsed) / len(elapsed)),
+                ('specs/s', len(latencies) / float(options.runs) / best if best else 0.0),
+                ('collected bytes', collected),
+                ('MB/s', collected / best / 1048576.0 if best else 0.0),
+                ('spec p50 (ms)', benchutil.percentile(latencies, 50) * 1000),
+                ('spec p90 (ms)', benchutil.percentile(latencies, 90) * 1000),
+                ('spec p99 (ms)', benchutil.percentile(latencies, 99) * 1000),
+                ('spec max (ms)', max(latencies) * 1000 if latencies else 0.0),
+                ('peak RSS self (KB)', own_rss),
+                ('peak RSS children (KB)', child_rss)]
+        if options.tar:
+            rows.append(('best tar (s)', min(tar_elapsed)))
+        benchutil.report('DataCollector.run_collection', rows)
+    finally:
+        if options.keep:
+            print 'Synthetic tree kept in %s' % work_dir
+        else:
+            shutil.rmtree(work_dir, True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+"""
+Archive compression benchmark
+
+Builds a synthetic archive directory (text that compresses like collected
+command output, plus some incompressible data standing in for nested
+archives) and times InsightsArchive.create_tar_file for each compressor
+with 1 thread (plain tar) and with the block-parallel compressor at each
+thread count, checking the result still lists with tar.
+
+    python tests/benchmarks/bench_compression.py --size 200 --threads 1,2,4
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import benchutil
+
+
+def build_tree(root, size_mb, seed=0):
+    """
+    Fill root with about size_mb MB of mostly text files
+    """
+    rand = random.Random(seed)
+    words = ['kernel', 'systemd', 'eth0', 'inet', 'mtu', '1500', 'UP', 'BROADCAST',
+             'RUNNING', 'tcp', 'LISTEN', '0.0.0.0:22', 'root', '/usr/lib64',
+             'loaded', 'active', 'running']
+    target = size_mb * 1024 * 1024
+    written = 0
+    index = 0
+    while written < target:
+        path = os.path.join(root, 'insights_commands', 'cmd_%04d' % index)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            if index % 10 == 9:
+                data = os.urandom(256 * 1024)
+            else:
+                lines = [' '.join(rand.choice(words) for w in range(10))
+                         for l in range(4000)]
+                data = '\n'.join(lines)
+            f.write(data)
+        written += len(data)
+        index += 1
+    return written
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--size', type='int', default=100,
+                      help='approximate uncompressed archive size in MB')
+    parser.add_option('--threads', default='1,2,4',
+                      help='comma separated thread counts to try')
+    parser.add_option('--compressors', default='gz,bz2,xz',
+                      help='comma separated compressors to try')
+    options, args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='insights-bench-')
+    client = benchutil.setup_client(work_dir=work_dir)
+    import archive
+    from archive import InsightsArchive
+    from compression import compression_threads
+    rows = [('CPUs allowed (cpu_count and cgroup quota)', compression_threads(0))]
+    try:
+        for compressor in options.compressors.split(','):
+            for threads in [int(t) for t in options.threads.split(',')]:
+                client.config.set('insights-client', 'compression_threads', str(threads))
+                # don't let the quota hide what we asked for
+                archive.compression_threads = lambda configured: configured
+                arch = InsightsArchive(compressor=compressor)
+                size = build_tree(arch.archive_dir, options.size)
+                with benchutil.Timer() as t:
+                    tar_file = arch.create_tar_file()
+                ok = subprocess.call(['tar', 'tf', tar_file], stdout=open(os.devnull, 'w')) == 0
+                rows.append(('%s x%d seconds' % (compressor, threads), t.elapsed))
+                rows.append(('%s x%d MB/s' % (compressor, threads),
+                             size / 1048576.0 / max(t.elapsed, 0.001)))
+                rows.append(('%s x%d ratio' % (compressor, threads),
+                             float(os.path.getsize(tar_file)) / size))
+                rows.append(('%s x%d tar tf ok' % (compressor, threads), ok))
+                arch.delete_tmp_dir()
+    finally:
+        shutil.rmtree(work_dir, True)
+    benchutil.report('InsightsArchive.create_tar_file', rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Import time benchmark
+
+Times, in a fresh interpreter each time, importing the insights_client
+package on its own, each client module (including everything it pulls
+in), and running the quick --version and --validate commands end to end.
+Modules are reported slowest first with the number of modules they load,
+which shows what a subsystem costs the first time it is used.
+
+    python tests/benchmarks/bench_imports.py --runs 5
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import benchutil
+
+IMPORT = """
+import sys, time, json
+start = time.time()
+import %(module)s
+print json.dumps([time.time() - start, len(sys.modules)])
+"""
+
+COMMAND = """
+import os, sys, time, json
+start = time.time()
+import insights_client
+from insights_client.constants import InsightsConstants
+InsightsConstants.log_dir = %(log_dir)r
+sys.argv = ['insights-client', '--conf', os.devnull, '--silent'] + %(args)r
+try:
+    insights_client._main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([time.time() - start, len(sys.modules)]) + '\\n')
+"""
+
+
+def client_modules():
+    names = []
+    for name in sorted(os.listdir(benchutil.PACKAGE_DIR)):
+        if name.endswith('.py') and name != '__init__.py':
+            names.append('insights_client.' + name[:-3])
+    names.append('insights_client.containers')
+    return names
+
+
+def run(code, env, runs, stream='stdout'):
+    """
+    p50 seconds and modules loaded by code over runs fresh interpreters
+    """
+    times = []
+    modules = 0
+    for i in range(runs):
+        proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        lines = (out if stream == 'stdout' else err).strip().splitlines()
+        if not lines:
+            return None, err.strip().splitlines()[-1:]
+        elapsed, modules = json.loads(lines[-1])
+        times.append(elapsed)
+    return benchutil.percentile(times, 50), modules
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--runs', type='int', default=5,
+                      help='interpreter starts per measurement')
+    options, args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [benchutil.REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    rows = []
+    timings = []
+    for module in ['insights_client'] + client_modules():
+        elapsed, modules = run(IMPORT % {'module': module}, env, options.runs)
+        if elapsed is None:
+            rows.append((module, 'failed: %s' % ' '.join(modules)))
+            continue
+        timings.append((elapsed, module, modules))
+    for elapsed, module, modules in sorted(timings, reverse=True):
+        rows.append(('import %s (ms, modules)' % module,
+                     '%.1f  %d' % (elapsed * 1000, modules)))
+    benchutil.report('Module import time, p50 of %d' % options.runs, rows)
+
+    if os.geteuid() != 0:
+        print 'Skipping command timings, the client only runs as root'
+        return 0
+    log_dir = tempfile.mkdtemp()
+    rows = []
+    try:
+        for args in (['--version'], ['--validate']):
+            elapsed, modules = run(COMMAND % {'log_dir': log_dir, 'args': args},
+                                   env, options.runs, stream='stderr')
+            if elapsed is None:
+                rows.append((' '.join(args), 'failed: %s' % ' '.join(modules)))
+                continue
+            rows.append(('insights-client %s (ms, modules)' % ' '.join(args),
+                         '%.1f  %d' % (elapsed * 1000, modules)))
+    finally:
+        shutil.rmtree(log_dir)
+    benchutil.report('Quick commands, p50 of %d' % options.runs, rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
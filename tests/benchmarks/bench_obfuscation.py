@@ -0,0 +1,248 @@
+#!/usr/bin/python
+"""
+Obfuscation throughput benchmark for SOSCleaner
+
+Generates log corpora with tunable IP, FQDN and keyword density, then
+measures:
+  - _ip2db and _hn2db cost per call as the databases grow
+  - _clean_line throughput (lines per second) against those databases
+  - clean_report end to end over a generated report directory
+
+A per-call cost that grows with the database size points at a quadratic
+regression in the obfuscation path.
+
+    python tests/benchmarks/bench_obfuscation.py --db-sizes 100,1000,5000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import tempfile
+import optparse
+
+import benchutil
+
+WORDS = ['kernel:', 'systemd[1]:', 'Started', 'session', 'of', 'user', 'root',
+         'connection', 'from', 'port', 'accepted', 'closed', 'error', 'ok']
+
+
+class Corpus(object):
+    """
+    Generator of log-like lines with tunable sensitive-token density
+    """
+    def __init__(self, seed, distinct_ips, distinct_hosts, domains, keywords,
+                 ip_density, fqdn_density, keyword_density, words_per_line=12):
+        self.rand = random.Random(seed)
+        self.ips = ['%d.%d.%d.%d' % (self.rand.randint(11, 223), self.rand.randint(0, 255),
+                                     self.rand.randint(0, 255), self.rand.randint(1, 254))
+                    for i in range(distinct_ips)]
+        self.domains = domains
+        self.hosts = ['node%d.%s' % (i, domains[i % len(domains)])
+                      for i in range(distinct_hosts)]
+        self.keywords = keywords
+        self.ip_density = ip_density
+        self.fqdn_density = fqdn_density
+        self.keyword_density = keyword_density
+        self.words_per_line = words_per_line
+
+    def line(self):
+        out = []
+        for i in range(self.words_per_line):
+            r = self.rand.random()
+            if r < self.ip_density:
+                out.append(self.rand.choice(self.ips))
+            elif r < self.ip_density + self.fqdn_density:
+                out.append(self.rand.choice(self.hosts))
+            elif r < self.ip_density + self.fqdn_density + self.keyword_density:
+                out.append(self.rand.choice(self.keywords))
+            else:
+                out.append(self.rand.choice(WORDS))
+        return ' '.join(out) + '\n'
+
+    def lines(self, count):
+        return [self.line() for i in range(count)]
+
+    def write_report(self, report_dir, files, lines_per_file):
+        """
+        Write a fake report tree: a hostname file, an /etc/hosts and log files
+        """
+        os.makedirs(os.path.join(report_dir, 'etc'))
+        os.makedirs(os.path.join(report_dir, 'var', 'log'))
+        with open(os.path.join(report_dir, 'hostname'), 'w') as f:
+            f.write(self.hosts[0] + '\n')
+        with open(os.path.join(report_dir, 'etc', 'hosts'), 'w') as f:
+            for ip, host in zip(self.ips, self.hosts):
+                f.write('%s %s %s\n' % (ip, host, host.split('.')[0]))
+        for n in range(files):
+            with open(os.path.join(report_dir, 'var', 'log', 'bench%d.log' % n), 'w') as f:
+                for i in range(lines_per_file):
+                    f.write(self.line())
+
+
+class CleanerOptions(object):
+    """
+    Mirror of data_collector.CleanOptions without the InsightsClient config
+    """
+    def __init__(self, report_dir, domains, keyword_file):
+        self.report_dir = report_dir
+        self.domains = domains
+        self.files = []
+        self.quiet = True
+        self.keywords = [keyword_file]
+        self.hostname_path = None
+
+
+def new_cleaner(work_dir, domains=None, keywords=None):
+    from soscleaner import SOSCleaner
+    cleaner = SOSCleaner(quiet=True)
+    cleaner.report_dir = work_dir
+    cleaner._start_logging(os.path.join(work_dir, 'soscleaner.log'))
+    logging.getLogger('soscleaner').setLevel(logging.ERROR)
+    if domains:
+        cleaner.domains = domains
+        cleaner._domains2db()
+    if keywords:
+        for n, k in enumerate(keywords):
+            cleaner.kw_db[k] = 'keyword%d' % n
+        cleaner.kw_count = len(keywords)
+    return cleaner
+
+
+def _time_calls(fn, args):
+    start = time.time()
+    for a in args:
+        fn(a)
+    elapsed = time.time() - start
+    return elapsed / len(args) if args else 0.0
+
+
+def bench_db_scaling(work_dir, db_sizes, ops, domains):
+    """
+    Cost per _ip2db/_hn2db call, for hits and for inserts, at each db size
+    """
+    rows = []
+    rand = random.Random(0)
+    for size in db_sizes:
+        cleaner = new_cleaner(work_dir, domains=domains)
+        ips = ['%d.%d.%d.%d' % (11 + (i >> 24) % 200, (i >> 16) & 255, (i >> 8) & 255, i & 255)
+               for i in range(size + ops)]
+        hosts = ['node%d.%s' % (i, domains[i % len(domains)]) for i in range(size + ops)]
+        for ip in ips[:size]:
+            cleaner._ip2db(ip)
+        for hn in hosts[:size]:
+            cleaner._hn2db(hn)
+        ip_hits = [rand.choice(ips[:size]) for i in range(ops)]
+        hn_hits = [rand.choice(hosts[:size]) for i in range(ops)]
+        ip_hit = _time_calls(cleaner._ip2db, ip_hits)
+        hn_hit = _time_calls(cleaner._hn2db, hn_hits)
+        ip_new = _time_calls(cleaner._ip2db, ips[size:])
+        hn_new = _time_calls(cleaner._hn2db, hosts[size:])
+        rows.append(('db=%d _ip2db hit/insert (us)' % size,
+                     '%.2f / %.2f' % (ip_hit * 1e6, ip_new * 1e6)))
+        rows.append(('db=%d _hn2db hit/insert (us)' % size,
+                     '%.2f / %.2f' % (hn_hit * 1e6, hn_new * 1e6)))
+    return rows
+
+
+def bench_clean_line(work_dir, corpus, db_sizes, lines, domains, keywords):
+    """
+    _clean_line lines per second with the databases pre-populated
+    """
+    rows = []
+    sample = corpus.lines(lines)
+    for size in db_sizes:
+        cleaner = new_cleaner(work_dir, domains=domains, keywords=keywords)
+        for i in range(size):
+            cleaner._ip2db('%d.%d.%d.%d' % (11 + (i >> 24) % 200, (i >> 16) & 255,
+                                            (i >> 8) & 255, i & 255))
+            cleaner._hn2db('prefill%d.%s' % (i, domains[i % len(domains)]))
+        with benchutil.Timer() as t:
+            for l in sample:
+                cleaner._clean_line(l)
+        rows.append(('db=%d _clean_line lines/s' % size,
+                     lines / t.elapsed if t.elapsed else 0.0))
+    return rows
+
+
+def bench_clean_report(work_dir, corpus, files, lines_per_file, domains, keywords):
+    """
+    End-to-end clean_report over a generated report directory
+    """
+    report_dir = os.path.join(work_dir, 'report')
+    corpus.write_report(report_dir, files, lines_per_file)
+    keyword_file = os.path.join(work_dir, 'keywords')
+    with open(keyword_file, 'w') as f:
+        f.write('\n'.join(keywords))
+    from soscleaner import SOSCleaner
+    cleaner = SOSCleaner(quiet=True)
+    options = CleanerOptions(work_dir, domains, keyword_file)
+    with benchutil.Timer() as t:
+        result = cleaner.clean_report(options, report_dir)
+    logging.getLogger('soscleaner').setLevel(logging.ERROR)
+    total_lines = files * lines_per_file
+    own_rss, child_rss = benchutil.peak_rss_kb()
+    return [('clean_report files', files),
+            ('clean_report lines', total_lines),
+            ('clean_report wall (s)', t.elapsed),
+            ('clean_report lines/s', total_lines / t.elapsed if t.elapsed else 0.0),
+            ('ip db size', len(cleaner.ip_db)),
+            ('hostname db size', len(cleaner.hn_db)),
+            ('archive bytes', os.path.getsize(result[0])),
+            ('peak RSS self (KB)', own_rss),
+            ('peak RSS children (KB)', child_rss)]
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--files', type='int', default=20,
+                      help='number of log files in the generated report')
+    parser.add_option('--lines', type='int', default=2000,
+                      help='lines per generated log file')
+    parser.add_option('--ip-density', type='float', default=0.1,
+                      help='fraction of words that are IP addresses')
+    parser.add_option('--fqdn-density', type='float', default=0.1,
+                      help='fraction of words that are FQDNs')
+    parser.add_option('--keyword-density', type='float', default=0.02,
+                      help='fraction of words that are keywords')
+    parser.add_option('--distinct-ips', type='int', default=500,
+                      help='distinct IP addresses in the corpus')
+    parser.add_option('--distinct-hosts', type='int', default=500,
+                      help='distinct hostnames in the corpus')
+    parser.add_option('--domains', default='example.net,corp.example.org,lab.example.io',
+                      help='comma separated domains to obfuscate')
+    parser.add_option('--keywords', type='int', default=20,
+                      help='number of keywords to obfuscate')
+    parser.add_option('--db-sizes', default='100,1000,5000',
+                      help='comma separated database sizes for the scaling runs')
+    parser.add_option('--ops', type='int', default=500,
+                      help='calls per database scaling measurement')
+    parser.add_option('--skip-report', action='store_true', default=False,
+                      help='skip the end-to-end clean_report run')
+    options, args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='insights-bench-')
+    benchutil.setup_client(work_dir=work_dir)
+    domains = options.domains.split(',')
+    keywords = ['secretproject%d' % i for i in range(options.keywords)]
+    db_sizes = [int(s) for s in options.db_sizes.split(',')]
+    corpus = Corpus(0, options.distinct_ips, options.distinct_hosts, domains, keywords,
+                    options.ip_density, options.fqdn_density, options.keyword_density)
+    try:
+        benchutil.report('_ip2db / _hn2db scaling',
+                         bench_db_scaling(work_dir, db_sizes, options.ops, domains))
+        benchutil.report('_clean_line throughput',
+                         bench_clean_line(work_dir, corpus, db_sizes, options.lines,
+                                          domains, keywords))
+        if not options.skip_report:
+            benchutil.report('SOSCleaner.clean_report',
+                             bench_clean_report(work_dir, corpus, options.files,
+                                                options.lines, domains, keywords))
+    finally:
+        shutil.rmtree(work_dir, True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""
+Client startup benchmark
+
+Times importing the insights_client package in a fresh interpreter, as
+every invocation does, with stand-in docker and atomic commands first on
+PATH that take --probe-latency seconds to answer, like docker info does
+with a real daemon.  'lazy' is a plain import, which no longer probes;
+'probed' also asks for docker and atomic, which is what importing used
+to cost and what container mode still pays.  The stand-ins log each call
+so the report shows how many probes ran.
+
+    python tests/benchmarks/bench_startup.py --probe-latency 0.1 --runs 10
+"""
+import os
+import sys
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+import benchutil
+
+STAND_IN = """#!/bin/sh
+echo "$0 $@" >> %(log)s
+sleep %(latency)s
+exit 0
+"""
+
+MODES = (('lazy', 'import insights_client'),
+         ('probed', 'import insights_client\n'
+                    'from insights_client import containers\n'
+                    'containers.have_docker()\n'
+                    'containers.have_atomic()'))
+
+
+def make_stand_ins(bin_dir, log, latency):
+    for name in ('docker', 'atomic'):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(STAND_IN % {'log': log, 'latency': latency})
+        os.chmod(path, 0o755)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--probe-latency', type='float', default=0.1,
+                      help='seconds the stand-in docker and atomic take')
+    parser.add_option('--runs', type='int', default=10,
+                      help='interpreter starts per mode')
+    options, args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        bin_dir = os.path.join(work_dir, 'bin')
+        os.mkdir(bin_dir)
+        log = os.path.join(work_dir, 'probes.log')
+        make_stand_ins(bin_dir, log, options.probe_latency)
+        env = dict(os.environ)
+        env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [benchutil.REPO_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+        rows = []
+        for name, code in MODES:
+            open(log, 'w').close()
+            times = []
+            for i in range(options.runs):
+                with benchutil.Timer() as t:
+                    subprocess.check_call([sys.executable, '-c', code], env=env)
+                times.append(t.elapsed)
+            with open(log) as f:
+                probes = len(f.readlines())
+            rows.append(('%s startup p50 (ms)' % name,
+                         benchutil.percentile(times, 50) * 1000))
+            rows.append(('%s startup max (ms)' % name, max(times) * 1000))
+            rows.append(('%s probes per start' % name,
+                         '%.1f' % (float(probes) / options.runs)))
+        benchutil.report('import insights_client, %.0f ms probes' %
+                         (options.probe_latency * 1000), rows)
+    finally:
+        shutil.rmtree(work_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Shared helpers for the offline benchmark scripts
+"""
+import os
+import sys
+import time
+import resource
+import optparse
+import logging
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PACKAGE_DIR = os.path.join(REPO_DIR, 'insights_client')
+ETC_DIR = os.path.join(REPO_DIR, 'etc')
+
+
+def setup_path():
+    """
+    Make the client modules importable the same way they import each other
+    (implicit relative imports), without running the package __init__
+    """
+    if PACKAGE_DIR not in sys.path:
+        sys.path.insert(0, PACKAGE_DIR)
+
+
+def setup_client(work_dir=None, **overrides):
+    """
+    Populate the global InsightsClient object with default options and config
+    If work_dir is given, state files the client writes are redirected there
+    """
+    setup_path()
+    from client_config import InsightsClient, set_up_options, parse_config_file
+    from constants import InsightsConstants as constants
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    options, args = parser.parse_args([])
+    for key in overrides:
+        setattr(options, key, overrides[key])
+    InsightsClient.options = options
+    InsightsClient.config = parse_config_file(os.devnull)
+    InsightsClient.argv = [sys.argv[0]]
+    # use the sed expressions shipped in the tree rather than /etc
+    constants.default_sed_file = os.path.join(ETC_DIR, '.exp.sed')
+    if work_dir:
+        for attr in ('machine_id_file', 'docker_group_id_file',
+                     'lastupload_file', 'upload_stats_file', 'registered_file',
+                     'unregistered_file', 'default_log_file'):
+            setattr(constants, attr,
+                    os.path.join(work_dir, os.path.basename(getattr(constants, attr))))
+    logging.getLogger(constants.app_name).setLevel(logging.ERROR)
+    return InsightsClient
+
+
+def percentile(samples, pct):
+    """
+    Nearest-rank percentile of a list of samples
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process and its reaped children, in KB
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own, children
+
+
+class Timer(object):
+    """
+    Wall clock timer usable as a context manager
+    """
+    def __init__(self):
+        self.start = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.time() - self.start
+
+
+def report(title, rows):
+    """
+    Print a two-column report
+    """
+    print '=== %s ===' % title
+    width = max([len(r[0]) for r in rows]) if rows else 0
+    for name, value in rows:
+        if isinstance(value, float):
+            value = '%.4f' % value
+        print '%s  %s' % (name.ljust(width), value)
+    print
@@ -0,0 +1,69 @@
+import os
+import json
+import errno
+import shutil
+import optparse
+import subprocess
+import pytest
+
+from insights_client.archive import InsightsArchive
+from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+
+
+@pytest.fixture
+def client():
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    InsightsClient.options = parser.parse_args([])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    return InsightsClient
+
+
+@pytest.fixture
+def target_archive():
+    arch = InsightsArchive(compressor='none', target_name='container-1')
+    with open(os.path.join(arch.archive_dir, 'hostname'), 'w') as f:
+        f.write('container-1\n')
+    yield arch.create_tar_file()
+    arch.delete_tmp_dir()
+
+
+def test_uber_archive_links_target_archives(client, target_archive):
+    full_archive = InsightsArchive(compressor='gz')
+    try:
+        linked = full_archive.link_file(target_archive)
+        assert os.stat(linked).st_ino == os.stat(target_archive).st_ino
+        shutil.rmtree(full_archive.cmd_dir)
+        full_archive.add_metadata_to_archive(json.dumps({'systems': []}), 'metadata.json')
+        tar_file = full_archive.create_tar_file(full_archive=True)
+        listing = subprocess.check_output(['tar', 'tf', tar_file]).split()
+        assert sorted(listing) == ['./', './' + os.path.basename(target_archive),
+                                   './metadata.json']
+    finally:
+        full_archive.delete_tmp_dir()
+
+
+def test_link_never_replaces_a_file(client, target_archive):
+    full_archive = InsightsArchive(compressor='gz')
+    try:
+        linked = full_archive.link_file(target_archive)
+        with pytest.raises(OSError) as e:
+            full_archive.link_file(target_archive)
+        assert e.value.errno == errno.EEXIST
+        assert os.stat(linked).st_ino == os.stat(target_archive).st_ino
+    finally:
+        full_archive.delete_tmp_dir()
+
+
+def test_link_across_filesystems_copies(client, target_archive, monkeypatch):
+    def cross_device_link(src, dst):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', cross_device_link)
+    full_archive = InsightsArchive(compressor='gz')
+    try:
+        copied = full_archive.link_file(target_archive)
+        assert os.stat(copied).st_ino != os.stat(target_archive).st_ino
+        with open(copied, 'rb') as a, open(target_archive, 'rb') as b:
+            assert a.read() == b.read()
+    finally:
+        full_archive.delete_tmp_dir()
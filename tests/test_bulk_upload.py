@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import pytest
+
+import insights_client
+from insights_client.bulk_upload import BulkUploader, find_archives, archive_machine_id
+from insights_client.compression import BlockCompressor
+from upload_endpoint import UploadEndpoint, configure_client
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def _make_archive(directory, name, members, mode='w:gz', top=None):
+    src = tempfile.mkdtemp(dir=directory)
+    for member, data in members.items():
+        path = os.path.join(src, name if top is None else top, member)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+    suffix = {'w:gz': '.tar.gz', 'w:bz2': '.tar.bz2', 'w': '.tar'}[mode]
+    tar_path = os.path.join(directory, name + suffix)
+    with tarfile.open(tar_path, mode) as tar:
+        tar.add(src, arcname='.')
+    shutil.rmtree(src)
+    return tar_path
+
+
+def _host_archive(directory, host, mode='w:gz'):
+    return _make_archive(directory, 'insights-%s' % host,
+                         {'insights_data/machine-id': 'id-%s\n' % host,
+                          'etc/hostname': host}, mode)
+
+
+def test_machine_id_from_archive(work_dir):
+    assert archive_machine_id(_host_archive(work_dir, 'a')) == 'id-a'
+    assert archive_machine_id(_host_archive(work_dir, 'b', 'w:bz2')) == 'id-b'
+    uber = _make_archive(work_dir, 'uber', {'metadata.json':
+                                            json.dumps({'system_id': 'group-1'})},
+                         top='')
+    assert archive_machine_id(uber) == 'group-1'
+
+
+def test_machine_id_from_multi_threaded_bzip2(work_dir):
+    tar_path = _host_archive(work_dir, 'c', 'w')
+    with open(tar_path, 'rb') as src:
+        with open(tar_path + '.bz2', 'wb') as dest:
+            BlockCompressor('bz2', 3, block_size=512).compress(src, dest)
+    assert archive_machine_id(tar_path + '.bz2') == 'id-c'
+
+
+def test_manifest(work_dir):
+    with open(os.path.join(work_dir, 'manifest'), 'w') as f:
+        f.write('# carried from site 3\n'
+                'one.tar.gz\n'
+                '/data/two.tar.gz  7f1c9a2e\n')
+    assert find_archives(os.path.join(work_dir, 'manifest')) == [
+        (os.path.join(work_dir, 'one.tar.gz'), None),
+        ('/data/two.tar.gz', '7f1c9a2e')]
+
+
+def test_bulk_upload_routes_and_retries(work_dir, monkeypatch):
+    import time
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    archives_dir = os.path.join(work_dir, 'archives')
+    os.mkdir(archives_dir)
+    hosts = ['host%d' % i for i in range(12)]
+    for host in hosts:
+        _host_archive(archives_dir, host)
+    with open(os.path.join(archives_dir, 'broken.tar.gz'), 'w') as f:
+        f.write('not a tarball')
+    endpoint = UploadEndpoint(statuses=[503, 500]).start()
+    try:
+        client = configure_client(endpoint, work_dir)
+        client.options.retries = 3
+        uploader = BulkUploader(insights_client.get_connection(), workers=4, retries=3)
+        rc = uploader.run(find_archives(archives_dir))
+    finally:
+        endpoint.stop()
+    assert rc == 1
+    failed = [r for r in uploader.results if r['error']]
+    assert [os.path.basename(r['archive']) for r in failed] == ['broken.tar.gz']
+    routed = sorted(u['path'].rsplit('/', 1)[-1] for u in endpoint.uploads
+                    if 'filename' in u)
+    # two uploads were turned away and retried
+    assert len(routed) == len(hosts) + 2
+    assert sorted(set(routed)) == sorted('id-' + h for h in hosts)
+    # relayed archives don't count towards this host's upload throughput
+    assert not os.path.exists(insights_client.constants.upload_stats_file)
@@ -0,0 +1,127 @@
+import os
+import gzip
+import shutil
+import tarfile
+import tempfile
+import subprocess
+import optparse
+import pytest
+
+from insights_client import archive, compression
+from insights_client.compression import BlockCompressor, cgroup_cpu_quota, compression_threads
+from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def _payload(work_dir):
+    path = os.path.join(work_dir, 'payload')
+    with open(path, 'wb') as f:
+        for i in range(40):
+            f.write(os.urandom(20000))
+            f.write('insights ' * 5000)
+    return path
+
+
+@pytest.mark.parametrize('compressor', ['gz', 'bz2'])
+def test_blocks_read_back_as_one_stream(work_dir, compressor):
+    src = _payload(work_dir)
+    dest = src + '.' + compressor
+    with open(src, 'rb') as f:
+        with open(dest, 'wb') as out:
+            total = BlockCompressor(compressor, 3, block_size=65536).compress(f, out)
+    assert total == os.path.getsize(src)
+    tool = {'gz': 'gzip', 'bz2': 'bzip2'}[compressor]
+    data = subprocess.check_output([tool, '-dc', dest])
+    with open(src, 'rb') as f:
+        assert data == f.read()
+    if compressor == 'gz':
+        assert gzip.open(dest).read() == data
+
+
+def test_cgroup_quota(work_dir, monkeypatch):
+    cpu_max = os.path.join(work_dir, 'cpu.max')
+    monkeypatch.setattr(compression, 'CGROUP_V2_CPU_MAX', cpu_max)
+    monkeypatch.setattr(compression, 'CGROUP_V1_QUOTA', os.path.join(work_dir, 'none'))
+    assert cgroup_cpu_quota() is None
+    with open(cpu_max, 'w') as f:
+        f.write('max 100000\n')
+    assert cgroup_cpu_quota() is None
+    with open(cpu_max, 'w') as f:
+        f.write('150000 100000\n')
+    assert cgroup_cpu_quota() == 1.5
+    monkeypatch.setattr(compression.multiprocessing, 'cpu_count', lambda: 16)
+    assert compression_threads(0) == 2
+    assert compression_threads(1) == 1
+
+
+@pytest.mark.parametrize('compressor', ['gz', 'bz2', 'xz'])
+def test_parallel_tar_file(work_dir, compressor, monkeypatch):
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    InsightsClient.options = parser.parse_args([])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    monkeypatch.setattr(archive, 'compression_threads', lambda configured: 3)
+    arch = archive.InsightsArchive(compressor=compressor)
+    arch.delete_tmp_dir()
+    arch.tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    arch.archive_dir = arch.create_archive_dir()
+    shutil.copy(_payload(work_dir), arch.archive_dir)
+    tar_file = arch.create_tar_file()
+    listing = subprocess.check_output(['tar', 'tf', tar_file]).split()
+    assert './%s/payload' % arch.archive_name in listing
+    assert './' + os.path.basename(tar_file) not in listing
+
+
+@pytest.mark.parametrize('compressor,level', [('gz', None), ('bz2', None),
+                                               ('gz', 1), ('bz2', 9)])
+def test_default_tar_file_reads_back_with_tarfile(work_dir, compressor, level):
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    InsightsClient.options = parser.parse_args([])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    arch = archive.InsightsArchive(compressor=compressor)
+    # a level, as picked by the auto compressor, goes through compress_stream
+    arch.compression_level = level
+    arch.delete_tmp_dir()
+    arch.tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    arch.archive_dir = arch.create_archive_dir()
+    payload = _payload(work_dir)
+    shutil.copy(payload, arch.archive_dir)
+    tar_file = arch.create_tar_file()
+    with tarfile.open(tar_file, 'r:*') as tar:
+        if level is not None:
+            # written once, by compress_stream, which leaves the tarball out
+            assert './' + os.path.basename(tar_file) not in tar.getnames()
+        data = tar.extractfile('./%s/payload' % arch.archive_name).read()
+    with open(payload, 'rb') as f:
+        assert data == f.read()
+
+
+def test_auto_compressor_follows_link_speed(work_dir):
+    tree = os.path.join(work_dir, 'tree')
+    os.mkdir(tree)
+    with open(os.path.join(tree, 'messages'), 'w') as f:
+        f.write('kernel: eth0: link up, 1000Mbps, full-duplex\n' * 20000)
+    assert compression.choose_compressor(tree, 1, None) == ('gz', None)
+    # a dial-up link: spend the CPU
+    assert compression.choose_compressor(tree, 1, 2000)[0] in ('xz', 'bz2')
+    # a link faster than any compressor: don't bother
+    assert compression.choose_compressor(tree, 1, 1e12) == ('none', None)
+
+
+def test_upload_throughput_average(work_dir, monkeypatch):
+    from insights_client import utilities
+    from insights_client.constants import InsightsConstants as constants
+    monkeypatch.setattr(constants, 'upload_stats_file', os.path.join(work_dir, '.uploadstats'))
+    assert utilities.read_upload_throughput() is None
+    utilities.write_upload_throughput(1000.0)
+    assert utilities.read_upload_throughput() == 1000.0
+    utilities.write_upload_throughput(2000.0)
+    assert utilities.read_upload_throughput() == pytest.approx(
+        1000 + 1000 * constants.upload_stats_weight)
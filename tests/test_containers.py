@@ -0,0 +1,55 @@
+import os
+import optparse
+import pytest
+
+from insights_client import containers
+from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    calls = []
+
+    def run(cmdline):
+        calls.append(cmdline)
+        if cmdline.startswith('docker'):
+            raise OSError('No such file or directory')
+        return 0
+    monkeypatch.setattr(containers, 'run_command_very_quietly', run)
+    monkeypatch.setattr(containers, 'HaveDocker', None)
+    monkeypatch.setattr(containers, 'HaveDockerException', None)
+    monkeypatch.setattr(containers, 'HaveAtomic', None)
+    monkeypatch.setattr(containers, 'HaveAtomicException', None)
+    return calls
+
+
+def test_probes_run_once_on_first_use(probes):
+    assert probes == []
+    assert not containers.have_docker()
+    assert not containers.have_docker()
+    assert containers.have_atomic()
+    assert containers.have_atomic()
+    assert probes == ['docker info', 'atomic --version']
+    assert isinstance(containers.HaveDockerException, OSError)
+
+
+def test_without_docker_there_are_no_targets(probes):
+    assert containers.get_targets() == []
+    assert containers.open_image('abc') is None
+    assert probes == ['docker info']
+
+
+def test_failed_image_listing_is_not_recorded(probes, monkeypatch):
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    monkeypatch.setattr(InsightsClient, 'options', parser.parse_args([])[0], raising=False)
+    monkeypatch.setattr(InsightsClient, 'config', parse_config_file(os.devnull), raising=False)
+    monkeypatch.setattr(containers, 'HaveDocker', True)
+    monkeypatch.setattr(containers, 'ListedImages', None)
+    monkeypatch.setattr(containers, '_docker_all_image_ids', lambda: None)
+    monkeypatch.setattr(containers, '_docker_all_container_ids', lambda: [])
+    assert containers.get_targets() == []
+    assert containers.listed_images() is None
+    monkeypatch.setattr(containers, '_docker_all_image_ids', lambda: ['abc'])
+    assert containers.get_targets() == [{'type': 'docker_image', 'name': 'abc'}]
+    assert containers.listed_images() == ['abc']
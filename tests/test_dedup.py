@@ -0,0 +1,91 @@
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import filecmp
+import pytest
+
+from insights_client.dedup import DedupArchive
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def _restore_target(archive_dir, manifest, dest):
+    """
+    Rebuild a target's files under dest from a deduplicated archive,
+    the way the server unpacks it
+    """
+    with open(os.path.join(archive_dir, 'targets', manifest)) as f:
+        manifest = json.load(f)
+    objects_dir = os.path.join(archive_dir, 'objects')
+    for entry in manifest['files']:
+        path = os.path.join(dest, entry['name'])
+        if entry['type'] == 'dir':
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            continue
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if entry['type'] == 'file':
+            digest = entry['digest']
+            shutil.copyfile(os.path.join(objects_dir, digest[:2], digest), path)
+            os.chmod(path, entry['mode'])
+        elif entry['type'] == 'symlink':
+            os.symlink(entry['target'], path)
+        elif entry['type'] == 'link':
+            os.link(os.path.join(dest, entry['target']), path)
+
+
+def _target(work_dir, name, files):
+    src = os.path.join(work_dir, 'src-' + name)
+    for path, data in files.items():
+        full = os.path.join(src, name, path)
+        if not os.path.isdir(os.path.dirname(full)):
+            os.makedirs(os.path.dirname(full))
+        with open(full, 'w') as f:
+            f.write(data)
+    os.symlink('os-release', os.path.join(src, name, 'etc', 'system-release'))
+    tar_file = os.path.join(work_dir, name + '.tar')
+    with tarfile.open(tar_file, 'w') as tar:
+        tar.add(src, arcname='.')
+    return src, tar_file
+
+
+def test_identical_files_stored_once(work_dir):
+    base = {'etc/os-release': 'NAME="Red Hat Enterprise Linux Server"\n' * 50,
+            'insights_commands/rpm_-qa': 'bash-4.2.46-20.el7_2.x86_64\n' * 500}
+    targets = []
+    for i in range(5):
+        files = dict(base)
+        files['etc/hostname'] = 'container-%d\n' % i
+        files['insights_data/machine-id'] = 'id-%d' % i
+        targets.append(_target(work_dir, 'insights-container-%d' % i, files))
+
+    uber = os.path.join(work_dir, 'uber')
+    dedup = DedupArchive(uber)
+    for i, (src, tar_file) in enumerate(targets):
+        dedup.add_target(tar_file, 'id-%d' % i)
+
+    shared = sum(len(d) for d in base.values())
+    assert dedup.total_bytes - dedup.stored_bytes == shared * 4
+    objects = [f for d, _, fs in os.walk(dedup.objects_dir) for f in fs]
+    assert len(objects) == 2 + 5 + 5
+
+    src, tar_file = targets[3]
+    with open(os.path.join(dedup.targets_dir, 'insights-container-3.json')) as f:
+        assert json.load(f)['system_id'] == 'id-3'
+    dest = os.path.join(work_dir, 'restored')
+    _restore_target(uber, 'insights-container-3.json', dest)
+    restored = os.path.join(dest, 'insights-container-3')
+    original = os.path.join(src, 'insights-container-3')
+    for path in ('etc/os-release', 'etc/hostname', 'insights_commands/rpm_-qa',
+                 'insights_data/machine-id'):
+        assert filecmp.cmp(os.path.join(original, path), os.path.join(restored, path),
+                           shallow=False)
+    assert os.readlink(os.path.join(restored, 'etc/system-release')) == 'os-release'
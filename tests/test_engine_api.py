@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import SocketServer
+import BaseHTTPServer
+import pytest
+
+from insights_client.containers.engine_api import DockerEngineClient, DockerEngineError
+
+IMAGES = [{'Id': 'sha256:aaa', 'RepoTags': ['rhel7:latest', 'rhel7:7.4']},
+          {'Id': 'sha256:bbb', 'RepoTags': ['<none>:<none>']},
+          {'Id': 'sha256:aaa', 'RepoTags': ['rhel7:latest', 'rhel7:7.4']}]
+CONTAINERS = [{'Id': 'c1', 'Names': ['/web'], 'ImageID': 'sha256:aaa'},
+              {'Id': 'c2', 'Names': ['/db'], 'ImageID': 'sha256:bbb'}]
+INSPECT = {'/images/sha256%3Accc/json': {'Id': 'sha256:ccc', 'RepoTags': ['ubi8:latest']},
+           '/containers/c3/json': {'Id': 'c3', 'Name': '/cache'}}
+
+
+class EngineHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'unix'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        routes = {'/_ping': 'OK',
+                  '/info': {'Driver': 'overlay2'},
+                  '/images/json': IMAGES,
+                  '/containers/json?all=1': CONTAINERS}
+        routes.update(INSPECT)
+        if self.path not in routes:
+            status, body = 404, {'message': 'no such object'}
+        else:
+            status, body = 200, routes[self.path]
+        body = body if isinstance(body, str) else json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeDockerd(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        SocketServer.UnixStreamServer.__init__(self, path, EngineHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+
+
+@pytest.fixture
+def dockerd():
+    work_dir = tempfile.mkdtemp()
+    server = FakeDockerd(os.path.join(work_dir, 'docker.sock'))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(work_dir)
+
+
+def test_listing_and_display_names_use_one_connection(dockerd):
+    client = DockerEngineClient(dockerd.server_address)
+    assert client.ping()
+    assert client.image_ids() == ['sha256:aaa', 'sha256:bbb']
+    assert client.container_ids() == ['c1', 'c2']
+    assert client.storage_driver() == 'overlay2'
+    # answered from the listings, no inspect round trips
+    assert client.display_name('sha256:aaa', 'image') == 'rhel7:latest'
+    assert client.display_name('sha256:bbb', 'image') == 'sha256:bbb'
+    assert client.display_name('c2', 'container') == 'db'
+    assert dockerd.requests == ['/_ping', '/images/json', '/containers/json?all=1', '/info']
+    assert dockerd.connections == 1
+    client.close()
+
+
+def test_inspect(dockerd):
+    client = DockerEngineClient(dockerd.server_address)
+    assert client.inspect('sha256:ccc')['RepoTags'] == ['ubi8:latest']
+    assert client.inspect('missing', 'container') is None
+    assert client.display_name('c3', 'container') == 'cache'
+    assert client.display_name('sha256:ccc', 'image') == 'ubi8:latest'
+    assert dockerd.connections == 1
+
+
+def test_reconnects_after_the_daemon_drops_the_connection(dockerd):
+    client = DockerEngineClient(dockerd.server_address)
+    assert client.info()['Driver'] == 'overlay2'
+    client.conn.sock.close()
+    assert client.info()['Driver'] == 'overlay2'
+    assert dockerd.connections == 2
+
+
+def test_unreachable_daemon():
+    client = DockerEngineClient('/nonexistent/docker.sock')
+    assert not client.ping()
+    with pytest.raises(DockerEngineError):
+        client.info()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import pytest
+
+import insights_client
+from insights_client.image_cache import ImageCache, rules_key
+from upload_endpoint import UploadEndpoint, configure_client
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def _archive_meta(work_dir, image_id):
+    tar_file = os.path.join(work_dir, 'insights-%s.tar' % image_id)
+    with open(tar_file, 'w') as f:
+        f.write('archive of ' + image_id)
+    return {'type': 'image',
+            'product': 'Docker',
+            'docker_id': image_id,
+            'display_name': 'rhel7:latest',
+            'system_id': 'system-' + image_id,
+            'tar_file': tar_file}
+
+
+def test_rules_key_changes_with_rules_and_remove_conf():
+    key = rules_key({'version': '1.0'}, None)
+    assert key == rules_key({'version': '1.0'}, None)
+    assert key != rules_key({'version': '1.1'}, None)
+    assert key != rules_key({'version': '1.0'}, {'files': ['/etc/shadow']})
+
+
+def test_rules_key_changes_with_branch_info_and_obfuscation():
+    key = rules_key({'version': '1.0'}, None, {'remote_branch': -1, 'remote_leaf': -1})
+    assert key != rules_key({'version': '1.0'}, None, {'remote_branch': 3, 'remote_leaf': 7})
+    assert key != rules_key({'version': '1.0'}, None, {'remote_branch': -1, 'remote_leaf': -1},
+                            obfuscate=True)
+    assert key != rules_key({'version': '1.0'}, None, {'remote_branch': -1, 'remote_leaf': -1},
+                            obfuscate=True, obfuscate_hostname=True)
+
+
+def test_store_and_lookup(work_dir):
+    cache = ImageCache(os.path.join(work_dir, 'cache'))
+    meta = _archive_meta(work_dir, 'abc')
+    assert cache.lookup('abc', 'k1') is None
+    assert cache.store('abc', 'k1', meta)
+    # the per-target archive goes away with its temporary directory
+    os.remove(meta['tar_file'])
+
+    cached = cache.lookup('abc', 'k1')
+    assert cached['system_id'] == 'system-abc'
+    assert cached['tar_file'].startswith(cache.cache_dir)
+    with open(cached['tar_file']) as f:
+        assert f.read() == 'archive of abc'
+
+
+def test_stale_entry_is_dropped(work_dir):
+    cache = ImageCache(os.path.join(work_dir, 'cache'))
+    cache.store('abc', 'k1', _archive_meta(work_dir, 'abc'))
+    assert cache.lookup('abc', 'k2') is None
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_prune_removes_gone_images(work_dir):
+    cache = ImageCache(os.path.join(work_dir, 'cache'))
+    cache.store('abc', 'k1', _archive_meta(work_dir, 'abc'))
+    cache.store('def', 'k1', _archive_meta(work_dir, 'def'))
+    cache.prune(['def'])
+    assert cache.lookup('abc', 'k1') is None
+    assert cache.lookup('def', 'k1') is not None
+
+
+def test_cached_images_are_not_collected(work_dir, monkeypatch):
+    endpoint = UploadEndpoint().start()
+    try:
+        configure_client(endpoint, work_dir)
+        monkeypatch.setattr(insights_client, 'docker_display_name',
+                            lambda name, kind: 'rhel7:7.4')
+        monkeypatch.setattr(insights_client, 'listed_images',
+                            lambda: ['abc', 'def', 'sha256:saved'])
+        cache = ImageCache()
+        cache.store('abc', 'k1', _archive_meta(work_dir, 'abc'))
+        targets = [{'type': 'docker_image', 'name': 'abc'},
+                   {'type': 'docker_image', 'name': 'def'},
+                   {'type': 'docker_container', 'name': 'c1'},
+                   {'type': 'host', 'name': None}]
+        # root file systems change in place, they are always collected
+        cache.store('/srv/rootfs/web', 'k1', _archive_meta(work_dir, 'web'))
+        targets.insert(2, {'type': 'docker_image', 'name': '/srv/rootfs/web',
+                           'rootfs': '/srv/rootfs/web'})
+        # nor are images read from docker save tarballs, even if docker has them too
+        cache.store('sha256:saved', 'k1', _archive_meta(work_dir, 'saved'))
+        targets.insert(3, {'type': 'docker_image', 'name': 'sha256:saved',
+                           'archive': '/srv/images.tar', 'display_name': 'saved:1'})
+
+        remaining, cached = insights_client._cached_images(cache, 'k1', targets)
+        assert [t['name'] for t in remaining] == ['def', '/srv/rootfs/web', 'sha256:saved',
+                                                  'c1', None]
+        assert len(cached) == 1
+        assert cached[0]['docker_id'] == 'abc'
+        assert cached[0]['display_name'] == 'rhel7:7.4'
+    finally:
+        endpoint.stop()
+
+
+def test_cache_is_kept_when_images_could_not_be_listed(work_dir, monkeypatch):
+    endpoint = UploadEndpoint().start()
+    try:
+        configure_client(endpoint, work_dir)
+        cache = ImageCache()
+        cache.store('abc', 'k1', _archive_meta(work_dir, 'abc'))
+        for listing in (None, []):
+            monkeypatch.setattr(insights_client, 'listed_images', lambda: listing)
+            insights_client._cached_images(cache, 'k1', [{'type': 'host', 'name': None}])
+            assert cache.lookup('abc', 'k1') is not None
+    finally:
+        endpoint.stop()
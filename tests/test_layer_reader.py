@@ -0,0 +1,141 @@
+import os
+import json
+import stat
+import hashlib
+import pytest
+
+from insights_client.constants import InsightsConstants as constants
+from insights_client.insights_spec import InsightsFile
+from insights_client.data_collector import DataCollector
+from insights_client.containers.layer_reader import (LayerReader, image_layers,
+                                                     container_layers)
+
+
+def write(path, content=''):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def layers(tmpdir):
+    lower = str(tmpdir.mkdir('lower'))
+    upper = str(tmpdir.mkdir('upper'))
+    write(os.path.join(lower, 'etc/hosts'), 'lower hosts\n')
+    write(os.path.join(lower, 'etc/removed'), 'gone\n')
+    write(os.path.join(lower, 'etc/opaque/old'), 'hidden\n')
+    write(os.path.join(lower, 'etc/merged/a'), 'a\n')
+    write(os.path.join(lower, 'etc/redhat-release'), 'Red Hat\n')
+    os.symlink('/etc/redhat-release', os.path.join(lower, 'etc/system-release'))
+    os.symlink('merged', os.path.join(lower, 'etc/alias'))
+    write(os.path.join(upper, 'etc/hosts'), 'upper hosts\n')
+    write(os.path.join(upper, 'etc/.wh.removed'))
+    write(os.path.join(upper, 'etc/opaque/.wh..wh..opq'))
+    write(os.path.join(upper, 'etc/opaque/new'), 'new\n')
+    write(os.path.join(upper, 'etc/merged/b'), 'b\n')
+    return LayerReader([upper, lower])
+
+
+def test_top_layer_wins(layers):
+    assert open(layers.resolve('/etc/hosts')).read() == 'upper hosts\n'
+    assert open(layers.resolve('/etc/merged/a')).read() == 'a\n'
+    assert layers.listdir('/etc/merged') == ['a', 'b']
+
+
+def test_whiteouts_hide_lower_layers(layers):
+    assert layers.resolve('/etc/removed') is None
+    assert layers.resolve('/etc/opaque/old') is None
+    assert layers.resolve('/etc/opaque/new') is not None
+    assert layers.listdir('/etc/opaque') == ['new']
+    assert 'removed' not in layers.listdir('/etc')
+
+
+def test_overlay_device_whiteouts(layers):
+    try:
+        os.mknod(os.path.join(layers.layers[0], 'etc/redhat-release'),
+                 stat.S_IFCHR | 0o600, os.makedev(0, 0))
+    except OSError:
+        pytest.skip('needs root to make device nodes')
+    assert layers.resolve('/etc/redhat-release') is None
+    assert 'redhat-release' not in layers.listdir('/etc')
+
+
+def test_symlinks_stay_inside_the_image(layers):
+    assert open(layers.resolve('/etc/system-release')).read() == 'Red Hat\n'
+    assert open(layers.resolve('/etc/alias/b')).read() == 'b\n'
+    assert layers.resolve('/etc/merged/../hosts') == layers.resolve('/etc/hosts')
+    assert layers.resolve('/etc') is None
+    assert layers.resolve('/etc/hosts/nothing') is None
+
+
+def test_expand_matches_like_expand_paths(layers):
+    assert layers.expand('/etc/merged/.*') == ['/etc/merged/a', '/etc/merged/b']
+    assert layers.expand('/missing/.*') == []
+
+
+def test_mount_only_on_demand(layers):
+    calls = []
+    layers.mount = lambda: calls.append(1) or '/mnt/image'
+    assert calls == []
+    assert layers.mount_point() == '/mnt/image'
+    assert layers.mount_point() == '/mnt/image'
+    assert calls == [1]
+
+
+def test_files_are_read_through_the_layers(layers, tmpdir, monkeypatch):
+    sed_file = tmpdir.join('empty.sed')
+    sed_file.write('')
+    monkeypatch.setattr(constants, 'default_sed_file', str(sed_file))
+    spec = {'file': '{CONTAINER_MOUNT_POINT}/etc/hosts', 'pattern': [],
+            'archive_file_name': '/etc/hosts'}
+    f = InsightsFile(spec, None, layers.root, 'image', layers=layers)
+    assert f.get_output() == 'upper hosts'
+    spec['file'] = '{CONTAINER_MOUNT_POINT}/etc/removed'
+    assert InsightsFile(spec, None, layers.root, 'image', layers=layers).get_output() is None
+
+
+def test_collector_uses_layers_for_target_files(layers):
+    dc = DataCollector(archive_=object(), mountpoint=layers.root,
+                       target_name='image', target_type='docker_image', layers=layers)
+    specs = dc._parse_file_spec({'file': '{CONTAINER_MOUNT_POINT}/etc/merged/.*'})
+    assert [s['file'] for s in specs] == ['{CONTAINER_MOUNT_POINT}/etc/merged/a',
+                                          '{CONTAINER_MOUNT_POINT}/etc/merged/b']
+    assert dc._file_layers({'file': '/etc/redhat-access-insights/machine-id'}) is None
+    # nothing to mount with, commands on the tree are skipped
+    assert dc._command_mountpoint({'command': 'rpm --root={CONTAINER_MOUNT_POINT} -qa'}) is None
+    assert dc._command_mountpoint({'command': 'docker inspect x'}) == layers.root
+
+
+def chain(diff_ids):
+    chain_ids = [diff_ids[0]]
+    for diff_id in diff_ids[1:]:
+        chain_ids.append('sha256:' + hashlib.sha256(chain_ids[-1] + ' ' + diff_id).hexdigest())
+    return chain_ids
+
+
+def test_image_layers_from_docker_metadata(tmpdir):
+    root = str(tmpdir)
+    diff_ids = ['sha256:' + c * 64 for c in 'abc']
+    write(os.path.join(root, 'image/overlay2/imagedb/content/sha256', 'f' * 64),
+          json.dumps({'rootfs': {'type': 'layers', 'diff_ids': diff_ids}}))
+    for i, chain_id in enumerate(chain(diff_ids)):
+        write(os.path.join(root, 'image/overlay2/layerdb/sha256',
+                           chain_id.split(':')[1], 'cache-id'), 'cache%d' % i)
+        os.makedirs(os.path.join(root, 'overlay2', 'cache%d' % i, 'diff'))
+    assert image_layers('sha256:' + 'f' * 64, root) == [
+        os.path.join(root, 'overlay2', 'cache%d' % i, 'diff') for i in (2, 1, 0)]
+    assert image_layers('sha256:' + 'e' * 64, root) is None
+
+
+def test_container_layers_from_docker_metadata(tmpdir):
+    root = str(tmpdir)
+    write(os.path.join(root, 'image/overlay2/layerdb/mounts/c1/mount-id'), 'mnt')
+    write(os.path.join(root, 'overlay2/mnt/lower'), 'l/AAA:l/BBB')
+    for name in ('mnt/diff', 'l/AAA', 'l/BBB'):
+        os.makedirs(os.path.join(root, 'overlay2', name))
+    assert container_layers('c1', root) == [os.path.join(root, 'overlay2', name)
+                                            for name in ('mnt/diff', 'l/AAA', 'l/BBB')]
+    os.rmdir(os.path.join(root, 'overlay2/l/BBB'))
+    assert container_layers('c1', root) is None
+    assert container_layers('c2', root) is None
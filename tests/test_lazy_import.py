@@ -0,0 +1,31 @@
+import os
+import sys
+import subprocess
+
+from insights_client import lazy_import
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_lazy_callable_imports_on_first_call():
+    parse_rate = lazy_import.lazy('ratelimit', 'parse_rate')
+    assert parse_rate.__name__ == 'parse_rate'
+    assert parse_rate('2k') == 2048
+    # resolved inside the package, not as a top level module
+    assert 'insights_client.ratelimit' in sys.modules
+
+
+def test_lazy_module():
+    retry = lazy_import.LazyModule('retry')
+    assert retry.THROTTLE_CODES == (429, 503)
+
+
+def test_package_import_defers_heavy_modules():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([REPO_DIR] + sys.path)
+    code = ('import sys, insights_client\n'
+            'print [m for m in ("requests", "insights_client.connection",\n'
+            '                   "insights_client.containers",\n'
+            '                   "insights_client.data_collector") if m in sys.modules]')
+    out = subprocess.check_output([sys.executable, '-c', code], env=env)
+    assert out.strip() == '[]'
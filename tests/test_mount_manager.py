@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+
+from insights_client import containers
+from insights_client.containers.mount_manager import MountManager
+
+
+class FakeMounter(object):
+    def __init__(self, fail=(), delay=0):
+        self.fail = fail
+        self.delay = delay
+        self.mounted = []
+        self.unmounted = []
+
+    def mount(self, key, mount_point):
+        time.sleep(self.delay)
+        if key in self.fail:
+            return None
+        self.mounted.append(key)
+        return 'handle-' + key
+
+    def unmount(self, mount_point, handle):
+        self.unmounted.append(handle[len('handle-'):])
+
+
+def test_same_image_is_mounted_once():
+    fake = FakeMounter()
+    manager = MountManager(fake.mount, fake.unmount)
+    first = manager.acquire('img1')
+    assert manager.acquire('img1') == first
+    manager.release('img1')
+    manager.release('img1')
+    # released mounts are kept for other targets until cleanup
+    assert manager.acquire('img1') == first
+    assert fake.mounted == ['img1']
+    assert fake.unmounted == []
+    manager.release('img1')
+    manager.cleanup()
+    assert fake.unmounted == ['img1']
+    assert not os.path.exists(first)
+
+
+def test_concurrent_acquires_share_one_mount():
+    fake = FakeMounter(delay=0.05)
+    manager = MountManager(fake.mount, fake.unmount)
+    points = []
+    threads = [threading.Thread(target=lambda: points.append(manager.acquire('img1')))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake.mounted == ['img1']
+    assert len(set(points)) == 1
+    assert manager.reused == 3
+    manager.cleanup()
+
+
+def test_idle_mounts_are_bounded():
+    fake = FakeMounter()
+    manager = MountManager(fake.mount, fake.unmount, max_idle=2)
+    for key in ('a', 'b', 'c', 'd'):
+        manager.acquire(key)
+        manager.release(key)
+    # least recently used go first
+    assert fake.unmounted == ['a', 'b']
+    manager.cleanup()
+    assert sorted(fake.unmounted) == ['a', 'b', 'c', 'd']
+
+
+def test_failed_mount():
+    fake = FakeMounter(fail=('bad',))
+    manager = MountManager(fake.mount, fake.unmount)
+    assert manager.acquire('bad') is None
+    assert 'bad' not in manager.mounts
+    manager.cleanup()
+    assert fake.unmounted == []
+
+
+def test_cleanup_undoes_stacked_mounts_first():
+    fake = FakeMounter()
+    manager = MountManager(None, fake.unmount)
+
+    def mount(key, mount_point):
+        if key == 'container':
+            # stacked on the image, which finishes mounting first
+            manager.acquire('image')
+        return fake.mount(key, mount_point)
+    manager.mount = mount
+    manager.acquire('container')
+    manager.release('container')
+    manager.cleanup()
+    assert fake.unmounted == ['container', 'image']
+
+
+def _inspect(graph, image=None):
+    data = {'GraphDriver': {'Name': 'overlay2', 'Data': graph}}
+    if image:
+        data['Image'] = image
+    return data
+
+
+def test_overlay_container_is_stacked_on_its_image(monkeypatch):
+    inspects = {
+        ('sha256:img', 'image'): _inspect({'UpperDir': '/l/top/diff',
+                                           'LowerDir': '/l/base/diff'}),
+        ('c1', 'container'): _inspect({
+            'UpperDir': '/l/c1/diff',
+            'LowerDir': '/l/c1-init/diff:/l/top/diff:/l/base/diff'}, 'sha256:img'),
+    }
+    commands = []
+    monkeypatch.setattr(containers, '_docker_driver', lambda: 'overlay2')
+    monkeypatch.setattr(containers, '_docker_inspect_image',
+                        lambda name, kind='image': inspects.get((name, kind)))
+    monkeypatch.setattr(containers, 'runcommand', lambda cmd: commands.append(cmd) or 0)
+    manager = MountManager(containers._docker_mount, containers._docker_unmount)
+    monkeypatch.setattr(containers, 'DockerMounts', manager)
+
+    container_mount = manager.acquire(('container', 'c1'))
+    image_mount = manager.mounts[('image', 'sha256:img')]['mount_point']
+    assert commands[0][-2:] == ['overlay', image_mount]
+    assert commands[0][4] == 'ro,lowerdir=/l/top/diff:/l/base/diff'
+    assert commands[1][4] == 'ro,lowerdir=/l/c1/diff:/l/c1-init/diff:' + image_mount
+    # the image target reuses the mount made for the container
+    assert manager.acquire(('image', 'sha256:img')) == image_mount
+    assert len(commands) == 2
+
+    manager.release(('container', 'c1'))
+    manager.release(('image', 'sha256:img'))
+    manager.cleanup()
+    assert commands[2:] == [['umount', container_mount], ['umount', image_mount]]
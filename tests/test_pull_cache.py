@@ -0,0 +1,133 @@
+import pytest
+
+from insights_client.containers import pull_cache
+from insights_client.containers.pull_cache import PullCache, parse_reference, registry_digest
+
+IMAGE = 'registry.access.redhat.com/rhel7/insights-client'
+OLD = 'sha256:' + 'a' * 64
+NEW = 'sha256:' + 'b' * 64
+
+
+def test_parse_reference():
+    assert parse_reference(IMAGE) == ('registry.access.redhat.com', 'rhel7/insights-client', 'latest')
+    assert parse_reference('localhost:5000/client:1.2') == ('localhost:5000', 'client', '1.2')
+    assert parse_reference('centos') == ('docker.io', 'library/centos', 'latest')
+    assert parse_reference('user/client@' + OLD) == ('docker.io', 'user/client', OLD)
+
+
+class FakeDocker(object):
+    def __init__(self, digest=OLD, remote=OLD, reachable=True):
+        self.digest = digest
+        self.remote = remote
+        self.reachable = reachable
+        self.pulls = []
+        self.checks = []
+
+    def image_digests(self, image):
+        if self.digest is None:
+            return None
+        return [image + '@' + self.digest]
+
+    def pull(self, image):
+        self.pulls.append(image)
+        if not self.reachable:
+            return 1
+        self.digest = self.remote
+        return 0
+
+    def registry_digest(self, image):
+        self.checks.append(image)
+        return self.remote
+
+
+@pytest.fixture
+def state(tmpdir):
+    return str(tmpdir.join('pulls.json'))
+
+
+def cache_for(docker, state, ttl=3600):
+    return PullCache(docker.image_digests, docker.pull, ttl, path=state,
+                     registry_digest=docker.registry_digest)
+
+
+def test_missing_image_is_pulled(state):
+    docker = FakeDocker(digest=None)
+    assert cache_for(docker, state).update(IMAGE)
+    assert docker.pulls == [IMAGE]
+    assert docker.checks == []
+
+
+def test_no_check_within_ttl(state):
+    docker = FakeDocker(remote=NEW)
+    cache_for(docker, state).update(IMAGE)
+    assert docker.pulls == [IMAGE]
+    assert not cache_for(docker, state).update(IMAGE)
+    assert docker.checks == [IMAGE]
+    assert docker.pulls == [IMAGE]
+
+
+def test_unchanged_digest_is_not_pulled(state):
+    docker = FakeDocker()
+    assert not cache_for(docker, state, ttl=0).update(IMAGE)
+    assert not cache_for(docker, state, ttl=0).update(IMAGE)
+    assert docker.checks == [IMAGE, IMAGE]
+    assert docker.pulls == []
+
+
+def test_new_digest_is_pulled_after_ttl(state):
+    docker = FakeDocker()
+    cache_for(docker, state, ttl=0).update(IMAGE)
+    docker.remote = NEW
+    assert cache_for(docker, state, ttl=0).update(IMAGE)
+    assert docker.pulls == [IMAGE]
+    assert not cache_for(docker, state, ttl=0).update(IMAGE)
+
+
+def test_failed_pull_is_retried_next_run(state):
+    docker = FakeDocker(remote=NEW, reachable=False)
+    assert not cache_for(docker, state).update(IMAGE)
+    assert not cache_for(docker, state).update(IMAGE)
+    assert docker.pulls == [IMAGE, IMAGE]
+    docker.reachable = True
+    assert cache_for(docker, state).update(IMAGE)
+    assert not cache_for(docker, state).update(IMAGE)
+    assert docker.pulls == [IMAGE, IMAGE, IMAGE]
+
+
+class Response(object):
+    def __init__(self, status_code, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = dict((k.lower(), v) for k, v in (headers or {}).items())
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def test_registry_digest_with_anonymous_token(monkeypatch):
+    calls = []
+
+    def head(url, headers, timeout):
+        calls.append((url, headers.get('Authorization')))
+        if 'Authorization' not in headers:
+            return Response(401, {'WWW-Authenticate':
+                                  'Bearer realm="https://auth.example/token",'
+                                  'service="registry",scope="repository:library/centos:pull"'})
+        return Response(200, {'Docker-Content-Digest': NEW})
+
+    def get(url, params, timeout):
+        assert url == 'https://auth.example/token'
+        assert params == {'service': 'registry', 'scope': 'repository:library/centos:pull'}
+        return Response(200, body={'token': 'secret'})
+    monkeypatch.setattr(pull_cache.requests, 'head', head)
+    monkeypatch.setattr(pull_cache.requests, 'get', get)
+    assert registry_digest('centos:7') == NEW
+    assert calls == [('https://registry-1.docker.io/v2/library/centos/manifests/7', None),
+                     ('https://registry-1.docker.io/v2/library/centos/manifests/7', 'Bearer secret')]
+
+
+def test_registry_digest_unreachable(monkeypatch):
+    def head(url, headers, timeout):
+        raise pull_cache.requests.ConnectionError('no route')
+    monkeypatch.setattr(pull_cache.requests, 'head', head)
+    assert registry_digest(IMAGE) is None
@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import tempfile
+import pytest
+
+from insights_client.ratelimit import TokenBucket, BandwidthLimit, parse_rate, parse_schedule
+from insights_client.connection import InsightsConnection
+from upload_endpoint import UploadEndpoint, configure_client
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+def test_parse_rate():
+    assert parse_rate('65536') == 65536
+    assert parse_rate('64k') == 65536
+    assert parse_rate('1.5M') == 1572864
+    assert parse_rate('0') == 0
+    with pytest.raises(ValueError):
+        parse_rate('fast')
+
+
+def test_parse_schedule():
+    assert parse_schedule('08:00-18:00, 22:00-06:00=1M', 1024) == [
+        (480, 1080, 1024), (1320, 360, 1048576)]
+    with pytest.raises(ValueError):
+        parse_schedule('8-18', 1024)
+
+
+def test_bucket_holds_the_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(1000, clock=clock, sleep=clock.sleep)
+    for i in range(50):
+        bucket.consume(200)
+    # the first second's worth is already in the bucket
+    assert clock.slept == pytest.approx(9.0)
+
+
+def test_bucket_unlimited_outside_schedule():
+    clock = FakeClock()
+    now = time.localtime(clock.now)
+    minute = now.tm_hour * 60 + now.tm_min
+    # a one minute window that isn't now
+    window = [((minute + 10) % 1440, (minute + 11) % 1440, 100)]
+    bucket = TokenBucket(BandwidthLimit(100, window, clock=clock),
+                         clock=clock, sleep=clock.sleep)
+    bucket.consume(10000)
+    assert clock.slept == 0
+    window = [(minute, (minute + 1) % 1440, 100)]
+    bucket = TokenBucket(BandwidthLimit(100, window, clock=clock),
+                         clock=clock, sleep=clock.sleep)
+    bucket.consume(1000)
+    assert clock.slept == pytest.approx(9.0)
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.mark.parametrize('resumable', [False, True])
+def test_limited_upload(work_dir, resumable):
+    archive = os.path.join(work_dir, 'insights-host.tar.gz')
+    with open(archive, 'wb') as f:
+        f.write(os.urandom(300000))
+    endpoint = UploadEndpoint(resumable=resumable).start()
+    try:
+        configure_client(endpoint, work_dir, upload_bandwidth='100k',
+                         resumable_upload=str(resumable))
+        conn = InsightsConnection()
+        conn.resumable_chunk_size = 65536
+        start = time.time()
+        res = conn.upload_archive(archive, '1')
+        elapsed = time.time() - start
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    # 300000 bytes, the first 100 KiB free: at least 1.9 seconds
+    assert elapsed > 1.8
@@ -0,0 +1,111 @@
+import os
+import hashlib
+import shutil
+import tempfile
+import pytest
+import requests
+
+from insights_client.connection import InsightsConnection
+from upload_endpoint import UploadEndpoint, configure_client
+
+CHUNK = 65536
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def archive(work_dir):
+    path = os.path.join(work_dir, 'insights-host.tar.gz')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(CHUNK * 10 + 123))
+    return path
+
+
+def _connection(endpoint, work_dir):
+    configure_client(endpoint, work_dir, resumable_upload='True')
+    conn = InsightsConnection()
+    conn.resumable_chunk_size = CHUNK
+    return conn
+
+
+def _md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def test_resumes_from_acknowledged_offset(work_dir, archive):
+    endpoint = UploadEndpoint(resumable=True, fail_patches=[4, 5]).start()
+    try:
+        conn = _connection(endpoint, work_dir)
+        res = conn.upload_archive(archive, '1.0', cluster='abc')
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    assert len(endpoint.uploads) == 1
+    upload = endpoint.uploads[0]
+    assert upload['resumable']
+    assert upload['md5'] == _md5(archive)
+    # only the two dropped chunks were sent twice
+    assert endpoint.patch_bytes <= os.path.getsize(archive) + 2 * CHUNK
+    assert not os.path.exists(archive + '.upload')
+
+
+def test_failed_offset_query_does_not_restart(work_dir, archive):
+    # the HEAD after the dropped chunk gets a 503, which must not be
+    # taken as offset 0
+    endpoint = UploadEndpoint(resumable=True, fail_patches=[4], fail_heads=[2]).start()
+    try:
+        conn = _connection(endpoint, work_dir)
+        res = conn.upload_archive(archive, '1.0', cluster='abc')
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    assert endpoint.heads == 3
+    assert endpoint.uploads[0]['md5'] == _md5(archive)
+    assert endpoint.patch_bytes <= os.path.getsize(archive) + CHUNK
+
+
+def test_resumes_across_attempts(work_dir, archive):
+    endpoint = UploadEndpoint(resumable=True, fail_patches=range(3, 10)).start()
+    try:
+        conn = _connection(endpoint, work_dir)
+        with pytest.raises(requests.ConnectionError):
+            conn.upload_archive(archive, '1.0', cluster='abc')
+        assert os.path.exists(archive + '.upload')
+        res = conn.upload_archive(archive, '1.0', cluster='abc')
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    assert len(endpoint.sessions) == 1
+    assert endpoint.uploads[0]['md5'] == _md5(archive)
+
+
+def test_retries_creating_the_session(work_dir, archive):
+    endpoint = UploadEndpoint(resumable=True, fail_sessions=[1, 2]).start()
+    try:
+        conn = _connection(endpoint, work_dir)
+        res = conn.upload_archive(archive, '1.0', cluster='abc')
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    assert endpoint.session_posts == 3
+    assert len(endpoint.sessions) == 1
+    assert endpoint.uploads[0]['md5'] == _md5(archive)
+
+
+def test_falls_back_to_single_post(work_dir, archive):
+    endpoint = UploadEndpoint(resumable=False).start()
+    try:
+        conn = _connection(endpoint, work_dir)
+        res = conn.upload_archive(archive, '1.0', cluster='abc')
+    finally:
+        endpoint.stop()
+    assert res.status_code == 201
+    assert not conn.resumable_supported
+    assert endpoint.uploads[0]['filename'] == 'insights-host.tar.gz'
+    assert endpoint.uploads[0]['md5'] == _md5(archive)
@@ -0,0 +1,84 @@
+import os
+import time
+import shutil
+import tempfile
+import pytest
+
+from insights_client.retry import RetryPolicy, parse_retry_after
+from upload_endpoint import UploadEndpoint, configure_client
+
+
+class Response(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470) == 10
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_backoff_grows_and_is_capped():
+    policy = RetryPolicy(10, base_delay=10, max_delay=100, max_total=10000,
+                         rand=lambda: 1.0)
+    delays = [policy.next_delay(i) for i in range(6)]
+    assert delays == [10, 20, 40, 80, 100, 100]
+
+
+def test_full_jitter_and_last_attempt():
+    policy = RetryPolicy(3, base_delay=10, rand=lambda: 0.25)
+    assert policy.next_delay(0) == 2.5
+    assert policy.next_delay(1) == 5
+    assert policy.next_delay(2) is None
+
+
+def test_retry_after_honored_on_throttle():
+    policy = RetryPolicy(3, base_delay=10, rand=lambda: 0.0)
+    assert policy.next_delay(0, Response(429, {'Retry-After': '45'})) == 45
+    # no hint, but still throttled: at least half the backoff
+    assert policy.next_delay(1, Response(503)) == 10
+
+
+def test_total_retry_time_is_capped():
+    policy = RetryPolicy(10, base_delay=100, max_total=150, rand=lambda: 1.0)
+    assert policy.next_delay(0) == 100
+    assert policy.next_delay(1) == 50
+    assert policy.next_delay(2) is None
+
+
+def test_retry_after_beyond_the_time_budget_gives_up():
+    policy = RetryPolicy(10, base_delay=10, max_total=60, rand=lambda: 1.0)
+    assert policy.next_delay(0, Response(503, {'Retry-After': '50'})) == 60
+    policy = RetryPolicy(10, base_delay=10, max_total=60, rand=lambda: 0.0)
+    assert policy.next_delay(0, Response(503, {'Retry-After': '61'})) is None
+
+
+def test_do_upload_retries_after_throttle(work_dir, monkeypatch):
+    import insights_client
+    endpoint = UploadEndpoint(statuses=[503], retry_after=7).start()
+    try:
+        client = configure_client(endpoint, work_dir)
+        client.options.retries = 3
+        archive = os.path.join(work_dir, 'insights-host.tar.gz')
+        with open(archive, 'wb') as f:
+            f.write(os.urandom(4096))
+        sleeps = []
+        monkeypatch.setattr(time, 'sleep', sleeps.append)
+        pconn = insights_client.get_connection()
+        rc = insights_client._do_upload(pconn, archive, 'test', '1')
+    finally:
+        endpoint.stop()
+    assert rc == 0
+    assert len(endpoint.uploads) == 2
+    assert len(sleeps) == 1 and 7 <= sleeps[0] <= 7 + RetryPolicy(1).base_delay
@@ -0,0 +1,97 @@
+import os
+import optparse
+import subprocess
+
+import insights_client
+from insights_client.archive import InsightsArchive
+from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+from insights_client.constants import InsightsConstants as constants
+from insights_client.rootfs import find_rootfs, rootfs_targets, open_rootfs
+
+
+def make_trees(tmpdir, names):
+    for name in names:
+        tmpdir.mkdir(name).mkdir('etc')
+    return [str(tmpdir.join(name)) for name in names]
+
+
+def test_glob_matches_directories_only(tmpdir):
+    trees = make_trees(tmpdir, ['rootfs-b', 'rootfs-a'])
+    tmpdir.join('rootfs-notes.txt').write('')
+    assert find_rootfs(str(tmpdir.join('rootfs-*'))) == [(trees[1], None), (trees[0], None)]
+
+
+def test_a_directory_is_one_tree(tmpdir):
+    assert find_rootfs(str(tmpdir)) == [(str(tmpdir), None)]
+
+
+def test_manifest_with_names(tmpdir):
+    trees = make_trees(tmpdir, ['one', 'two'])
+    manifest = tmpdir.join('trees.txt')
+    manifest.write('# build farm output\n'
+                   'one web-frontend\n'
+                   '\n'
+                   '%s\n' % trees[1])
+    assert find_rootfs(str(manifest)) == [(trees[0], 'web-frontend'), (trees[1], None)]
+
+
+def test_targets_are_collected_like_images(tmpdir):
+    trees = make_trees(tmpdir, ['one', 'two'])
+    targets = rootfs_targets([str(tmpdir.join('*')), trees[0],
+                              str(tmpdir.join('missing.txt'))])
+    assert [(t['type'], t['rootfs'], t['display_name']) for t in targets] == [
+        ('docker_image', tree, tree) for tree in trees]
+    assert targets[0]['name'].startswith('one-')
+    assert targets[1]['name'].startswith('two-')
+    assert open_rootfs(trees[0]).get_fs() == trees[0]
+    assert open_rootfs(os.path.join(trees[0], 'nothing')) is None
+
+
+def test_trees_with_the_same_name_get_their_own_archives(tmpdir, monkeypatch):
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    # left set, the archives' atexit handlers look at them
+    InsightsClient.options = parser.parse_args(['--rootfs', 'x'])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    for name in ('default_log_file', 'default_sed_file'):
+        tmpdir.join(name).write('')
+        monkeypatch.setattr(constants, name, str(tmpdir.join(name)))
+    tmpdir.join('machine-id').write('12345678-1234-5678-1234-567812345678')
+    monkeypatch.setattr(constants, 'machine_id_file', str(tmpdir.join('machine-id')))
+    trees = []
+    for parent in ('a', 'b'):
+        tree = tmpdir.mkdir(parent).mkdir('merged')
+        tree.mkdir('etc').join('hostname').write(parent + '\n')
+        trees.append(str(tree))
+    rules = {'specs': {'hostname': {'docker_image': [
+        {'file': '{CONTAINER_MOUNT_POINT}/etc/hostname', 'pattern': [],
+         'archive_file_name': '/etc/hostname'}]}},
+        'pre_commands': {}}
+
+    targets = rootfs_targets(trees)
+    assert len(set(t['name'] for t in targets)) == 2
+    full_archive = InsightsArchive(compressor='none')
+    try:
+        for t in targets:
+            opened = insights_client._open_target(t)
+            archive, archive_meta = insights_client._collect_target(
+                t, opened, rules, None, constants.default_branch_info, 0)[:2]
+            assert archive_meta['display_name'] == t['rootfs']
+            full_archive.link_file(archive_meta['tar_file'])
+            archive.delete_tmp_dir()
+        linked = sorted(os.listdir(full_archive.archive_dir))
+        linked.remove('insights_commands')
+        assert len(linked) == 2
+        hostnames = []
+        for tar_file in linked:
+            listing = subprocess.check_output(
+                ['tar', 'tf', os.path.join(full_archive.archive_dir, tar_file)]).split()
+            # one top level directory, named like the tarball
+            top = tar_file[:-len('.tar')]
+            assert set(m.split('/')[1] for m in listing if m != './') == set([top])
+            hostnames.append(subprocess.check_output(
+                ['tar', 'xOf', os.path.join(full_archive.archive_dir, tar_file),
+                 './%s/etc/hostname' % top]).strip())
+        assert sorted(hostnames) == ['a', 'b']
+    finally:
+        full_archive.delete_tmp_dir()
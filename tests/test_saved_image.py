@@ -0,0 +1,166 @@
+import io
+import json
+import gzip
+import tarfile
+import pytest
+
+from insights_client.constants import InsightsConstants as constants
+from insights_client.insights_spec import InsightsFile
+from insights_client.containers import saved_image
+from insights_client.containers.saved_image import (SavedImage, SavedImageError,
+                                                    saved_images)
+
+IMAGE_ID = 'sha256:' + 'c' * 64
+
+
+def layer_tar(members, compress=False):
+    """
+    Layer tarball from (name, content) pairs, content None for a directory,
+    ('symlink', target) or ('hardlink', target) for links
+    """
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode='w')
+    for name, content in members:
+        info = tarfile.TarInfo(name)
+        data = None
+        if content is None:
+            info.type = tarfile.DIRTYPE
+        elif isinstance(content, tuple):
+            info.type = tarfile.SYMTYPE if content[0] == 'symlink' else tarfile.LNKTYPE
+            info.linkname = content[1]
+        else:
+            data = io.BytesIO(content)
+            info.size = len(content)
+        tar.addfile(info, data)
+    tar.close()
+    if not compress:
+        return buf.getvalue()
+    out = io.BytesIO()
+    gz = gzip.GzipFile(fileobj=out, mode='wb')
+    gz.write(buf.getvalue())
+    gz.close()
+    return out.getvalue()
+
+
+def add(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def save_image(path, upper=None, mode='w'):
+    """
+    docker save tarball at path, with a plain lower layer and a gzip upper
+    """
+    lower = layer_tar([('etc', None),
+                       ('etc/hosts', 'lower hosts\n'),
+                       ('etc/removed', 'gone\n'),
+                       ('etc/opaque/old', 'hidden\n'),
+                       ('etc/merged/a', 'a\n'),
+                       ('etc/redhat-release', 'Red Hat\n'),
+                       ('etc/system-release', ('symlink', '/etc/redhat-release')),
+                       ('etc/alias', ('symlink', 'merged'))])
+    if upper is None:
+        upper = layer_tar([('./etc/hosts', 'upper hosts\n'),
+                           ('./etc/.wh.removed', ''),
+                           ('./etc/opaque/new', 'new\n'),
+                           ('./etc/opaque/.wh..wh..opq', ''),
+                           ('./etc/merged/b', 'b\n'),
+                           ('./etc/linked', ('hardlink', 'etc/merged/b'))],
+                          compress=True)
+    tar = tarfile.open(path, mode)
+    add(tar, 'lower/layer.tar', lower)
+    add(tar, 'upper/layer.tar', upper)
+    add(tar, 'c' * 64 + '.json', '{}')
+    add(tar, 'manifest.json', json.dumps([{'Config': 'c' * 64 + '.json',
+                                           'RepoTags': ['rhel7:latest'],
+                                           'Layers': ['lower/layer.tar',
+                                                      'upper/layer.tar']}]))
+    tar.close()
+    return path
+
+
+@pytest.fixture
+def saved(tmpdir):
+    image = SavedImage(save_image(str(tmpdir.join('image.tar'))), IMAGE_ID)
+    yield image
+    image.close()
+
+
+def test_lists_saved_images(saved):
+    assert saved_images(saved.path) == [(IMAGE_ID, 'rhel7:latest')]
+
+
+def test_top_layer_wins(saved):
+    assert saved.open('/etc/hosts').read() == 'upper hosts\n'
+    assert saved.open('/etc/merged/a').read() == 'a\n'
+    assert saved.listdir('/etc/merged') == ['a', 'b']
+
+
+def test_whiteouts_hide_lower_layers(saved):
+    assert saved.open('/etc/removed') is None
+    assert saved.open('/etc/opaque/old') is None
+    assert saved.listdir('/etc/opaque') == ['new']
+    assert 'removed' not in saved.listdir('/etc')
+
+
+def test_links(saved):
+    assert saved.open('/etc/system-release').read() == 'Red Hat\n'
+    assert saved.open('/etc/alias/b').read() == 'b\n'
+    assert saved.open('/etc/linked').read() == 'b\n'
+    assert saved.open('/etc') is None
+    assert saved.open('/etc/hosts/nothing') is None
+
+
+def test_expand_matches_like_expand_paths(saved):
+    assert saved.expand('/etc/merged/.*') == ['/etc/merged/a', '/etc/merged/b']
+    assert saved.mount_point() is None
+
+
+def test_files_are_read_from_the_tarball(saved, tmpdir, monkeypatch):
+    sed_file = tmpdir.join('empty.sed')
+    sed_file.write('')
+    monkeypatch.setattr(constants, 'default_sed_file', str(sed_file))
+    spec = {'file': '{CONTAINER_MOUNT_POINT}/etc/hosts', 'pattern': ['upper'],
+            'archive_file_name': '/etc/hosts'}
+    f = InsightsFile(spec, ['nothing'], saved.root, IMAGE_ID, layers=saved)
+    assert f.get_output() == 'upper hosts'
+
+
+def test_missing_image(saved):
+    with pytest.raises(SavedImageError):
+        SavedImage(saved.path, 'sha256:' + 'd' * 64)
+
+
+def test_compressed_layers_are_decompressed_once(tmpdir, monkeypatch):
+    path = save_image(str(tmpdir.join('image.tar')))
+    opened = []
+    GzipFile = gzip.GzipFile
+
+    def gzip_file(*args, **kwargs):
+        opened.append(args)
+        return GzipFile(*args, **kwargs)
+    monkeypatch.setattr(saved_image.gzip, 'GzipFile', gzip_file)
+    image = SavedImage(path, IMAGE_ID)
+    try:
+        for path in ('/etc/hosts', '/etc/merged/b', '/etc/opaque/new', '/etc/linked'):
+            assert image.open(path).read()
+        assert len(opened) == 1
+    finally:
+        image.close()
+
+
+def test_compressed_tarball(tmpdir):
+    image = SavedImage(save_image(str(tmpdir.join('image.tar.gz')), mode='w:gz'), IMAGE_ID)
+    try:
+        assert image.open('/etc/hosts').read() == 'upper hosts\n'
+        assert image.open('/etc/redhat-release').read() == 'Red Hat\n'
+    finally:
+        image.close()
+
+
+def test_corrupt_layer(tmpdir):
+    upper = layer_tar([('etc/hosts', 'x' * 100000)], compress=True)
+    upper = upper[:len(upper) // 2]
+    with pytest.raises(SavedImageError):
+        SavedImage(save_image(str(tmpdir.join('image.tar')), upper), IMAGE_ID)
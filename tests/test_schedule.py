@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+import pytest
+
+import insights_client
+from insights_client import schedule
+from insights_client.schedule import InsightsSchedule, splay_offset
+from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+from insights_client.constants import InsightsConstants as constants
+
+APP_NAME = constants.app_name
+
+
+@pytest.fixture
+def cron(monkeypatch):
+    work_dir = tempfile.mkdtemp()
+    for name in ('CRON_DAILY', 'CRON_WEEKLY', 'CRON_D'):
+        path = os.path.join(work_dir, name.lower()) + '/'
+        os.mkdir(path)
+        monkeypatch.setattr(schedule, name, path)
+    monkeypatch.setattr(constants, 'splay_file', os.path.join(work_dir, '.splay'))
+    monkeypatch.setattr(constants, 'machine_id_file', os.path.join(work_dir, 'machine-id'))
+    with open(constants.machine_id_file, 'w') as f:
+        f.write('dc194312-8cdd-4e75-8cf1-2094bf666f45')
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    InsightsClient.options = parser.parse_args([])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    InsightsClient.config.set(APP_NAME, 'splay_window', '240')
+    InsightsClient.config.set(APP_NAME, 'splay_start', '01:00')
+    yield InsightsSchedule(set_cron=False)
+    shutil.rmtree(work_dir)
+
+
+def test_offsets_spread_over_window():
+    window = 240
+    offsets = [splay_offset('machine-%d' % i, window) for i in range(4800)]
+    assert all(0 <= o < window for o in offsets)
+    assert splay_offset('machine-1', window) == offsets[1]
+    # every 30 minute bucket gets roughly an eighth of the fleet
+    buckets = [0] * 8
+    for o in offsets:
+        buckets[o // 30] += 1
+    assert min(buckets) > 500 and max(buckets) < 700
+
+
+def test_slot_is_persisted(cron):
+    slot = cron.slot()
+    assert 60 <= slot < 60 + 240
+    state = cron._read_state()
+    assert state['offset'] == slot - 60
+    InsightsClient.config.set(APP_NAME, 'splay_window', '60')
+    assert 60 <= cron.slot() < 120
+    assert cron._read_state()['window'] == 60
+
+
+def test_set_daily_writes_cron_d(cron):
+    cron.set_daily()
+    assert not os.path.exists(schedule.CRON_DAILY + APP_NAME)
+    with open(schedule.CRON_D + APP_NAME) as f:
+        entry = f.read()
+    minute = cron.slot() % 60
+    assert entry.splitlines()[-1].startswith('%d * * * * root ' % minute)
+    assert entry.rstrip().endswith('.cron --scheduled')
+    InsightsClient.config.set(APP_NAME, 'splay_catch_up', 'False')
+    cron.refresh()
+    with open(schedule.CRON_D + APP_NAME) as f:
+        assert f.read().splitlines()[-1].startswith(
+            '%d %d * * * root ' % (minute, cron.slot() // 60))
+    InsightsClient.config.set(APP_NAME, 'splay_window', '0')
+    cron.refresh()
+    assert not os.path.exists(schedule.CRON_D + APP_NAME)
+    assert os.path.islink(schedule.CRON_DAILY + APP_NAME)
+
+
+def test_catch_up_after_missed_slot(cron):
+    slot_time = cron.last_slot_time()
+    assert slot_time <= time.time() < slot_time + 24 * 3600 + 3600
+    assert cron.is_due()
+    cron.mark_run(slot_time + 60)
+    assert not cron.is_due(slot_time + 3600)
+    # the next day's slot came and went while we were down
+    assert cron.is_due(slot_time + 26 * 3600)
+
+
+def test_refresh_keeps_the_scheduled_script(cron):
+    InsightsClient.options.container_mode = True
+    InsightsSchedule()
+    InsightsClient.options.container_mode = False
+    with open(schedule.CRON_D + APP_NAME) as f:
+        assert f.read().rstrip().endswith('-container.cron --scheduled')
+    # a manual run in host mode with new splay settings
+    InsightsClient.config.set(APP_NAME, 'splay_catch_up', 'False')
+    cron.refresh()
+    with open(schedule.CRON_D + APP_NAME) as f:
+        entry = f.read().splitlines()[-1]
+    assert entry.startswith('%d %d * * * root ' % (cron.slot() % 60, cron.slot() // 60))
+    assert entry.endswith('-container.cron --scheduled')
+    InsightsClient.config.set(APP_NAME, 'splay_window', '0')
+    cron.refresh()
+    assert os.readlink(schedule.CRON_DAILY + APP_NAME).endswith('-container.cron')
+
+
+def test_script_of_an_existing_cron_daily_link(cron):
+    os.symlink('/etc/insights-client/insights-client-container.cron',
+               schedule.CRON_DAILY + APP_NAME)
+    assert cron.cron_script() == '/etc/insights-client/insights-client-container.cron'
+
+
+@pytest.mark.parametrize('rc', [0, 1])
+def test_scheduled_run_is_marked_once_it_worked(cron, monkeypatch, rc):
+    class Handler(object):
+        def doRollover(self):
+            pass
+    monkeypatch.setattr(sys, 'argv', ['insights-client', '--scheduled'])
+    monkeypatch.setattr(sys, 'excepthook', sys.excepthook)
+    monkeypatch.setattr(insights_client.os, 'geteuid', lambda: 0)
+    monkeypatch.setattr(insights_client, 'set_up_logging', Handler)
+    monkeypatch.setattr(insights_client, 'handle_startup', lambda: None)
+    monkeypatch.setattr(insights_client, 'collect_data_and_upload', lambda: rc)
+    with pytest.raises(SystemExit):
+        insights_client._main()
+    assert ('last_run' in cron._read_state()) == (rc == 0)
@@ -0,0 +1,112 @@
+import os
+import time
+import fcntl
+import shutil
+import tempfile
+import pytest
+
+import insights_client
+from insights_client.spool import UploadSpool
+from upload_endpoint import UploadEndpoint, configure_client
+
+
+@pytest.fixture
+def work_dir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def archive(work_dir):
+    path = os.path.join(work_dir, 'insights-host.tar.gz')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(4096))
+    return path
+
+
+def test_failed_upload_is_spooled_and_drained(work_dir, archive, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    endpoint = UploadEndpoint(statuses=[500, 500]).start()
+    try:
+        client = configure_client(endpoint, work_dir, spool_uploads='True')
+        client.options.retries = 2
+        pconn = insights_client.get_connection()
+        assert insights_client._do_upload(pconn, archive, 'test', '1') == 1
+        spooled = UploadSpool().entries()
+        assert len(spooled) == 1
+        assert spooled[0]['archive'] == os.path.basename(archive)
+
+        # the next run uploads and then sends the queued archive too
+        assert insights_client._do_upload(pconn, archive, 'test', '1') == 0
+    finally:
+        endpoint.stop()
+    assert len(endpoint.uploads) == 4
+    assert UploadSpool().entries() == []
+
+
+def test_not_spooled_by_default(work_dir, archive, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda s: None)
+    endpoint = UploadEndpoint(statuses=[500, 500]).start()
+    try:
+        client = configure_client(endpoint, work_dir)
+        client.options.retries = 2
+        pconn = insights_client.get_connection()
+        assert insights_client._do_upload(pconn, archive, 'test', '1') == 1
+    finally:
+        endpoint.stop()
+    assert len(endpoint.uploads) == 2
+    assert not os.path.exists(os.path.join(work_dir, 'spool'))
+
+
+def test_drain_stops_at_first_failure(work_dir, archive):
+    endpoint = UploadEndpoint(statuses=[503]).start()
+    try:
+        configure_client(endpoint, work_dir)
+        spool = UploadSpool()
+        spool.add(archive, 'first', '1')
+        spool.add(archive, 'second', '1')
+        pconn = insights_client.get_connection()
+        assert spool.drain(pconn) == 1
+        entries = spool.entries()
+        assert len(endpoint.uploads) == 1
+        assert entries[0]['attempts'] == 1
+        assert entries[0]['last_error'] == 'HTTP 503'
+        assert spool.drain(pconn) == 0
+    finally:
+        endpoint.stop()
+    assert len(endpoint.uploads) == 3
+
+
+def test_drain_skips_a_spool_being_drained(work_dir, archive):
+    endpoint = UploadEndpoint().start()
+    try:
+        configure_client(endpoint, work_dir)
+        spool = UploadSpool()
+        spool.add(archive, 'first', '1')
+        # another run is draining
+        with open(os.path.join(spool.spool_dir, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            assert spool.drain(insights_client.get_connection()) == 0
+            assert len(spool.entries()) == 1
+        assert spool.drain(insights_client.get_connection()) == 0
+    finally:
+        endpoint.stop()
+    assert len(endpoint.uploads) == 1
+    assert spool.entries() == []
+
+
+def test_retention(work_dir, archive):
+    endpoint = UploadEndpoint()
+    try:
+        client = configure_client(endpoint, work_dir, spool_max_archives='2')
+    finally:
+        endpoint.server_close()
+    spool = UploadSpool()
+    for name in ('a', 'b', 'c'):
+        spool.add(archive, name, '1')
+    assert [e['logging_name'] for e in spool.entries()] == ['b', 'c']
+    week = client.config.getint('insights-client', 'spool_max_age') * 86400
+    assert spool.expire(time.time() + week + 1) == []
+    # only the lock file that drains and expiries take is left
+    assert os.listdir(spool.spool_dir) == ['.lock']
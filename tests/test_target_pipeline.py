@@ -0,0 +1,117 @@
+import time
+import threading
+import pytest
+
+import insights_client
+from insights_client.target_pipeline import TargetPipeline
+
+
+class FakeMounts(object):
+    """
+    Stand-in for open_image/open_container that tracks live mounts
+    """
+    def __init__(self, unmountable=(), broken=(), delay=0.01):
+        self.unmountable = unmountable
+        self.broken = broken
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.live = 0
+        self.peak = 0
+        self.collecting = 0
+        self.peak_collecting = 0
+        self.opened = []
+        self.closed = []
+
+    def open(self, t):
+        if t['name'] in self.unmountable:
+            return None
+        with self.lock:
+            self.live += 1
+            self.peak = max(self.peak, self.live)
+            self.opened.append(t['name'])
+        return t['name']
+
+    def collect(self, t, handle):
+        with self.lock:
+            self.collecting += 1
+            self.peak_collecting = max(self.peak_collecting, self.collecting)
+        try:
+            time.sleep(self.delay)
+            if t['name'] in self.broken:
+                raise RuntimeError('collection of %s failed' % t['name'])
+            return 'archive-' + handle
+        finally:
+            with self.lock:
+                self.collecting -= 1
+
+    def close(self, handle):
+        with self.lock:
+            self.live -= 1
+            self.closed.append(handle)
+
+
+def _pipeline(mounts, workers, max_mounts):
+    return TargetPipeline(mounts.open, mounts.collect, mounts.close,
+                          workers=workers, max_mounts=max_mounts)
+
+
+def test_results_keep_target_order():
+    mounts = FakeMounts()
+    targets = [{'type': 'docker_image', 'name': 'image%d' % i} for i in range(8)]
+    results = _pipeline(mounts, 4, 6).run(targets)
+    assert results == ['archive-image%d' % i for i in range(8)]
+    assert sorted(mounts.closed) == sorted(mounts.opened)
+    assert mounts.live == 0
+
+
+def test_live_mounts_are_bounded():
+    mounts = FakeMounts()
+    targets = [{'type': 'docker_image', 'name': 'image%d' % i} for i in range(12)]
+    _pipeline(mounts, 2, 3).run(targets)
+    assert mounts.peak <= 3
+    assert mounts.peak_collecting <= 2
+
+
+def test_max_mounts_is_at_least_workers():
+    pipeline = TargetPipeline(None, None, None, workers=4, max_mounts=1)
+    assert pipeline.max_mounts == 4
+
+
+def test_unmountable_target_is_skipped():
+    mounts = FakeMounts(unmountable=('image1',))
+    targets = [{'type': 'docker_image', 'name': 'image%d' % i} for i in range(3)]
+    results = _pipeline(mounts, 2, 2).run(targets)
+    assert results == ['archive-image0', 'archive-image2']
+    assert 'image1' not in mounts.opened
+
+
+def test_collection_error_is_raised_after_unmounting():
+    mounts = FakeMounts(broken=('image2',))
+    targets = [{'type': 'docker_image', 'name': 'image%d' % i} for i in range(10)]
+    with pytest.raises(RuntimeError):
+        _pipeline(mounts, 2, 3).run(targets)
+    # every mount was undone and the run stopped early
+    assert mounts.live == 0
+    assert sorted(mounts.closed) == sorted(mounts.opened)
+    assert len(mounts.opened) < len(targets)
+
+
+def test_open_error_is_raised():
+    def open_target(t):
+        if t['name'] == 'image1':
+            raise OSError('mount failed')
+        return mounts.open(t)
+    mounts = FakeMounts()
+    targets = [{'type': 'docker_image', 'name': 'image%d' % i} for i in range(4)]
+    pipeline = TargetPipeline(open_target, mounts.collect, mounts.close,
+                              workers=2, max_mounts=2)
+    with pytest.raises(OSError):
+        pipeline.run(targets)
+    assert mounts.live == 0
+
+
+def test_open_target_skips_unopenable_image(monkeypatch):
+    monkeypatch.setattr(insights_client, 'open_image', lambda name: None)
+    monkeypatch.setattr(insights_client, 'docker_display_name',
+                        lambda name, kind: name)
+    assert insights_client._open_target({'type': 'docker_image', 'name': 'abc'}) is None
@@ -0,0 +1,59 @@
+import os
+import hashlib
+import tempfile
+import pytest
+import requests
+
+from insights_client.upload_stream import MultipartFileEncoder
+from upload_endpoint import UploadEndpoint
+
+
+@pytest.fixture
+def archive():
+    fd, path = tempfile.mkstemp(suffix='.tar.gz')
+    with os.fdopen(fd, 'wb') as f:
+        for i in range(64):
+            f.write(os.urandom(16384))
+    yield path
+    os.remove(path)
+
+
+@pytest.fixture
+def endpoint():
+    server = UploadEndpoint().start()
+    yield server
+    server.stop()
+
+
+def _md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def test_encoder_length_matches_body(archive):
+    body = MultipartFileEncoder('file', archive, 'application/x-gzip')
+    data = body.read()
+    body.close()
+    assert len(data) == len(body)
+    assert data.endswith('\r\n--%s--\r\n' % body.boundary)
+
+
+def test_encoder_reads_in_bounded_chunks(archive):
+    body = MultipartFileEncoder('file', archive, 'application/x-gzip')
+    sizes = [len(chunk) for chunk in body]
+    body.close()
+    assert sum(sizes) == len(body)
+    assert max(sizes) <= body.chunk_size
+
+
+def test_streaming_upload_to_endpoint(archive, endpoint):
+    body = MultipartFileEncoder('file', archive, 'application/x-gzip', 'insights.tar.gz')
+    res = requests.post(endpoint.url + '/uploads/abc', data=body,
+                        headers={'Content-Type': body.content_type})
+    body.close()
+    assert res.status_code == 201
+    upload = endpoint.uploads[0]
+    assert int(upload['headers']['content-length']) == len(body)
+    assert 'transfer-encoding' not in upload['headers']
+    assert upload['filename'] == 'insights.tar.gz'
+    assert upload['md5'] == _md5(archive)
@@ -0,0 +1,200 @@
+"""
+Local stand-in for the Insights upload service, for tests and benchmarks
+"""
+import cgi
+import json
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+class UploadHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=None, body=''):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _session(self):
+        session_id = self.path.rsplit('/', 1)[-1]
+        return self.server.sessions.get(session_id)
+
+    def do_HEAD(self):
+        session = self._session()
+        if session is None:
+            return self._reply(404)
+        with self.server.lock:
+            self.server.heads += 1
+            if self.server.heads in self.server.fail_heads:
+                return self._reply(503)
+        self._reply(200, {'Upload-Offset': str(len(session['data']))})
+
+    def do_PATCH(self):
+        server = self.server
+        session = self._session()
+        chunk = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.patch_bytes += len(chunk)
+        server.patches += 1
+        if server.patches in server.fail_patches:
+            # drop the connection without answering, like a WAN link dying
+            self.close_connection = 1
+            self.connection.shutdown(2)
+            return
+        if session is None:
+            return self._reply(404)
+        offset = int(self.headers.get('Upload-Offset', -1))
+        if offset != len(session['data']):
+            return self._reply(409, {'Upload-Offset': str(len(session['data']))})
+        algo, _, checksum = self.headers.get('Upload-Checksum', '').partition(' ')
+        if algo != 'sha256' or hashlib.sha256(chunk).hexdigest() != checksum:
+            return self._reply(460)
+        session['data'] += chunk
+        if len(session['data']) < session['size']:
+            return self._reply(204, {'Upload-Offset': str(len(session['data']))})
+        data = str(session['data'])
+        if hashlib.sha256(data).hexdigest() != session['sha256']:
+            return self._reply(460)
+        server.uploads.append({'path': session['path'],
+                               'headers': session['headers'],
+                               'filename': session['filename'],
+                               'size': len(data),
+                               'md5': hashlib.md5(data).hexdigest(),
+                               'resumable': True})
+        self._reply(201, {'Content-Type': 'application/json'}, '{}')
+
+    def _create_session(self):
+        server = self.server
+        server.session_posts += 1
+        if server.session_posts in server.fail_sessions:
+            self.close_connection = 1
+            self.connection.shutdown(2)
+            return
+        if not server.resumable:
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            return self._reply(404)
+        meta = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        with server.lock:
+            session_id = str(len(server.sessions) + 1)
+            server.sessions[session_id] = {'path': self.path[:-len('/resumable')],
+                                           'headers': dict(self.headers.items()),
+                                           'filename': meta['filename'],
+                                           'size': meta['size'],
+                                           'sha256': meta['sha256'],
+                                           'data': bytearray()}
+        self._reply(201, {'Location': '/sessions/' + session_id})
+
+    def do_POST(self):
+        server = self.server
+        if self.path.endswith('/resumable'):
+            return self._create_session()
+        record = {'path': self.path,
+                  'headers': dict(self.headers.items())}
+        status = server.next_status()
+        environ = {'REQUEST_METHOD': 'POST',
+                   'CONTENT_TYPE': self.headers.get('Content-Type', '')}
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ=environ)
+        if 'file' in form:
+            item = form['file']
+            data = item.file.read()
+            record['filename'] = item.filename
+            record['size'] = len(data)
+            record['md5'] = hashlib.md5(data).hexdigest()
+        server.uploads.append(record)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if status in (429, 503) and server.retry_after is not None:
+            self.send_header('Retry-After', str(server.retry_after))
+        body = '{}'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UploadEndpoint(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server recording every multipart upload it receives
+    'statuses' is a list of status codes to answer with, in order;
+    once it runs out every request gets 201
+    With resumable=True it also speaks the chunked upload protocol;
+    the PATCH requests numbered in fail_patches (from 1) are dropped,
+    and the HEAD requests numbered in fail_heads are answered with 503;
+    the session requests numbered in fail_sessions are dropped too
+    retry_after is sent as a Retry-After header with 429 and 503 answers
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    handler_class = UploadHandler
+
+    def __init__(self, statuses=None, resumable=False, fail_patches=(), retry_after=None,
+                 fail_heads=(), fail_sessions=()):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), self.handler_class)
+        self.statuses = list(statuses or [])
+        self.resumable = resumable
+        self.fail_patches = set(fail_patches)
+        self.fail_heads = set(fail_heads)
+        self.heads = 0
+        self.fail_sessions = set(fail_sessions)
+        self.session_posts = 0
+        self.retry_after = retry_after
+        self.sessions = {}
+        self.patches = 0
+        self.patch_bytes = 0
+        self.uploads = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def next_status(self):
+        with self.lock:
+            if self.statuses:
+                return self.statuses.pop(0)
+            return 201
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def configure_client(endpoint, work_dir, **config):
+    """
+    Point the global InsightsClient config at a stand-in endpoint
+    and keep the client's state files inside work_dir
+    """
+    import os
+    import optparse
+    from insights_client.client_config import InsightsClient, set_up_options, parse_config_file
+    from insights_client.constants import InsightsConstants as constants
+    parser = optparse.OptionParser()
+    set_up_options(parser)
+    InsightsClient.options = parser.parse_args([])[0]
+    InsightsClient.config = parse_config_file(os.devnull)
+    InsightsClient.argv = ['insights-client']
+    InsightsClient.config.set(constants.app_name, 'auto_config', 'False')
+    InsightsClient.config.set(constants.app_name, 'insecure_connection', 'True')
+    InsightsClient.config.set(constants.app_name, 'base_url',
+                              endpoint.url.replace('http://', '') + '/r/insights')
+    for key in config:
+        InsightsClient.config.set(constants.app_name, key, config[key])
+    for attr in ('machine_id_file', 'docker_group_id_file', 'lastupload_file',
+                 'upload_stats_file', 'registered_file', 'unregistered_file'):
+        setattr(constants, attr,
+                os.path.join(work_dir, os.path.basename(getattr(constants, attr))))
+    constants.spool_dir = os.path.join(work_dir, 'spool')
+    constants.image_cache_dir = os.path.join(work_dir, 'image-cache')
+    return InsightsClient